@@ -0,0 +1,27 @@
+"""
+Settings for send worker processes (python -m email_sender.worker).
+
+Extends the regular settings but leaves out the apps and middleware that
+only serve the web UI (admin, sessions, messages, static files), and
+routes only the tracking URLs. A worker then never imports views, forms
+or admin modules, which makes it start faster and keeps its memory down.
+"""
+from .settings import *  # noqa: F401,F403
+
+INSTALLED_APPS = [
+    'django.contrib.auth',
+    'django.contrib.contenttypes',
+    'emails',
+]
+
+MIDDLEWARE = []
+
+ROOT_URLCONF = 'email_sender.worker_urls'
+
+TEMPLATES = [
+    {
+        'BACKEND': 'django.template.backends.django.DjangoTemplates',
+        'DIRS': [],
+        'APP_DIRS': False,
+    },
+]
@@ -0,0 +1,25 @@
+"""
+Lightweight entry point for send workers.
+
+    python -m email_sender.worker [send_worker options]
+
+Runs the send_worker command with email_sender.settings_worker, so the
+process loads the models and the send path but none of the web UI. Unlike
+`manage.py send_worker` it also skips the system checks (they import the
+auth views and migration autodetector); run `manage.py check` on deploy.
+"""
+import os
+import sys
+
+
+def main(argv=None):
+    os.environ.setdefault('DJANGO_SETTINGS_MODULE', 'email_sender.settings_worker')
+    import django
+    from django.core.management import call_command
+
+    django.setup()
+    call_command('send_worker', *(sys.argv[1:] if argv is None else argv))
+
+
+if __name__ == '__main__':
+    main()
@@ -0,0 +1,11 @@
+"""
+URLconf for send workers (see settings_worker).
+
+Workers only reverse the tracking URLs they put into emails. They are
+mounted at the same prefix as in email_sender/urls.py so the links match.
+"""
+from django.urls import include, path
+
+urlpatterns = [
+    path('', include('emails.tracking_urls')),
+]
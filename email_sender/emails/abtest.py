@@ -0,0 +1,157 @@
+import zlib
+import logging
+from collections import Counter
+from datetime import timedelta
+from django.db import transaction
+from django.db.models import F
+from django.utils import timezone
+from .models import Campaign, CampaignVariant, Delivery
+
+logger = logging.getLogger(__name__)
+
+VARIANT_LABELS = 'ABCDEFGHIJ'
+# Test buckets are hundredths of a percent
+BUCKETS = 10000
+DEFAULT_TEST_PERCENT = 20
+DEFAULT_TEST_WAIT_MINUTES = 240
+
+
+def variant_index(campaign_id, recipient_id, variant_count, test_percent):
+    """
+    Index of the variant a recipient is tested with, or None when they wait for the winner.
+
+    The split hashes (campaign, recipient) with crc32, so it is the same in
+    every process and on every retry, yet a recipient is not always in the
+    test group of every campaign.
+    """
+    bucket = zlib.crc32(f'{campaign_id}:{recipient_id}'.encode()) % BUCKETS
+    if bucket >= test_percent * BUCKETS // 100:
+        return None
+    return bucket % variant_count
+
+
+def winner_tracking(winner_metric):
+    """
+    Tracking options an A/B test choosing its winner by ``winner_metric`` needs.
+
+    Without open (or click) tracking every variant's rate stays 0 and the
+    first variant would always win, so the matching tracking is switched on
+    whatever the tracking settings say.
+    """
+    return {'track_opens': True} if winner_metric == 'opens' else {'track_clicks': True}
+
+
+def create_variants(campaign, variants):
+    """Create CampaignVariant rows for ``variants``, dicts with subject, body and optionally template"""
+    if len(variants) > len(VARIANT_LABELS):
+        raise ValueError(f"At most {len(VARIANT_LABELS)} variants can be tested")
+    return CampaignVariant.objects.bulk_create([
+        CampaignVariant(campaign=campaign, label=label, subject=variant['subject'], body=variant['body'],
+                        template=variant.get('template'))
+        for label, variant in zip(VARIANT_LABELS, variants)
+    ])
+
+
+def add_counts(counts):
+    """Add {(variant_id, counter): n} to the variant counters, e.g. {(3, 'sent'): 50}, with one UPDATE per pair"""
+    for (variant_id, counter), count in counts.items():
+        CampaignVariant.objects.filter(pk=variant_id).update(**{counter: F(counter) + count})
+
+
+def record_engagement(first_opens, first_clicks):
+    """
+    Count recipients' first opens and clicks towards the variant they were sent.
+
+    ``first_opens`` and ``first_clicks`` are sets of (campaign_id, recipient_id)
+    whose engagement just went from zero to one or more, so each recipient
+    counts once per variant no matter how often they open or click.
+    """
+    pairs = first_opens | first_clicks
+    campaign_ids = {campaign_id for campaign_id, _ in pairs if campaign_id}
+    if not campaign_ids:
+        return
+    variants = dict(
+        ((campaign_id, recipient_id), variant_id) for campaign_id, recipient_id, variant_id in
+        Delivery.objects.filter(
+            campaign_id__in=campaign_ids,
+            recipient_id__in={recipient_id for _, recipient_id in pairs},
+            variant__isnull=False,
+        ).values_list('campaign_id', 'recipient_id', 'variant_id')
+    )
+    if not variants:
+        return
+    counts = Counter()
+    for metric, keys in (('opens', first_opens), ('clicks', first_clicks)):
+        for key in keys:
+            if key in variants:
+                counts[(variants[key], metric)] += 1
+    add_counts(counts)
+
+
+def variant_results(campaign):
+    """Per-variant counters and the rate the winner is chosen by"""
+    results = []
+    for variant in campaign.variants.all():
+        metric = getattr(variant, campaign.winner_metric)
+        results.append({
+            'label': variant.label,
+            'subject': variant.subject,
+            'sent': variant.sent,
+            'failed': variant.failed,
+            'opens': variant.opens,
+            'clicks': variant.clicks,
+            'rate': round(metric / variant.sent, 4) if variant.sent else 0.0,
+            'is_winner': variant.is_winner,
+        })
+    return results
+
+
+def start_test_wait(campaign):
+    """
+    Move a campaign whose test emails are all sent to 'testing'.
+
+    The winner is chosen test_wait_minutes later, giving recipients time to
+    open and click. Returns False when the campaign has nothing held back.
+    """
+    if not campaign.deliveries.filter(status='held').exists():
+        return False
+    decide_at = timezone.now() + timedelta(minutes=campaign.test_wait_minutes)
+    if Campaign.objects.filter(pk=campaign.pk, status='running').update(status='testing', winner_decide_at=decide_at):
+        logger.info(f"Campaign {campaign.pk} test sent; choosing a winner at {decide_at:%Y-%m-%d %H:%M}")
+    return True
+
+
+def choose_winner(campaign):
+    """
+    Pick the best variant and release the held deliveries with it.
+
+    Held deliveries get the winning variant and become pending in one UPDATE;
+    the campaign goes back to 'running' for the send workers. Ties go to the
+    earlier variant. Returns the winner, or None when another process already
+    decided.
+    """
+    variants = list(campaign.variants.all())
+    if not variants:
+        return None
+
+    def rate(variant):
+        return getattr(variant, campaign.winner_metric) / variant.sent if variant.sent else 0.0
+
+    winner = max(variants, key=lambda variant: (rate(variant), -variants.index(variant)))
+    with transaction.atomic():
+        if not Campaign.objects.filter(pk=campaign.pk, status='testing').update(status='running'):
+            return None
+        CampaignVariant.objects.filter(pk=winner.pk).update(is_winner=True)
+        released = campaign.deliveries.filter(status='held').update(status='pending', variant=winner)
+    logger.info(f"Campaign {campaign.pk}: variant {winner.label} won with a {campaign.winner_metric} rate of "
+                f"{rate(winner):.1%}; sending it to the remaining {released} recipients")
+    return winner
+
+
+def decide_winners(now=None):
+    """Choose winners for campaigns whose test wait is over; returns how many were decided"""
+    decided = 0
+    for campaign in Campaign.objects.filter(status='testing', winner_decide_at__lte=now or timezone.now()):
+        if choose_winner(campaign) is not None:
+            decided += 1
+    return decided
@@ -1,33 +1,135 @@
 from django.contrib import admin
-from .models import Recipient, EmailTemplate, EmailLog, EmailCredential, EmailSettings
+from django.db.models import Q
+from .changelist import LargeTableAdmin
+from .models import Recipient, CustomField, EmailTemplate, EmailLog, EmailCredential, EmailSettings, Campaign, CampaignVariant, Delivery, ApiToken, StoredAttachment, CampaignAttachment, Engagement, TrackingEvent, Tenant, TenantUsage
+from .validation import normalize_email
+
+class TenantUsageInline(admin.TabularInline):
+    model = TenantUsage
+    extra = 0
+    ordering = ['-day']
+    readonly_fields = ['day', 'sent']
+    max_num = 0
+
+@admin.register(Tenant)
+class TenantAdmin(admin.ModelAdmin):
+    list_display = ['name', 'slug', 'daily_quota', 'weight', 'is_active', 'created_at']
+    list_filter = ['is_active']
+    search_fields = ['name', 'slug']
+    prepopulated_fields = {'slug': ['name']}
+    filter_horizontal = ['members']
+    inlines = [TenantUsageInline]
 
 @admin.register(Recipient)
-class RecipientAdmin(admin.ModelAdmin):
-    list_display = ['email', 'company', 'created_at']
-    list_filter = ['created_at']
-    search_fields = ['email', 'company']
+class RecipientAdmin(LargeTableAdmin):
+    list_display = ['email', 'company', 'email_check', 'bounce_count', 'is_suppressed', 'created_at']
+    list_filter = ['tenant', 'is_suppressed', 'email_check']
+    date_hierarchy = 'created_at'
+    search_fields = ['email']
+    search_help_text = 'Full address, or the start of one'
+
+    def get_search_results(self, request, queryset, search_term):
+        # Exact and prefix matches on the normalized address use its indexes;
+        # the default icontains search scans every row
+        term = search_term.strip()
+        if not term:
+            return queryset, False
+        if '@' in term:
+            return queryset.filter(email_normalized=normalize_email(term)), False
+        return queryset.filter(email_normalized__startswith=term.lower()), False
+
+@admin.register(CustomField)
+class CustomFieldAdmin(admin.ModelAdmin):
+    list_display = ['name', 'tenant', 'created_at']
+    list_filter = ['tenant']
+    search_fields = ['name']
 
 @admin.register(EmailTemplate)
 class EmailTemplateAdmin(admin.ModelAdmin):
-    list_display = ['name', 'subject', 'created_at', 'updated_at']
+    list_display = ['name', 'subject', 'tenant', 'variables', 'created_at', 'updated_at']
+    list_filter = ['tenant']
     search_fields = ['name', 'subject']
+    readonly_fields = ['variables']
 
 @admin.register(EmailLog)
-class EmailLogAdmin(admin.ModelAdmin):
+class EmailLogAdmin(LargeTableAdmin):
     list_display = ['recipient', 'subject', 'status', 'has_attachments', 'attachment_count', 'sent_at', 'created_at']
-    list_filter = ['status', 'has_attachments', 'created_at']
-    search_fields = ['recipient__email', 'subject']
+    list_filter = ['tenant', 'status', 'has_attachments']
+    list_select_related = ['recipient']
+    date_hierarchy = 'created_at'
+    search_fields = ['recipient__email', 'message_id']
+    search_help_text = 'Recipient address or <Message-ID>'
+    raw_id_fields = ['recipient', 'template', 'campaign']
     readonly_fields = ['created_at', 'sent_at']
 
+    def get_search_results(self, request, queryset, search_term):
+        term = search_term.strip()
+        if not term:
+            return queryset, False
+        if term.startswith('<'):
+            return queryset.filter(message_id=term), False
+        # Recipients migration 0016 could not normalize keep a NULL
+        # email_normalized and are matched on the address itself
+        return queryset.filter(
+            Q(recipient__email_normalized=normalize_email(term))
+            | Q(recipient__email_normalized__isnull=True, recipient__email__iexact=term)
+        ), False
+
+class CampaignAttachmentInline(admin.TabularInline):
+    model = CampaignAttachment
+    raw_id_fields = ['attachment']
+    extra = 0
+
+class CampaignVariantInline(admin.TabularInline):
+    model = CampaignVariant
+    fields = ['label', 'subject', 'sent', 'failed', 'opens', 'clicks', 'is_winner']
+    readonly_fields = ['sent', 'failed', 'opens', 'clicks', 'is_winner']
+    extra = 0
+
+@admin.register(Campaign)
+class CampaignAdmin(admin.ModelAdmin):
+    inlines = [CampaignVariantInline, CampaignAttachmentInline]
+    list_display = ['__str__', 'subject', 'tenant', 'status', 'priority', 'shard_count', 'shard_key', 'created_at', 'completed_at']
+    list_filter = ['tenant', 'status', 'priority']
+    search_fields = ['name', 'subject', 'idempotency_key']
+    readonly_fields = ['idempotency_key', 'winner_decide_at', 'created_at', 'started_at', 'completed_at']
+
+@admin.register(StoredAttachment)
+class StoredAttachmentAdmin(admin.ModelAdmin):
+    list_display = ['sha256', 'tenant', 'size', 'created_at']
+    list_filter = ['tenant']
+    search_fields = ['sha256']
+    readonly_fields = ['tenant', 'sha256', 'size', 'created_at']
+
+@admin.register(Engagement)
+class EngagementAdmin(admin.ModelAdmin):
+    list_display = ['recipient', 'campaign', 'opens', 'clicks', 'first_opened_at', 'last_event_at']
+    list_filter = ['campaign']
+    search_fields = ['recipient__email']
+    raw_id_fields = ['recipient', 'campaign']
+
+@admin.register(TrackingEvent)
+class TrackingEventAdmin(admin.ModelAdmin):
+    list_display = ['kind', 'campaign_id', 'recipient_id', 'url', 'created_at']
+    list_filter = ['kind']
+    raw_id_fields = ['recipient', 'campaign']
+
+@admin.register(Delivery)
+class DeliveryAdmin(admin.ModelAdmin):
+    list_display = ['campaign', 'recipient', 'shard', 'status', 'lease_owner', 'lease_expires_at', 'attempts']
+    list_filter = ['status']
+    list_select_related = ['campaign', 'recipient']
+    raw_id_fields = ['campaign', 'recipient']
+
 @admin.register(EmailCredential)
 class EmailCredentialAdmin(admin.ModelAdmin):
-    list_display = ['name', 'email_host_user', 'provider', 'is_active', 'created_at']
-    list_filter = ['provider', 'is_active', 'created_at']
+    list_display = ['name', 'email_host_user', 'tenant', 'provider', 'is_active', 'created_at']
+    list_filter = ['tenant', 'provider', 'is_active', 'created_at']
     search_fields = ['name', 'email_host_user', 'email_host']
     readonly_fields = ['created_at', 'updated_at']
     fieldsets = (
         ('Basic Information', {
-            'fields': ('name', 'provider', 'is_active')
+            'fields': ('tenant', 'name', 'provider', 'is_active')
         }),
         ('Email Configuration', {
             'fields': ('email_host_user', 'from_email', 'email_host', 'email_port')
@@ -68,4 +170,15 @@ class EmailSettingsAdmin(admin.ModelAdmin):
 
     def has_delete_permission(self, request, obj=None):
         # Don't allow deleting the settings
-        return False
\ No newline at end of file
+        return False
+
+
+@admin.register(ApiToken)
+class ApiTokenAdmin(admin.ModelAdmin):
+    list_display = ['name', 'prefix', 'tenant', 'is_active', 'created_at']
+    list_filter = ['tenant', 'is_active']
+    readonly_fields = ['key_hash', 'prefix', 'created_at']
+
+    def has_add_permission(self, request):
+        # Tokens are created with the create_api_token command so the raw key can be shown once
+        return False
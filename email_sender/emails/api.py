@@ -0,0 +1,592 @@
+import json
+import time
+import logging
+from functools import wraps
+from django.core.exceptions import ValidationError
+from django.core.validators import validate_email
+from django.db import IntegrityError, transaction
+from django.db.models import Count, Q, Sum, prefetch_related_objects
+from django.http import JsonResponse
+from django.template import TemplateSyntaxError
+from django.views.decorators.csrf import csrf_exempt
+from .models import ApiToken, Campaign, CustomField, Engagement, EmailTemplate, Recipient, StoredAttachment, Tenant
+from .abtest import DEFAULT_TEST_PERCENT, DEFAULT_TEST_WAIT_MINUTES, VARIANT_LABELS, variant_results, winner_tracking
+from .attachments import AttachmentRef, store_stream
+from .audience import AUDIENCE_CHOICES, AUDIENCE_SELECTED, resolve_audience
+from .dispatch import queue_depths
+from .sharding import get_or_create_campaign
+from .templating import custom_field_name, validate_template
+from .tenants import quota_status, release_quota, reserve_quota
+from .transactional import PoolExhausted, send_transactional, transactional_latency
+from .validation import REJECTED_STATUSES, check_emails, normalize_email
+
+logger = logging.getLogger(__name__)
+
+UPSERT_CHUNK = 1000
+MAX_ERRORS_REPORTED = 100
+
+# Verified token hashes are remembered briefly so hot clients cost no extra query
+TOKEN_CACHE_SECONDS = 60
+TOKEN_CACHE_SIZE = 1000
+_token_cache = {}
+# Campaign.weight is a PositiveSmallIntegerField
+MAX_WEIGHT = 32767
+
+
+class ApiError(Exception):
+    def __init__(self, message, status=400):
+        super().__init__(message)
+        self.status = status
+
+
+# JSON types of the optional fields of a send and of its variants
+SEND_FIELD_TYPES = {
+    'template_id': (int, 'an integer'),
+    'subject': (str, 'a string'),
+    'body': (str, 'a string'),
+    'name': (str, 'a string'),
+    'audience': (str, 'a string'),
+    'recipient_ids': (list, 'a list of integers'),
+    'emails': (list, 'a list of strings'),
+    'priority': (int, 'an integer'),
+    'weight': (int, 'an integer'),
+    'track_opens': (bool, 'true or false'),
+    'track_clicks': (bool, 'true or false'),
+    'attachments': (list, 'a list of objects'),
+}
+VARIANT_FIELD_TYPES = {field: SEND_FIELD_TYPES[field] for field in ('template_id', 'subject', 'body')}
+TRANSACTIONAL_FIELD_TYPES = {
+    'to': (str, 'a string'),
+    'subject': (str, 'a string'),
+    'body': (str, 'a string'),
+    'html_body': (str, 'a string'),
+    'context': (dict, 'an object'),
+    'from_email': (str, 'a string'),
+}
+
+
+def _check_types(payload, field_types, prefix=''):
+    """Raise ApiError for fields of ``payload`` that are present but of the wrong JSON type"""
+    for field, (expected, description) in field_types.items():
+        value = payload.get(field)
+        # bool is an int in Python, but true is not a valid id or priority
+        if value is not None and (not isinstance(value, expected) or (expected is int and isinstance(value, bool))):
+            raise ApiError(f'{prefix}{field} must be {description}')
+
+
+def _is_int(value):
+    return isinstance(value, int) and not isinstance(value, bool)
+
+
+def _authenticate(request):
+    """(token id, tenant id) of the request's bearer token"""
+    header = request.headers.get('Authorization', '')
+    scheme, _, raw_key = header.partition(' ')
+    if scheme.lower() not in ('bearer', 'token') or not raw_key:
+        raise ApiError('Missing or malformed Authorization header', status=401)
+
+    key_hash = ApiToken.hash_key(raw_key.strip())
+    cached = _token_cache.get(key_hash)
+    if cached and cached[1] > time.monotonic():
+        return cached[0]
+
+    token = ApiToken.objects.filter(
+        key_hash=key_hash, is_active=True, tenant__is_active=True,
+    ).values_list('pk', 'tenant_id').first()
+    if token is None:
+        raise ApiError('Invalid API token', status=401)
+    _remember_token(key_hash, token)
+    return token
+
+
+def _remember_token(key_hash, token):
+    """Cache a verified token, keeping at most TOKEN_CACHE_SIZE entries"""
+    now = time.monotonic()
+    if len(_token_cache) >= TOKEN_CACHE_SIZE:
+        for cached_hash, (_, expires) in list(_token_cache.items()):
+            if expires <= now:
+                _token_cache.pop(cached_hash, None)
+        # Dicts keep insertion order, so these are the oldest entries
+        for cached_hash in list(_token_cache)[:len(_token_cache) - TOKEN_CACHE_SIZE + 1]:
+            _token_cache.pop(cached_hash, None)
+    _token_cache[key_hash] = (token, now + TOKEN_CACHE_SECONDS)
+
+
+def _json_body(request):
+    try:
+        return json.loads(request.body or b'null')
+    except ValueError:
+        raise ApiError('Request body is not valid JSON')
+
+
+def api_view(methods):
+    """
+    Token authentication, method check and JSON error handling for API views.
+
+    Views see request.api_tenant_id, the tenant of the token, and only read or
+    create that tenant's rows.
+    """
+    def decorator(view):
+        @csrf_exempt
+        @wraps(view)
+        def wrapper(request, *args, **kwargs):
+            if request.method not in methods:
+                return JsonResponse({'error': f'Method {request.method} not allowed'}, status=405)
+            try:
+                request.api_token_id, request.api_tenant_id = _authenticate(request)
+                return view(request, *args, **kwargs)
+            except ApiError as e:
+                return JsonResponse({'error': str(e)}, status=e.status)
+        return wrapper
+    return decorator
+
+
+def _variants(payload, subject, body, template, custom_fields, tenant):
+    """A/B variants of a send (the send's own subject/body first) and the test options, or (None, {})"""
+    if not payload.get('variants'):
+        return None, {}
+    if not isinstance(payload['variants'], list):
+        raise ApiError('variants must be a list')
+    variants = [{'subject': subject, 'body': body, 'template': template}]
+    for number, item in enumerate(payload['variants'], start=2):
+        if not isinstance(item, dict):
+            raise ApiError('Each variant must be a JSON object')
+        _check_types(item, VARIANT_FIELD_TYPES, f'variant {number}: ')
+        variant_template = None
+        if item.get('template_id'):
+            variant_template = EmailTemplate.objects.for_tenant(tenant).filter(pk=item['template_id']).first()
+            if variant_template is None:
+                raise ApiError(f"Template {item['template_id']} does not exist", status=404)
+        variant = {
+            'subject': item.get('subject') or (variant_template.subject if variant_template else ''),
+            'body': item.get('body') or (variant_template.body if variant_template else ''),
+            'template': variant_template,
+        }
+        for field in ('subject', 'body'):
+            try:
+                validate_template(variant[field], custom_fields)
+            except ValidationError as e:
+                raise ApiError(f'Invalid {field} of variant {number}: {e.messages[0]}')
+        variants.append(variant)
+    if len(variants) > len(VARIANT_LABELS):
+        raise ApiError(f'At most {len(VARIANT_LABELS)} variants can be tested')
+
+    test_percent = payload.get('test_percent', DEFAULT_TEST_PERCENT)
+    if not isinstance(test_percent, int) or not 1 <= test_percent <= 100:
+        raise ApiError('test_percent must be an integer between 1 and 100')
+    winner_metric = payload.get('winner_metric', 'opens')
+    if winner_metric not in dict(Campaign.WINNER_METRIC_CHOICES):
+        raise ApiError(f"winner_metric must be one of {sorted(dict(Campaign.WINNER_METRIC_CHOICES))}")
+    test_wait_minutes = payload.get('test_wait_minutes', DEFAULT_TEST_WAIT_MINUTES)
+    if not isinstance(test_wait_minutes, int) or test_wait_minutes < 0:
+        raise ApiError('test_wait_minutes must be a non-negative integer')
+    # The winner is chosen by tracked opens or clicks, so that tracking cannot be turned off
+    tracking = winner_tracking(winner_metric)
+    for option in tracking:
+        if payload.get(option) is False:
+            raise ApiError(f'An A/B test with winner_metric "{winner_metric}" needs {option}')
+    return variants, {'test_percent': test_percent, 'winner_metric': winner_metric, 'test_wait_minutes': test_wait_minutes,
+                      **tracking}
+
+
+def _enqueue_send(payload, tenant, idempotency_key=None):
+    if not isinstance(payload, dict):
+        raise ApiError('Each send must be a JSON object')
+    _check_types(payload, SEND_FIELD_TYPES)
+
+    idempotency_key = payload.get('idempotency_key') or idempotency_key
+    if idempotency_key is not None and (not isinstance(idempotency_key, str) or len(idempotency_key) > 100):
+        raise ApiError('idempotency_key must be a string of at most 100 characters')
+
+    template = None
+    if payload.get('template_id'):
+        template = EmailTemplate.objects.for_tenant(tenant).filter(pk=payload['template_id']).first()
+        if template is None:
+            raise ApiError(f"Template {payload['template_id']} does not exist", status=404)
+
+    subject = payload.get('subject') or (template.subject if template else '')
+    body = payload.get('body') or (template.body if template else '')
+    if not subject or not body:
+        raise ApiError('Each send needs subject and body, or a template_id')
+    custom_fields = CustomField.names(tenant)
+    for field, text in (('subject', subject), ('body', body)):
+        try:
+            validate_template(text, custom_fields)
+        except ValidationError as e:
+            raise ApiError(f'Invalid {field}: {e.messages[0]}')
+    variants, ab_test = _variants(payload, subject, body, template, custom_fields, tenant)
+
+    unknown = []
+    audience = payload.get('audience', AUDIENCE_SELECTED)
+    if audience not in dict(AUDIENCE_CHOICES):
+        raise ApiError(f"audience must be one of {sorted(dict(AUDIENCE_CHOICES))}")
+    if audience != AUDIENCE_SELECTED:
+        if template is None:
+            raise ApiError(f'audience "{audience}" needs a template_id')
+        recipients = resolve_audience(audience, template)
+    elif payload.get('recipient_ids'):
+        if not all(_is_int(pk) for pk in payload['recipient_ids']):
+            raise ApiError('recipient_ids must be a list of integers')
+        recipients = Recipient.objects.for_tenant(tenant).filter(pk__in=payload['recipient_ids'])
+    elif payload.get('emails'):
+        if not all(isinstance(email, str) for email in payload['emails']):
+            raise ApiError('emails must be a list of strings')
+        emails = {normalize_email(email): email for email in payload['emails']}
+        recipients = Recipient.objects.for_tenant(tenant).filter(email_normalized__in=emails)
+        known = set(recipients.values_list('email_normalized', flat=True))
+        unknown = sorted(email for normalized, email in emails.items() if normalized not in known)
+    else:
+        raise ApiError('Each send needs recipient_ids, emails or an audience')
+
+    priority = payload.get('priority', Campaign.PRIORITY_BULK)
+    if priority not in dict(Campaign.PRIORITY_CHOICES):
+        raise ApiError(f"priority must be one of {sorted(dict(Campaign.PRIORITY_CHOICES))}")
+
+    weight = payload.get('weight')
+    weight = 1 if weight is None else weight
+    if not 1 <= weight <= MAX_WEIGHT:
+        raise ApiError(f'weight must be an integer between 1 and {MAX_WEIGHT}')
+
+    attachments = []
+    for item in payload.get('attachments') or []:
+        if not isinstance(item, dict) or not all(
+            isinstance(item.get(field) or '', str) for field in ('sha256', 'filename', 'content_type')
+        ):
+            raise ApiError('Each attachment must be an object with string sha256, filename and content_type')
+        # Only the tenant's own uploads, so other tenants' files can neither be sent nor probed for
+        stored = StoredAttachment.objects.for_tenant(tenant).filter(sha256=item.get('sha256', '')).first()
+        if stored is None:
+            raise ApiError(f"Attachment {item.get('sha256')} has not been uploaded", status=404)
+        attachments.append(AttachmentRef(stored, item.get('filename') or stored.sha256, item.get('content_type')))
+
+    tracking = {'track_opens': payload.get('track_opens'), 'track_clicks': payload.get('track_clicks'), **ab_test}
+    campaign, created = get_or_create_campaign(
+        idempotency_key, subject, body, recipients, template, name=payload.get('name') or '', priority=priority,
+        weight=weight, attachments=attachments, variants=variants, tenant=tenant, **tracking,
+    )
+    return {
+        'campaign_id': campaign.pk,
+        'status': campaign.status,
+        'deliveries': campaign.deliveries.count(),
+        'unknown_emails': unknown,
+        'duplicate': not created,
+    }
+
+
+@api_view(['POST'])
+def enqueue_sends(request):
+    """
+    Queue one campaign (JSON object) or several (JSON array) for the send workers.
+
+    Each send has subject/body or template_id, plus recipient_ids or emails,
+    or an audience instead: "new" for recipients added since the template was
+    last sent, "failed" for those it failed to reach. Optionally it has a
+    priority lane (0 = transactional, 5 = normal, 10 = bulk) and a weight
+    relative to other campaigns in the same lane. Attachments are
+    referenced as {"sha256", "filename", "content_type"} after uploading them
+    to /api/attachments/. track_opens/track_clicks override the tracking settings.
+
+    An idempotency_key (or an Idempotency-Key header for a single send) makes
+    retries safe: a repeated key returns the existing campaign with
+    "duplicate": true instead of queueing its recipients again. An array of
+    sends is queued in one transaction, so when one of them is rejected none
+    are queued.
+
+    "variants" (a list of {"subject", "body"} or {"template_id"}) makes the
+    send an A/B test against its own subject/body, sent to test_percent of the
+    recipients; after test_wait_minutes the variant with the best
+    winner_metric ("opens" or "clicks") is sent to the rest.
+    """
+    payload = _json_body(request)
+    tenant = Tenant.objects.get(pk=request.api_tenant_id)
+    if isinstance(payload, list):
+        # All or nothing: an invalid send rolls back the campaigns queued before it
+        with transaction.atomic():
+            campaigns = [_enqueue_send(item, tenant) for item in payload]
+        return JsonResponse({'campaigns': campaigns}, status=202)
+    return JsonResponse(_enqueue_send(payload, tenant, request.headers.get('Idempotency-Key')), status=202)
+
+
+def _iter_recipient_rows(request):
+    """Yield (line number, row) pairs from an NDJSON stream or a JSON array body"""
+    if request.content_type == 'application/x-ndjson':
+        # Read line by line so large uploads are never parsed in one piece
+        for line_number, line in enumerate(request, start=1):
+            line = line.strip()
+            if not line:
+                continue
+            try:
+                yield line_number, json.loads(line)
+            except ValueError:
+                yield line_number, None
+    else:
+        rows = _json_body(request)
+        if not isinstance(rows, list):
+            raise ApiError('Expected a JSON array of recipients or an application/x-ndjson body')
+        yield from enumerate(rows, start=1)
+
+
+def _upsert_error(results, line_number, error):
+    results['failed'] += 1
+    if len(results['errors']) < MAX_ERRORS_REPORTED:
+        results['errors'].append(f"line {line_number}: {error}")
+
+
+def _custom_fields(value):
+    """Custom fields of an upserted row as {field name: text}, or None when the row has none"""
+    if value is None:
+        return None
+    if not isinstance(value, dict):
+        raise ValueError('custom_fields must be an object')
+    fields = {}
+    for key, text in value.items():
+        name = custom_field_name(key)
+        if name is None:
+            raise ValueError(f'"{key}" cannot be used as a custom field name')
+        if text not in (None, ''):
+            fields[name] = str(text).strip()
+    return fields
+
+
+def _adopt_legacy_recipients(recipients, tenant_id):
+    """
+    Fill in email_normalized for rows with the same address that predate normalization.
+
+    Migration 0016 left it NULL on some rows; such a row still holds the
+    (tenant, email) constraint, so the upsert would conflict on it instead of
+    updating it. Rows whose normalized address is already taken keep NULL.
+    """
+    legacy = Recipient.objects.for_tenant(tenant_id).filter(
+        email_normalized__isnull=True, email__in=[recipient.email for recipient in recipients],
+    ).values_list('pk', 'email')
+    for pk, email in legacy:
+        try:
+            with transaction.atomic():
+                Recipient.objects.filter(pk=pk).update(email_normalized=normalize_email(email))
+        except IntegrityError:
+            continue
+
+
+def _bulk_upsert(recipients, update_fields):
+    Recipient.objects.bulk_create(
+        recipients,
+        update_conflicts=True,
+        unique_fields=['tenant', 'email_normalized'],
+        update_fields=update_fields,
+    )
+
+
+def _upsert_chunk(rows, results, tenant_id):
+    """Validate a chunk of (line number, email, company, custom fields) rows in one batch and upsert the valid ones"""
+    chunk = {}
+    for (line_number, email, company, custom_fields), check in zip(rows, check_emails([row[1] for row in rows])):
+        if check.status in REJECTED_STATUSES:
+            _upsert_error(results, line_number, check.reason)
+            continue
+        # Later rows for the same address win, as they would with sequential upserts
+        chunk[check.normalized] = (line_number, Recipient(
+            tenant_id=tenant_id, email=check.email, email_normalized=check.normalized, email_check=check.status,
+            company=company, custom_fields=custom_fields or {},
+        ), custom_fields is not None)
+    if not chunk:
+        return
+    _adopt_legacy_recipients([recipient for _, recipient, _ in chunk.values()], tenant_id)
+    CustomField.register(set().union(*(recipient.custom_fields for _, recipient, _ in chunk.values())), tenant_id)
+
+    # Rows without custom_fields keep the ones stored on the recipient
+    for with_fields in (True, False):
+        rows = [(line_number, recipient) for line_number, recipient, has_fields in chunk.values() if has_fields == with_fields]
+        if not rows:
+            continue
+        update_fields = ['company', 'email_check', 'custom_fields'] if with_fields else ['company', 'email_check']
+        try:
+            with transaction.atomic():
+                _bulk_upsert([recipient for _, recipient in rows], update_fields)
+            results['upserted'] += len(rows)
+        except IntegrityError:
+            # A duplicate left without email_normalized holds one of the addresses: find it row by row
+            for line_number, recipient in rows:
+                try:
+                    with transaction.atomic():
+                        _bulk_upsert([recipient], update_fields)
+                    results['upserted'] += 1
+                except IntegrityError:
+                    _upsert_error(results, line_number, f"{recipient.email} conflicts with an existing recipient")
+
+
+@api_view(['POST'])
+def bulk_upsert_recipients(request):
+    """
+    Insert or update the token's tenant's recipients by normalized email, in chunks of one multi-row statement each.
+
+    Rows are {"email", "company", "custom_fields"}; custom_fields replaces the
+    recipient's custom fields, and rows without it leave them unchanged.
+    """
+    results = {'upserted': 0, 'failed': 0, 'errors': []}
+    chunk = []
+
+    for line_number, row in _iter_recipient_rows(request):
+        if not isinstance(row, dict):
+            _upsert_error(results, line_number, 'not a JSON object')
+            continue
+        try:
+            custom_fields = _custom_fields(row.get('custom_fields'))
+        except ValueError as e:
+            _upsert_error(results, line_number, str(e))
+            continue
+
+        chunk.append((
+            line_number, str(row.get('email', '')).strip(), str(row.get('company', ''))[:200], custom_fields,
+        ))
+        if len(chunk) >= UPSERT_CHUNK:
+            _upsert_chunk(chunk, results, request.api_tenant_id)
+            chunk = []
+
+    if chunk:
+        _upsert_chunk(chunk, results, request.api_tenant_id)
+
+    return JsonResponse(results)
+
+
+def _campaign_status(campaigns):
+    """Status and delivery counts for campaigns, using one grouped query"""
+    counts = (
+        Campaign.objects.filter(pk__in=[campaign.pk for campaign in campaigns])
+        .annotate(
+            total=Count('deliveries'),
+            pending=Count('deliveries', filter=Q(deliveries__status='pending')),
+            sent=Count('deliveries', filter=Q(deliveries__status='sent')),
+            failed=Count('deliveries', filter=Q(deliveries__status='failed')),
+            held=Count('deliveries', filter=Q(deliveries__status='held')),
+        )
+        .values('pk', 'total', 'pending', 'sent', 'failed', 'held')
+    )
+    counts = {row['pk']: row for row in counts}
+    engagement = (
+        Engagement.objects.filter(campaign__in=campaigns)
+        .values('campaign')
+        .annotate(
+            total_opens=Sum('opens'),
+            unique_opens=Count('pk', filter=Q(opens__gt=0)),
+            total_clicks=Sum('clicks'),
+            unique_clicks=Count('pk', filter=Q(clicks__gt=0)),
+        )
+    )
+    engagement = {
+        row['campaign']: {
+            'opens': row['total_opens'], 'unique_opens': row['unique_opens'],
+            'clicks': row['total_clicks'], 'unique_clicks': row['unique_clicks'],
+        }
+        for row in engagement
+    }
+    no_engagement = {'opens': 0, 'unique_opens': 0, 'clicks': 0, 'unique_clicks': 0}
+    prefetch_related_objects(campaigns, 'variants')
+    return [
+        {
+            'campaign_id': campaign.pk,
+            'name': campaign.name,
+            'status': campaign.status,
+            'created_at': campaign.created_at.isoformat(),
+            'started_at': campaign.started_at.isoformat() if campaign.started_at else None,
+            'completed_at': campaign.completed_at.isoformat() if campaign.completed_at else None,
+            'deliveries': {key: counts[campaign.pk][key] for key in ('total', 'pending', 'sent', 'failed', 'held')},
+            'engagement': engagement.get(campaign.pk, no_engagement),
+            'variants': variant_results(campaign),
+        }
+        for campaign in campaigns
+    ]
+
+
+@api_view(['GET'])
+def campaign_status(request, pk):
+    campaign = Campaign.objects.for_tenant(request.api_tenant_id).filter(pk=pk).first()
+    if campaign is None:
+        raise ApiError(f'Campaign {pk} does not exist', status=404)
+    return JsonResponse(_campaign_status([campaign])[0])
+
+
+@api_view(['GET'])
+def campaign_status_batch(request):
+    """Status of several campaigns at once: /api/campaigns/?ids=1,2,3"""
+    try:
+        ids = [int(value) for value in request.GET.get('ids', '').split(',') if value]
+    except ValueError:
+        raise ApiError('ids must be a comma separated list of integers')
+    if not ids:
+        raise ApiError('ids is required')
+    campaigns = list(Campaign.objects.for_tenant(request.api_tenant_id).filter(pk__in=ids))
+    return JsonResponse({'campaigns': _campaign_status(campaigns)})
+
+
+@api_view(['POST'])
+def transactional_send(request):
+    """
+    Send one message immediately over the tenant's pooled SMTP connection.
+
+    Body: {"to", "subject", "body", optional "html_body", "context", "from_email"}.
+    Counts against the tenant's daily quota; over quota the answer is 429.
+    Failed sends do not count. When every pooled connection stays busy the
+    answer is 503 and the request can be retried.
+    """
+    payload = _json_body(request)
+    if not isinstance(payload, dict):
+        raise ApiError('Expected a JSON object')
+    _check_types(payload, TRANSACTIONAL_FIELD_TYPES)
+    try:
+        validate_email(payload.get('to') or '')
+    except ValidationError:
+        raise ApiError('to must be a valid email address')
+    if not payload.get('subject') or not payload.get('body'):
+        raise ApiError('subject and body are required')
+
+    tenant = Tenant.objects.get(pk=request.api_tenant_id)
+    if not reserve_quota(tenant, 1):
+        raise ApiError('Daily sending quota exceeded', status=429)
+
+    started = time.perf_counter()
+    try:
+        send_transactional(
+            payload['to'], payload['subject'], payload['body'],
+            html_body=payload.get('html_body'),
+            context=payload.get('context'),
+            from_email=payload.get('from_email'),
+            tenant_id=tenant.pk,
+        )
+    except TemplateSyntaxError as e:
+        release_quota(tenant, 1)
+        raise ApiError(f'Template syntax error: {str(e)}')
+    except PoolExhausted as e:
+        release_quota(tenant, 1)
+        logger.warning(f"Transactional send to {payload['to']} not attempted: {str(e)}")
+        raise ApiError('SMTP connection pool exhausted, retry later', status=503)
+    except Exception as e:
+        # Nothing was sent, so the reserved quota is given back
+        release_quota(tenant, 1)
+        logger.error(f"Transactional send to {payload['to']} failed: {str(e)}")
+        raise ApiError(f'Send failed: {str(e)}', status=502)
+    return JsonResponse({'status': 'sent', 'latency_ms': round((time.perf_counter() - started) * 1000, 2)})
+
+
+@api_view(['GET'])
+def transactional_metrics(request):
+    """Latency histogram of transactional sends handled by this process"""
+    return JsonResponse(transactional_latency.snapshot())
+
+
+@api_view(['GET'])
+def queue_status(request):
+    """Pending deliveries and oldest wait per priority lane, and today's quota usage, of the token's tenant"""
+    tenant = Tenant.objects.get(pk=request.api_tenant_id)
+    return JsonResponse({'lanes': queue_depths(tenant), 'quota': quota_status(tenant)})
+
+
+@api_view(['POST'])
+def upload_attachment(request):
+    """
+    Stream the raw request body into the attachment store: /api/attachments/?filename=report.pdf
+
+    Identical content is stored once; the returned sha256 can be reused by any number of the
+    token's tenant's sends.
+    """
+    ref = store_stream(request, request.GET.get('filename', 'attachment'), request.content_type, request.api_tenant_id)
+    return JsonResponse({'sha256': ref.stored.sha256, 'size': ref.stored.size}, status=201)
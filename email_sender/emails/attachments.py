@@ -0,0 +1,121 @@
+import base64
+import hashlib
+import mmap
+import os
+import tempfile
+import logging
+from pathlib import Path
+from django.conf import settings
+from django.db import IntegrityError
+from .models import StoredAttachment, Tenant
+
+logger = logging.getLogger(__name__)
+
+READ_CHUNK = 1024 * 1024
+# 57 raw bytes encode to exactly one 76 character base64 line
+ENCODE_CHUNK = 57 * 16 * 1024
+
+
+class AttachmentRef:
+    """
+    A stored attachment with the filename and content type to send it under.
+
+    MessageFactory uses open_encoded() to reference the pre-encoded base64 file
+    from every message through a read-only mmap, which the SMTP backend writes
+    to the socket, so large attachments are served from the page cache instead
+    of being copied into each worker's heap.
+    """
+
+    def __init__(self, stored, name, content_type='application/octet-stream'):
+        self.stored = stored
+        self.name = name
+        self.content_type = content_type or 'application/octet-stream'
+
+    @property
+    def size(self):
+        return self.stored.size
+
+    def open_encoded(self):
+        path = ensure_encoded(self.stored)
+        with open(path, 'rb') as encoded:
+            if os.fstat(encoded.fileno()).st_size == 0:
+                return b''
+            return mmap.mmap(encoded.fileno(), 0, access=mmap.ACCESS_READ)
+
+
+def _store_root():
+    root = Path(settings.ATTACHMENT_STORE_ROOT)
+    (root / 'tmp').mkdir(parents=True, exist_ok=True)
+    return root
+
+
+def store_chunks(chunks, tenant_id=None):
+    """
+    Stream ``chunks`` (an iterable of bytes) into the store and return its StoredAttachment.
+
+    Content is hashed while it is written to a temporary file, which is then
+    moved into place, or discarded when identical content is already stored.
+    The StoredAttachment belongs to ``tenant_id`` (the default tenant when
+    omitted), even when another tenant stored the same content first.
+    """
+    tenant_id = tenant_id or Tenant.default_id()
+    root = _store_root()
+    digest = hashlib.sha256()
+    size = 0
+    with tempfile.NamedTemporaryFile(dir=root / 'tmp', delete=False) as temp:
+        for chunk in chunks:
+            digest.update(chunk)
+            size += len(chunk)
+            temp.write(chunk)
+    sha256 = digest.hexdigest()
+
+    existing = StoredAttachment.objects.for_tenant(tenant_id).filter(sha256=sha256).first()
+    attachment = existing or StoredAttachment(tenant_id=tenant_id, sha256=sha256, size=size)
+    if attachment.path.exists():
+        os.unlink(temp.name)
+        if existing:
+            return existing
+    else:
+        attachment.path.parent.mkdir(parents=True, exist_ok=True)
+        os.replace(temp.name, attachment.path)
+    if existing is None:
+        try:
+            attachment.save()
+        except IntegrityError:
+            # Another process stored the same content for this tenant concurrently
+            attachment = StoredAttachment.objects.for_tenant(tenant_id).get(sha256=sha256)
+    logger.info(f"Stored attachment {sha256} ({size} bytes)")
+    return attachment
+
+
+def store_upload(uploaded_file, tenant_id=None):
+    """Store a Django UploadedFile for ``tenant_id`` and return an AttachmentRef for sending it"""
+    stored = store_chunks(uploaded_file.chunks(), tenant_id)
+    return AttachmentRef(stored, uploaded_file.name, uploaded_file.content_type)
+
+
+def store_stream(stream, name, content_type=None, tenant_id=None):
+    """Store the contents of a readable binary stream (e.g. an API request body) for ``tenant_id``"""
+    stored = store_chunks(iter(lambda: stream.read(READ_CHUNK), b''), tenant_id)
+    return AttachmentRef(stored, name, content_type)
+
+
+def ensure_encoded(stored):
+    """Create the base64 copy of a stored attachment if it does not exist yet"""
+    path = stored.encoded_path
+    if path.exists():
+        return path
+
+    fd, temp_name = tempfile.mkstemp(dir=_store_root() / 'tmp')
+    with open(stored.path, 'rb') as source, os.fdopen(fd, 'wb') as target:
+        for chunk in iter(lambda: source.read(ENCODE_CHUNK), b''):
+            target.write(base64.encodebytes(chunk).replace(b'\n', b'\r\n'))
+    os.replace(temp_name, path)
+    return path
+
+
+def campaign_attachment_refs(campaign):
+    return [
+        AttachmentRef(use.attachment, use.filename, use.content_type)
+        for use in campaign.attachments.select_related('attachment')
+    ]
@@ -0,0 +1,74 @@
+import logging
+from django.db.models import Exists, Max, OuterRef
+from .models import Campaign, EmailLog, Recipient
+
+logger = logging.getLogger(__name__)
+
+AUDIENCE_SELECTED = 'selected'
+AUDIENCE_NEW = 'new'
+AUDIENCE_FAILED = 'failed'
+AUDIENCE_CHOICES = [
+    (AUDIENCE_SELECTED, 'Selected recipients'),
+    (AUDIENCE_NEW, 'Recipients added since the last send of the template'),
+    (AUDIENCE_FAILED, 'Recipients the template failed to reach'),
+]
+
+
+def _template_logs(template, status):
+    """EmailLog rows of ``template`` with ``status`` for the outer query's recipient"""
+    return EmailLog.objects.filter(recipient=OuterRef('pk'), template=template, status=status)
+
+
+def last_send_at(template):
+    """
+    When ``template`` was last sent, or None when it never was.
+
+    This is the creation time of its latest campaign that was not cancelled:
+    a campaign's recipients are resolved when it is created, so anyone added
+    later cannot be part of it, however long it takes to deliver.
+    """
+    return (
+        Campaign.objects.filter(tenant_id=template.tenant_id, template=template)
+        .exclude(status='cancelled')
+        .aggregate(last=Max('created_at'))['last']
+    )
+
+
+def new_recipients(template):
+    """
+    Recipients added since ``template`` was last sent and not sent it yet.
+
+    Resolved in the database: a range scan on (tenant, created_at) and a NOT
+    EXISTS anti-join against the template's sent logs, which also keeps out
+    recipients reached by other sends of the template. Before the first send
+    of the template this is everyone who has not received it.
+    """
+    recipients = Recipient.objects.for_tenant(template.tenant_id).filter(is_suppressed=False)
+    since = last_send_at(template)
+    if since is not None:
+        recipients = recipients.filter(created_at__gt=since)
+    return recipients.filter(~Exists(_template_logs(template, 'sent')))
+
+
+def failed_recipients(template):
+    """
+    Recipients ``template`` failed to reach and that have not received it since.
+
+    Driven from the template's failed logs (an IN subquery) with a NOT
+    EXISTS anti-join against its sent ones, both on the (template, status,
+    recipient) index of EmailLog, so neither the logs nor the tenant's other
+    recipients are read. Suppressed (hard bounced) addresses are left out.
+    """
+    failed = EmailLog.objects.filter(template=template, status='failed').values('recipient_id')
+    return Recipient.objects.for_tenant(template.tenant_id).filter(
+        pk__in=failed, is_suppressed=False,
+    ).filter(~Exists(_template_logs(template, 'sent')))
+
+
+def resolve_audience(audience, template):
+    """Recipients of a delta ``audience`` (AUDIENCE_NEW or AUDIENCE_FAILED) of ``template``"""
+    if audience == AUDIENCE_NEW:
+        return new_recipients(template)
+    if audience == AUDIENCE_FAILED:
+        return failed_recipients(template)
+    raise ValueError(f"Unknown audience {audience!r}")
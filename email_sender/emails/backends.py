@@ -0,0 +1,103 @@
+import re
+import smtplib
+from django.conf import settings
+from django.core.mail.backends.smtp import EmailBackend as SMTPEmailBackend
+from django.core.mail.message import sanitize_address
+
+CRLF = b'\r\n'
+# A line starting with '.' is sent as '..' so it cannot end the DATA section (RFC 5321 4.5.2)
+LEADING_DOT = re.compile(rb'^\.', re.MULTILINE)
+
+
+def _raise_for(smtp, code, error):
+    if code == 421:
+        smtp.close()
+    else:
+        smtp._rset()
+    raise error
+
+
+def send_segments(smtp, from_email, recipients, segments):
+    """
+    Send a message given as a list of byte segments over an open smtplib.SMTP.
+
+    Does what SMTP.sendmail does, except that the DATA section is written
+    segment by segment instead of as one bytes object: segments that are
+    memoryviews of mmapped attachments go to the socket as they are, so their
+    pages are never copied onto the heap. Only the bytes segments are
+    dot-stuffed; mapped segments hold base64, whose lines never start with
+    '.'. Segments must use CRLF line endings.
+
+    Returns the refused recipients like sendmail does.
+    """
+    smtp.ehlo_or_helo_if_needed()
+    options = []
+    if smtp.does_esmtp and smtp.has_extn('size'):
+        options.append(f'size={sum(len(segment) for segment in segments)}')
+    code, response = smtp.mail(from_email, options)
+    if code != 250:
+        _raise_for(smtp, code, smtplib.SMTPSenderRefused(code, response, from_email))
+
+    refused = {}
+    for recipient in recipients:
+        code, response = smtp.rcpt(recipient)
+        if code not in (250, 251):
+            refused[recipient] = (code, response)
+        if code == 421:
+            smtp.close()
+            raise smtplib.SMTPRecipientsRefused(refused)
+    if len(refused) == len(recipients):
+        smtp._rset()
+        raise smtplib.SMTPRecipientsRefused(refused)
+
+    smtp.putcmd('data')
+    code, response = smtp.getreply()
+    if code != 354:
+        raise smtplib.SMTPDataError(code, response)
+    line_start = True
+    last = CRLF
+    for segment in segments:
+        if not segment:
+            continue
+        if isinstance(segment, bytes):
+            stuffed = LEADING_DOT.sub(b'..', segment)
+            if not line_start and segment[:1] == b'.':
+                # The match at the segment start is mid-line in the message
+                stuffed = stuffed[1:]
+            segment = stuffed
+        smtp.send(segment)
+        last = (last + bytes(segment[-2:]))[-2:]
+        line_start = last[-1:] == b'\n'
+    smtp.send(b'.' + CRLF if last == CRLF else CRLF + b'.' + CRLF)
+    code, response = smtp.getreply()
+    if code != 250:
+        _raise_for(smtp, code, smtplib.SMTPDataError(code, response))
+    return refused
+
+
+class EmailBackend(SMTPEmailBackend):
+    """
+    Django's SMTP backend, streaming messages built by a MessageFactory.
+
+    Those messages carry their wire format as segments (see
+    PrebuiltEmailMessage); they are written to the socket with
+    send_segments() rather than joined into one bytes object first. Any
+    other message is sent by Django's backend unchanged.
+    """
+
+    def _send(self, email_message):
+        segments = getattr(email_message, 'segments', None)
+        if segments is None:
+            return super()._send(email_message)
+        if not email_message.recipients():
+            return False
+        encoding = email_message.encoding or settings.DEFAULT_CHARSET
+        from_email = sanitize_address(email_message.from_email, encoding)
+        recipients = [sanitize_address(address, encoding) for address in email_message.recipients()]
+        try:
+            send_segments(self.connection, from_email, recipients, segments)
+        except smtplib.SMTPException:
+            if not self.fail_silently:
+                raise
+            return False
+        return True
@@ -0,0 +1,275 @@
+import email
+import re
+import logging
+from collections import Counter, namedtuple
+from django.conf import settings
+from django.db import connections, router, transaction
+from django.db.models import F, Max
+from django.utils import timezone
+from .models import EmailLog, Recipient
+from .validation import normalize_email
+
+logger = logging.getLogger(__name__)
+
+Bounce = namedtuple('Bounce', ['message_id', 'recipient', 'status', 'diagnostic', 'hard'])
+
+BOUNCE_CHUNK = 1000
+# Headers a receiving server may use to tell us which address the DSN was sent to
+VERP_HEADERS = ('X-Original-To', 'Delivered-To', 'To')
+
+
+def verp_address(recipient_email):
+    """
+    Envelope sender encoding the recipient, e.g. bounces+jane=example.com@ours.com.
+
+    Returns None when BOUNCE_ADDRESS is not configured, so the From address is used.
+    """
+    bounce_address = getattr(settings, 'BOUNCE_ADDRESS', '')
+    if not bounce_address:
+        return None
+    local, _, domain = bounce_address.rpartition('@')
+    return f"{local}+{recipient_email.replace('@', '=')}@{domain}"
+
+
+def _verp_pattern():
+    local, _, domain = getattr(settings, 'BOUNCE_ADDRESS', '').rpartition('@')
+    if not local:
+        return None
+    return re.compile(rf'{re.escape(local)}\+([^@\s<>]+)=([^=@\s<>]+)@{re.escape(domain)}', re.IGNORECASE)
+
+
+def _normalize_message_id(value):
+    value = (value or '').strip()
+    if value and not value.startswith('<'):
+        value = f'<{value}>'
+    return value
+
+
+def parse_dsn(raw, verp_pattern=None):
+    """
+    Return a Bounce for each failed recipient in a delivery status notification.
+
+    Non-DSN messages and delayed/relayed notices yield an empty list. The
+    Message-ID is taken from the returned original headers; the recipient from
+    the VERP address the DSN was delivered to, or its Final-Recipient field.
+    """
+    message = email.message_from_bytes(raw)
+    status_part = original = None
+    for part in message.walk():
+        content_type = part.get_content_type()
+        if content_type == 'message/delivery-status':
+            status_part = part
+        elif content_type in ('text/rfc822-headers', 'message/rfc822') and original is None:
+            original = part
+    if status_part is None:
+        return []
+
+    message_id = ''
+    if original is not None:
+        if original.get_content_type() == 'message/rfc822':
+            headers = original.get_payload(0)
+        else:
+            headers = email.message_from_bytes(original.get_payload(decode=True) or b'')
+        message_id = _normalize_message_id(headers.get('Message-ID'))
+
+    verp_recipient = ''
+    if verp_pattern is not None:
+        for header in VERP_HEADERS:
+            match = verp_pattern.search(message.get(header, ''))
+            if match:
+                verp_recipient = f'{match.group(1)}@{match.group(2)}'.lower()
+                break
+
+    bounces = []
+    # The first block holds per-message fields, the rest one block per recipient
+    for block in status_part.get_payload()[1:]:
+        if (block.get('Action') or '').strip().lower() != 'failed':
+            continue
+        status = (block.get('Status') or '').strip()
+        final_recipient = (block.get('Final-Recipient') or block.get('Original-Recipient') or '').partition(';')[2]
+        diagnostic = ' '.join((block.get('Diagnostic-Code') or '').partition(';')[2].split())
+        bounces.append(Bounce(
+            message_id,
+            verp_recipient or final_recipient.strip().lower(),
+            status,
+            diagnostic or f'Bounced with status {status}',
+            status.startswith('5'),
+        ))
+    return bounces
+
+
+class MailboxSource:
+    """DSNs from a local mbox file or Maildir directory"""
+
+    def __init__(self, path, maildir=False):
+        # Imported here: senders import this module for verp_address only
+        import mailbox
+
+        if maildir:
+            self.box = mailbox.Maildir(path, factory=None, create=False)
+        else:
+            self.box = mailbox.mbox(path, factory=None, create=False)
+        self.processed = []
+
+    def __iter__(self):
+        for key in self.box.iterkeys():
+            yield key, self.box.get_bytes(key)
+
+    def remove(self, keys):
+        self.processed.extend(keys)
+
+    def close(self):
+        # Deleting from an mbox rewrites the file, so it is done once at the end
+        if self.processed:
+            self.box.lock()
+            try:
+                for key in self.processed:
+                    self.box.discard(key)
+                self.box.flush()
+            finally:
+                self.box.unlock()
+        self.box.close()
+
+
+class ImapSource:
+    """DSNs from an IMAP folder, fetched in batches of ``batch_size`` messages"""
+
+    def __init__(self, host, username, password, folder='INBOX', port=None, use_ssl=True, batch_size=500):
+        import imaplib
+
+        imap_class = imaplib.IMAP4_SSL if use_ssl else imaplib.IMAP4
+        self.imap = imap_class(host, port or (993 if use_ssl else 143))
+        self.imap.login(username, password)
+        self.imap.select(folder)
+        self.batch_size = batch_size
+        self.processed = []
+
+    def __iter__(self):
+        _, data = self.imap.uid('search', None, 'ALL')
+        uids = data[0].split()
+        for start in range(0, len(uids), self.batch_size):
+            _, data = self.imap.uid('fetch', b','.join(uids[start:start + self.batch_size]), '(RFC822)')
+            for item in data:
+                if isinstance(item, tuple):
+                    uid = re.search(rb'UID (\d+)', item[0]).group(1)
+                    yield uid, item[1]
+
+    def remove(self, keys):
+        self.processed.extend(keys)
+
+    def close(self):
+        for start in range(0, len(self.processed), self.batch_size):
+            self.imap.uid('store', b','.join(self.processed[start:start + self.batch_size]), '+FLAGS', r'(\Deleted)')
+        if self.processed:
+            self.imap.expunge()
+        self.imap.logout()
+
+
+def _apply_bounces(bounces, results):
+    """Match one chunk of bounces to EmailLog rows and update logs and recipients in bulk"""
+    by_message_id = {bounce.message_id: bounce for bounce in bounces if bounce.message_id}
+    matched = {}
+    for pk, message_id, recipient_id, status in EmailLog.objects.filter(
+        message_id__in=by_message_id
+    ).values_list('pk', 'message_id', 'recipient_id', 'status'):
+        matched[pk] = (by_message_id.pop(message_id), recipient_id, status)
+
+    # Without a known Message-ID, fall back to the latest sent email of the (VERP) recipient.
+    # The same address can be a recipient of several tenants; the latest email to it wins.
+    by_email = {normalize_email(bounce.recipient): bounce for bounce in bounces if bounce.recipient and (
+        not bounce.message_id or bounce.message_id in by_message_id
+    )}
+    if by_email:
+        latest = {
+            row['latest']: row['recipient__email_normalized'] for row in
+            EmailLog.objects.filter(recipient__email_normalized__in=by_email, status__in=['sent', 'bounced'])
+            .values('recipient__email_normalized')
+            .annotate(latest=Max('pk'))
+        }
+        for pk, recipient_id, status in EmailLog.objects.filter(pk__in=latest).values_list('pk', 'recipient_id', 'status'):
+            if pk not in matched:
+                matched[pk] = (by_email.pop(latest[pk]), recipient_id, status)
+    results['unmatched'] += len(bounces) - len(matched)
+
+    logs = []
+    recipients = Counter()
+    hard = set()
+    for pk, (bounce, recipient_id, status) in matched.items():
+        if status == 'bounced':
+            # Reprocessing the same mailbox must not count a bounce twice
+            results['already_bounced'] += 1
+            continue
+        logs.append(('bounced', bounce.diagnostic[:1000], pk))
+        recipients[recipient_id] += 1
+        if bounce.hard:
+            hard.add(recipient_id)
+
+    now = timezone.now()
+    connection = connections[router.db_for_write(EmailLog)]
+    with transaction.atomic(using=connection.alias):
+        # A parameterized executemany is far cheaper than bulk_update's CASE expression
+        # when every row gets its own diagnostic
+        with connection.cursor() as cursor:
+            table, status, error_message, pk = (connection.ops.quote_name(name) for name in (
+                EmailLog._meta.db_table,
+                EmailLog._meta.get_field('status').column,
+                EmailLog._meta.get_field('error_message').column,
+                EmailLog._meta.pk.column,
+            ))
+            cursor.executemany(f"UPDATE {table} SET {status} = %s, {error_message} = %s WHERE {pk} = %s", logs)
+        # One UPDATE per distinct (bounce count, hard) pair, usually just one or two
+        groups = {}
+        for recipient_id, count in recipients.items():
+            groups.setdefault((count, recipient_id in hard), []).append(recipient_id)
+        for (count, is_hard), recipient_ids in groups.items():
+            fields = {'bounce_count': F('bounce_count') + count, 'last_bounced_at': now}
+            if is_hard:
+                fields['is_suppressed'] = True
+            Recipient.objects.filter(pk__in=recipient_ids).update(**fields)
+
+    results['bounced'] += len(logs)
+    results['suppressed'] += len(hard)
+
+
+def process_bounces(source, chunk_size=BOUNCE_CHUNK, delete=False):
+    """
+    Stream DSNs from ``source`` and mark matching EmailLog rows as bounced.
+
+    Messages are parsed one at a time and applied in chunks of ``chunk_size``
+    bounces with a handful of bulk queries each, so large mailboxes are
+    processed in constant memory. Hard (5.x.x) bounces suppress the recipient
+    from future campaigns. With ``delete`` the DSNs that were recognised are
+    removed from the source once processing finishes.
+    """
+    results = {'messages': 0, 'ignored': 0, 'bounces': 0, 'bounced': 0, 'already_bounced': 0,
+               'unmatched': 0, 'suppressed': 0}
+    verp_pattern = _verp_pattern()
+    chunk, keys = [], []
+
+    try:
+        for key, raw in source:
+            results['messages'] += 1
+            try:
+                bounces = parse_dsn(raw, verp_pattern)
+            except Exception as e:
+                logger.warning(f"Could not parse message {key}: {str(e)}")
+                bounces = []
+            if not bounces:
+                results['ignored'] += 1
+                continue
+            chunk.extend(bounces)
+            keys.append(key)
+            if len(chunk) >= chunk_size:
+                _apply_bounces(chunk, results)
+                results['bounces'] += len(chunk)
+                chunk = []
+        if chunk:
+            _apply_bounces(chunk, results)
+            results['bounces'] += len(chunk)
+        if delete:
+            source.remove(keys)
+    finally:
+        source.close()
+
+    logger.info(f"Bounce processing completed: {results}")
+    return results
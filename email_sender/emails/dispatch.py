@@ -0,0 +1,227 @@
+import time
+import logging
+from django.conf import settings
+from django.db.models import Count, Exists, Min, OuterRef
+from django.utils import timezone
+from .metrics import LatencyHistogram
+from .models import Campaign, Delivery
+from .tenants import exhausted_tenant_ids
+
+logger = logging.getLogger(__name__)
+
+# Queue wait times range from milliseconds (transactional) to hours (bulk)
+WAIT_BUCKETS_MS = [100, 500, 1000, 5000, 10000, 30000, 60000, 300000, 900000, 3600000, 14400000, 86400000]
+
+# How often workers reload the active campaigns. Batches are picked between
+# refreshes from the worker's own pass counters, so this only bounds how long
+# a newly queued campaign waits before the worker notices it
+REFRESH_SECONDS = 5.0
+
+DEFAULT_LANES = {
+    Campaign.PRIORITY_TRANSACTIONAL: {'weight': 1, 'strict': True},
+    Campaign.PRIORITY_NORMAL: {'weight': 4},
+    Campaign.PRIORITY_BULK: {'weight': 1},
+}
+
+
+class CampaignState:
+    def __init__(self, campaign, pass_value):
+        self.campaign = campaign
+        self.pass_value = pass_value
+        self.has_pending = False
+        self.exhausted = False
+
+
+class Lane:
+    """Campaigns of one priority and the lane's scheduling state and metrics"""
+
+    def __init__(self, priority, weight=1, strict=False):
+        self.priority = priority
+        self.name = dict(Campaign.PRIORITY_CHOICES).get(priority, str(priority))
+        self.weight = weight
+        self.strict = strict
+        self.pass_value = 0.0
+        self.campaigns = {}
+        # Pass of each tenant with campaigns in this lane
+        self.tenants = {}
+        self.sent = 0
+        self.wait = LatencyHistogram(WAIT_BUCKETS_MS)
+
+    @property
+    def depth(self):
+        """Campaigns with pending deliveries; queue_depths() counts the deliveries themselves"""
+        return sum(state.has_pending for state in self.campaigns.values())
+
+    def ready(self):
+        return [state for state in self.campaigns.values() if not state.exhausted]
+
+    def ready_tenants(self):
+        return {state.campaign.tenant_id for state in self.ready()}
+
+
+class Dispatcher:
+    """
+    Chooses which campaign a send worker leases its next batch from.
+
+    Campaigns are grouped into lanes by priority. Strict lanes (transactional
+    by default) are always served first. The remaining lanes share the worker
+    by weight, then the tenants within a lane by tenant weight, then each
+    tenant's campaigns by campaign weight, using stride scheduling: each
+    lane/tenant/campaign advances a virtual "pass" by deliveries / weight and
+    the lowest pass goes next. So a tenant with one huge campaign gets the
+    same share as a tenant with many small ones. Newly active lanes, tenants
+    and campaigns start at the current minimum pass, so one that was idle
+    cannot build up credit and burst. Tenants that have used up their daily
+    quota are skipped until the next day.
+
+    With ``tenant_id`` only that tenant's campaigns are sent, e.g. by workers
+    dedicated to a large tenant. Lane configuration comes from
+    settings.EMAIL_DISPATCH_LANES.
+    """
+
+    def __init__(self, campaign_id=None, lanes=None, refresh_seconds=REFRESH_SECONDS, tenant_id=None):
+        config = lanes or getattr(settings, 'EMAIL_DISPATCH_LANES', DEFAULT_LANES)
+        self.lanes = {
+            priority: Lane(priority, options.get('weight', 1), options.get('strict', False))
+            for priority, options in sorted(config.items())
+        }
+        self.campaign_id = campaign_id
+        self.tenant_id = tenant_id
+        self.refresh_seconds = refresh_seconds
+        self.refreshed_at = None
+
+    def _lane(self, priority):
+        if priority not in self.lanes:
+            self.lanes[priority] = Lane(priority)
+        return self.lanes[priority]
+
+    def refresh(self):
+        """
+        Reload the active campaigns with one query.
+
+        Whether a campaign has pending deliveries is an EXISTS probe on the
+        delivery claim index that stops at the first row, not a count of the
+        campaign's deliveries.
+        """
+        pending = Delivery.objects.filter(campaign=OuterRef('pk'), status='pending')
+        campaigns = Campaign.objects.filter(status__in=['queued', 'running'], tenant__is_active=True).select_related(
+            'tenant'
+        ).annotate(has_pending=Exists(pending))
+        if self.campaign_id is not None:
+            campaigns = campaigns.filter(pk=self.campaign_id)
+        if self.tenant_id is not None:
+            campaigns = campaigns.filter(tenant_id=self.tenant_id)
+        over_quota = exhausted_tenant_ids()
+
+        active = {}
+        for campaign in campaigns:
+            active.setdefault(campaign.priority, []).append(campaign)
+
+        busy_passes = [lane.pass_value for lane in self.lanes.values() if lane.ready()]
+        floor = min(busy_passes) if busy_passes else 0.0
+
+        for priority in active:
+            self._lane(priority)
+
+        for priority, lane in self.lanes.items():
+            lane_campaigns = active.get(priority, [])
+            if lane_campaigns and not lane.ready():
+                lane.pass_value = max(lane.pass_value, floor)
+
+            busy_tenants = lane.ready_tenants()
+            tenant_floor = min((lane.tenants[tenant_id] for tenant_id in busy_tenants), default=0.0)
+            campaign_floors = {}
+            for state in lane.ready():
+                tenant_id = state.campaign.tenant_id
+                campaign_floors[tenant_id] = min(campaign_floors.get(tenant_id, state.pass_value), state.pass_value)
+
+            states, tenants = {}, {}
+            for campaign in lane_campaigns:
+                if campaign.tenant_id not in tenants:
+                    tenant_pass = lane.tenants.get(campaign.tenant_id, 0.0)
+                    tenants[campaign.tenant_id] = tenant_pass if campaign.tenant_id in busy_tenants else max(tenant_pass, tenant_floor)
+                state = lane.campaigns.get(campaign.pk) or CampaignState(campaign, campaign_floors.get(campaign.tenant_id, 0.0))
+                state.campaign = campaign
+                state.has_pending = campaign.has_pending
+                state.exhausted = campaign.tenant_id in over_quota
+                states[campaign.pk] = state
+            lane.campaigns = states
+            lane.tenants = tenants
+
+        self.refreshed_at = time.monotonic()
+
+    def next_campaign(self):
+        """Campaign to lease the next batch from, or None when there is no work"""
+        if self.refreshed_at is None or time.monotonic() - self.refreshed_at >= self.refresh_seconds:
+            self.refresh()
+
+        candidates = [lane for lane in self.lanes.values() if lane.ready()]
+        if not candidates:
+            return None
+
+        strict = [lane for lane in candidates if lane.strict]
+        if strict:
+            lane = min(strict, key=lambda lane: lane.priority)
+        else:
+            lane = min(candidates, key=lambda lane: (lane.pass_value, lane.priority))
+
+        tenant_id = min(lane.ready_tenants(), key=lambda tenant_id: (lane.tenants.get(tenant_id, 0.0), tenant_id))
+        state = min(
+            (state for state in lane.ready() if state.campaign.tenant_id == tenant_id),
+            key=lambda state: (state.pass_value, state.campaign.created_at),
+        )
+        return state.campaign
+
+    def record(self, campaign, claimed, sent=0):
+        """Account for a batch leased from ``campaign``"""
+        lane = self._lane(campaign.priority)
+        state = lane.campaigns.get(campaign.pk)
+        if state is None:
+            return
+        if not claimed:
+            # Nothing leasable right now (leased elsewhere, deferred or over quota) until the next refresh
+            state.exhausted = True
+            return
+
+        weight = max(campaign.weight, 1)
+        state.pass_value += claimed / weight
+        lane.tenants[campaign.tenant_id] = lane.tenants.get(campaign.tenant_id, 0.0) + claimed / max(campaign.tenant.weight, 1)
+        lane.pass_value += claimed / lane.weight
+        lane.sent += sent
+        lane.wait.observe((timezone.now() - campaign.created_at).total_seconds(), count=claimed)
+
+    def metrics(self):
+        """Per-lane campaigns with pending work, throughput and wait-time percentiles for this worker"""
+        return {
+            lane.name: {
+                'campaigns': len(lane.campaigns),
+                'tenants': len(lane.tenants),
+                'campaigns_pending': lane.depth,
+                'sent': lane.sent,
+                'wait_p50_ms': lane.wait.percentile(0.50),
+                'wait_p95_ms': lane.wait.percentile(0.95),
+                'wait_max_ms': round(lane.wait.max_ms, 1),
+            }
+            for lane in self.lanes.values()
+        }
+
+
+def queue_depths(tenant=None):
+    """Pending deliveries and oldest waiting campaign per lane, across all workers (or of one tenant)"""
+    campaigns = Campaign.objects.filter(status__in=['queued', 'running'], deliveries__status='pending')
+    if tenant is not None:
+        campaigns = campaigns.for_tenant(tenant)
+    rows = (
+        campaigns
+        .values('priority')
+        .annotate(pending=Count('deliveries'), oldest=Min('created_at'))
+    )
+    now = timezone.now()
+    names = dict(Campaign.PRIORITY_CHOICES)
+    return {
+        names.get(row['priority'], str(row['priority'])): {
+            'queue_depth': row['pending'],
+            'oldest_wait_seconds': round((now - row['oldest']).total_seconds(), 1),
+        }
+        for row in rows
+    }
@@ -0,0 +1,199 @@
+import csv
+import json
+import sys
+from asgiref.sync import sync_to_async
+from datetime import datetime, time as dt_time
+from django.utils import timezone
+from django.utils.dateparse import parse_date, parse_datetime
+from .models import CustomField, EmailLog, Recipient
+
+# Rows fetched per round trip (a server-side cursor on PostgreSQL) and joined into one output chunk
+EXPORT_CHUNK = 2000
+FORMATS = {
+    'csv': 'text/csv',
+    'ndjson': 'application/x-ndjson',
+}
+
+RECIPIENT_COLUMNS = ['email', 'company', 'bounce_count', 'is_suppressed', 'created_at']
+LOG_COLUMNS = [
+    ('id', 'id'),
+    ('created_at', 'created_at'),
+    ('sent_at', 'sent_at'),
+    ('status', 'status'),
+    ('email', 'recipient__email'),
+    ('campaign_id', 'campaign_id'),
+    ('template_id', 'template_id'),
+    ('subject', 'subject'),
+    ('message_id', 'message_id'),
+    ('attachment_count', 'attachment_count'),
+    ('error_message', 'error_message'),
+]
+
+
+def _parse_moment(value, end_of_day=False):
+    """A date (YYYY-MM-DD) or ISO datetime filter value as an aware datetime"""
+    moment = parse_datetime(value)
+    if moment is None:
+        day = parse_date(value)
+        if day is None:
+            raise ValueError(f"Invalid date: {value}")
+        moment = datetime.combine(day, dt_time.max if end_of_day else dt_time.min)
+    if timezone.is_naive(moment):
+        moment = timezone.make_aware(moment)
+    return moment
+
+
+def _date_range(queryset, field, params):
+    if params.get('since'):
+        queryset = queryset.filter(**{f'{field}__gte': _parse_moment(params['since'])})
+    if params.get('until'):
+        queryset = queryset.filter(**{f'{field}__lte': _parse_moment(params['until'], end_of_day=True)})
+    return queryset
+
+
+def _campaign_id(params):
+    try:
+        return int(params['campaign'])
+    except (TypeError, ValueError):
+        raise ValueError(f"Invalid campaign: {params['campaign']}")
+
+
+def recipient_export(params, tenant=None):
+    """
+    Columns and a row iterator for recipients matching ``params`` (of ``tenant`` only, if given).
+
+    Filters: suppressed (yes/no), campaign (recipients of a campaign), since/until
+    (created_at). Custom fields get one column each, so the CSV can be imported again.
+    """
+    queryset = Recipient.objects.order_by('pk')
+    if tenant is not None:
+        queryset = queryset.for_tenant(tenant)
+    if params.get('suppressed') in ('1', 'yes', 'true'):
+        queryset = queryset.filter(is_suppressed=True)
+    elif params.get('suppressed') in ('0', 'no', 'false'):
+        queryset = queryset.filter(is_suppressed=False)
+    if params.get('campaign'):
+        queryset = queryset.filter(delivery__campaign_id=_campaign_id(params))
+    queryset = _date_range(queryset, 'created_at', params)
+
+    if tenant is not None:
+        custom_fields = CustomField.names(tenant)
+    else:
+        custom_fields = list(CustomField.objects.order_by('name').values_list('name', flat=True).distinct())
+    columns = RECIPIENT_COLUMNS + custom_fields
+
+    def rows():
+        for values in queryset.values_list(*RECIPIENT_COLUMNS, 'custom_fields').iterator(chunk_size=EXPORT_CHUNK):
+            extra = values[-1] or {}
+            yield list(values[:-1]) + [extra.get(name, '') for name in custom_fields]
+
+    return columns, rows()
+
+
+def log_export(params, tenant=None):
+    """
+    Columns and a row iterator for email logs matching ``params`` (of ``tenant`` only, if given).
+
+    Filters: status, campaign, since/until (created_at). The body is only
+    included with body=1, since it usually dwarfs everything else.
+    """
+    queryset = EmailLog.objects.order_by('pk')
+    if tenant is not None:
+        queryset = queryset.for_tenant(tenant)
+    if params.get('status'):
+        if params['status'] not in dict(EmailLog.STATUS_CHOICES):
+            raise ValueError(f"Invalid status: {params['status']}")
+        queryset = queryset.filter(status=params['status'])
+    if params.get('campaign'):
+        queryset = queryset.filter(campaign_id=_campaign_id(params))
+    queryset = _date_range(queryset, 'created_at', params)
+
+    fields = list(LOG_COLUMNS)
+    if params.get('body') in ('1', 'yes', 'true', True):
+        fields.append(('body', 'body'))
+    columns = [name for name, _ in fields]
+
+    def rows():
+        yield from queryset.values_list(*(lookup for _, lookup in fields)).iterator(chunk_size=EXPORT_CHUNK)
+
+    return columns, rows()
+
+
+class _Echo:
+    """File-like object whose write() returns the line instead of storing it"""
+
+    def write(self, value):
+        return value
+
+
+def _value(value):
+    return value.isoformat() if hasattr(value, 'isoformat') else value
+
+
+def csv_chunks(columns, rows):
+    writer = csv.writer(_Echo())
+    yield writer.writerow(columns)
+    chunk = []
+    for row in rows:
+        chunk.append(writer.writerow([_value(value) for value in row]))
+        if len(chunk) >= EXPORT_CHUNK:
+            yield ''.join(chunk)
+            chunk = []
+    if chunk:
+        yield ''.join(chunk)
+
+
+def ndjson_chunks(columns, rows):
+    chunk = []
+    for row in rows:
+        chunk.append(json.dumps(dict(zip(columns, map(_value, row))), ensure_ascii=False) + '\n')
+        if len(chunk) >= EXPORT_CHUNK:
+            yield ''.join(chunk)
+            chunk = []
+    if chunk:
+        yield ''.join(chunk)
+
+
+def export_chunks(export_format, columns, rows):
+    """
+    Encoded output of an export, yielded in chunks of EXPORT_CHUNK rows.
+
+    Rows are streamed from the database, so memory use does not depend on the
+    number of rows and the first bytes are available immediately.
+    """
+    if export_format not in FORMATS:
+        raise ValueError(f"Invalid format: {export_format}. Use one of {', '.join(FORMATS)}")
+    chunks = csv_chunks(columns, rows) if export_format == 'csv' else ndjson_chunks(columns, rows)
+    return (chunk.encode('utf-8') for chunk in chunks)
+
+
+def write_export(chunks, output):
+    """Write export chunks to ``output`` or stdout and return the number of bytes written"""
+    written = 0
+    stream = open(output, 'wb') if output else sys.stdout.buffer
+    try:
+        for chunk in chunks:
+            stream.write(chunk)
+            written += len(chunk)
+    finally:
+        if output:
+            stream.close()
+        else:
+            stream.flush()
+    return written
+
+
+async def async_chunks(chunks):
+    """
+    Async iterator over an export's chunks, for responses served over ASGI.
+
+    ASGI servers would otherwise read a synchronous iterator into memory before
+    sending it. Each chunk is produced in the thread that owns the database
+    connection, so the server-side cursor stays on one connection.
+    """
+    next_chunk = sync_to_async(next, thread_sensitive=True)
+    while True:
+        chunk = await next_chunk(chunks, None)
+        if chunk is None:
+            return
+        yield chunk
@@ -1,6 +1,10 @@
 from django import forms
 from django.forms.widgets import Input
-from .models import Recipient, EmailTemplate, EmailCredential, EmailSettings
+from .models import Campaign, Recipient, EmailTemplate, EmailCredential, EmailSettings, CustomField
+from .abtest import DEFAULT_TEST_PERCENT, DEFAULT_TEST_WAIT_MINUTES
+from .audience import AUDIENCE_CHOICES, AUDIENCE_FAILED, AUDIENCE_SELECTED, resolve_audience
+from .templating import validate_template
+from .validation import REJECTED_STATUSES, check_emails
 
 
 class MultipleFileInput(Input):
@@ -21,7 +25,15 @@ class MultipleFileInput(Input):
     def value_omitted_from_data(self, data, files, name):
         return name not in files
 
-class RecipientForm(forms.ModelForm):
+class TenantModelFormMixin:
+    """ModelForm whose new instances are created in ``tenant`` (the default tenant when omitted)"""
+
+    def __init__(self, *args, tenant=None, **kwargs):
+        super().__init__(*args, **kwargs)
+        if tenant is not None and self.instance.pk is None:
+            self.instance.tenant = tenant
+
+class RecipientForm(TenantModelFormMixin, forms.ModelForm):
     class Meta:
         model = Recipient
         fields = ['email', 'company']
@@ -30,14 +42,27 @@ class RecipientForm(forms.ModelForm):
             'company': forms.TextInput(attrs={'class': 'form-control'}),
         }
 
+    def clean_email(self):
+        """Reject invalid addresses and addresses that only differ from an existing one of the tenant in case or whitespace"""
+        check, = check_emails([self.cleaned_data['email']])
+        if check.status in REJECTED_STATUSES:
+            raise forms.ValidationError(check.reason)
+        duplicates = Recipient.objects.for_tenant(self.instance.tenant_id).filter(
+            email_normalized=check.normalized
+        ).exclude(pk=self.instance.pk)
+        if duplicates.exists():
+            raise forms.ValidationError(f'{duplicates.first().email} is already a recipient.')
+        self.instance.email_check = check.status
+        return check.email
+
 class BulkRecipientForm(forms.Form):
     csv_file = forms.FileField(
         label='Upload CSV File',
-        help_text='CSV format: email, company',
+        help_text='CSV format: email, company, plus any custom field columns',
         widget=forms.FileInput(attrs={'class': 'form-control', 'accept': '.csv'})
     )
 
-class EmailTemplateForm(forms.ModelForm):
+class EmailTemplateForm(TenantModelFormMixin, forms.ModelForm):
     class Meta:
         model = EmailTemplate
         fields = ['name', 'subject', 'body']
@@ -64,9 +89,17 @@ class SendEmailForm(forms.Form):
         widget=forms.Textarea(attrs={'class': 'form-control', 'rows': 10})
     )
     recipients = forms.ModelMultipleChoiceField(
-        queryset=Recipient.objects.all(),
+        queryset=Recipient.objects.filter(is_suppressed=False),
         widget=forms.CheckboxSelectMultiple,
-        required=True
+        required=False
+    )
+    # Delta sends pick their recipients from the template's delivery history
+    audience = forms.ChoiceField(
+        choices=AUDIENCE_CHOICES,
+        initial=AUDIENCE_SELECTED,
+        required=False,
+        widget=forms.Select(attrs={'class': 'form-control'}),
+        help_text='New and failed recipients are worked out from the sends of the chosen template'
     )
     attachments = forms.FileField(
         widget=MultipleFileInput(attrs={'class': 'form-control'}),
@@ -78,6 +111,50 @@ class SendEmailForm(forms.Form):
         initial=True,
         widget=forms.CheckboxInput(attrs={'class': 'form-check-input'})
     )
+    # A/B test: the subject/body above is variant A, each template another variant
+    variant_templates = forms.ModelMultipleChoiceField(
+        queryset=EmailTemplate.objects.all(),
+        widget=forms.SelectMultiple(attrs={'class': 'form-control', 'size': 4}),
+        required=False,
+        label='A/B test against templates',
+        help_text='Each selected template is sent as a variant to part of the recipients; the best one goes to the rest'
+    )
+    test_percent = forms.IntegerField(
+        min_value=1,
+        max_value=100,
+        initial=DEFAULT_TEST_PERCENT,
+        required=False,
+        widget=forms.NumberInput(attrs={'class': 'form-control'}),
+        help_text='Recipients in the test, split evenly between the variants'
+    )
+    winner_metric = forms.ChoiceField(
+        choices=Campaign.WINNER_METRIC_CHOICES,
+        initial='opens',
+        required=False,
+        widget=forms.Select(attrs={'class': 'form-control'}),
+        help_text='Open or click tracking is switched on for A/B tests, whatever the tracking settings'
+    )
+    test_wait_minutes = forms.IntegerField(
+        min_value=0,
+        initial=DEFAULT_TEST_WAIT_MINUTES,
+        required=False,
+        widget=forms.NumberInput(attrs={'class': 'form-control'}),
+        help_text='Wait after the test emails are sent before choosing the winner'
+    )
+    # Generated when the form is rendered, so submitting it twice sends once
+    idempotency_key = forms.CharField(
+        max_length=100,
+        required=False,
+        widget=forms.HiddenInput
+    )
+
+    def __init__(self, *args, tenant=None, **kwargs):
+        super().__init__(*args, **kwargs)
+        self.tenant = tenant
+        if tenant is not None:
+            # Only the tenant's own templates and recipients can be chosen
+            for name in ('template', 'variant_templates', 'recipients'):
+                self.fields[name].queryset = self.fields[name].queryset.for_tenant(tenant)
 
     def clean_attachments(self):
         """Validate attachments"""
@@ -102,8 +179,48 @@ class SendEmailForm(forms.Form):
 
         return files
 
+    def clean_subject(self):
+        subject = self.cleaned_data['subject']
+        validate_template(subject, CustomField.names(self.tenant))
+        return subject
+
+    def clean_body(self):
+        body = self.cleaned_data['body']
+        validate_template(body, CustomField.names(self.tenant))
+        return body
+
+    def clean_variant_templates(self):
+        templates = self.cleaned_data['variant_templates']
+        custom_fields = CustomField.names(self.tenant)
+        for template in templates:
+            try:
+                validate_template(template.subject, custom_fields)
+                validate_template(template.body, custom_fields)
+            except forms.ValidationError as e:
+                raise forms.ValidationError(f'Template "{template}": {e.messages[0]}')
+        return templates
+
+    def clean(self):
+        cleaned_data = super().clean()
+        audience = cleaned_data.get('audience') or AUDIENCE_SELECTED
+        if audience == AUDIENCE_SELECTED:
+            if not cleaned_data.get('recipients') and 'recipients' not in self.errors:
+                self.add_error('recipients', 'Select at least one recipient.')
+            return cleaned_data
+        template = cleaned_data.get('template')
+        if template is None:
+            self.add_error('template', 'Choose the template whose new or failed recipients should be sent to.')
+            return cleaned_data
+        recipients = resolve_audience(audience, template)
+        if not recipients.exists():
+            if audience == AUDIENCE_FAILED:
+                raise forms.ValidationError(f'"{template}" has no failed recipients left to retry.')
+            raise forms.ValidationError(f'Nobody who has not received "{template}" was added since it was last sent.')
+        cleaned_data['recipients'] = recipients
+        return cleaned_data
+
 
-class EmailCredentialForm(forms.ModelForm):
+class EmailCredentialForm(TenantModelFormMixin, forms.ModelForm):
     """Form for adding/editing email credentials"""
 
     # Add a password field that won't display the encrypted password
@@ -174,7 +291,8 @@ class EmailSettingsForm(forms.ModelForm):
 
     class Meta:
         model = EmailSettings
-        fields = ['email_delay', 'batch_size', 'batch_delay', 'max_attachments', 'max_attachment_size']
+        fields = ['email_delay', 'batch_size', 'batch_delay', 'max_attachments', 'max_attachment_size',
+                  'track_opens', 'track_clicks']
         widgets = {
             'email_delay': forms.NumberInput(attrs={
                 'class': 'form-control',
@@ -204,6 +322,8 @@ class EmailSettingsForm(forms.ModelForm):
                 'min': '1',
                 'max': '25'
             }),
+            'track_opens': forms.CheckboxInput(attrs={'class': 'form-check-input'}),
+            'track_clicks': forms.CheckboxInput(attrs={'class': 'form-check-input'}),
         }
         help_texts = {
             'email_delay': 'Delay between each email in seconds (0-60). Helps avoid rate limiting.',
@@ -211,6 +331,8 @@ class EmailSettingsForm(forms.ModelForm):
             'batch_delay': 'Longer pause after sending a batch (in seconds).',
             'max_attachments': 'Maximum number of attachments allowed per email (1-10).',
             'max_attachment_size': 'Maximum size per attachment in MB (1-25).',
+            'track_opens': 'Adds an HTML version with an invisible tracking image.',
+            'track_clicks': 'Links are rewritten to record the click before redirecting.',
         }
         labels = {
             'email_delay': 'Delay Between Emails (seconds)',
@@ -218,6 +340,8 @@ class EmailSettingsForm(forms.ModelForm):
             'batch_delay': 'Batch Delay (seconds)',
             'max_attachments': 'Max Attachments Per Email',
             'max_attachment_size': 'Max Attachment Size (MB)',
+            'track_opens': 'Track Opens',
+            'track_clicks': 'Track Clicks',
         }
 
     def clean_email_delay(self):
@@ -0,0 +1,72 @@
+import time
+from datetime import timedelta
+from django.db.models import F, Q
+from django.utils import timezone
+from .models import Delivery
+
+
+def claim_recipients(campaign, worker_id, recipient_ids, lease_seconds=300):
+    """
+    Lease the pending deliveries of ``recipient_ids`` in ``campaign`` and return {recipient_id: delivery_id}.
+
+    One conditional UPDATE on the unique (campaign, recipient) index followed by
+    one SELECT per chunk: recipients already sent, failed or leased by another
+    execution are simply not returned, so retried and concurrent sends skip
+    them without per-recipient queries.
+    """
+    now = timezone.now()
+    claimable = Q(status='pending') & (Q(lease_expires_at__isnull=True) | Q(lease_expires_at__lt=now))
+    Delivery.objects.filter(claimable, campaign=campaign, recipient_id__in=recipient_ids).update(
+        lease_owner=worker_id,
+        lease_expires_at=now + timedelta(seconds=lease_seconds),
+        attempts=F('attempts') + 1,
+    )
+    return dict(
+        Delivery.objects.filter(
+            campaign=campaign, recipient_id__in=recipient_ids, lease_owner=worker_id, status='pending'
+        ).values_list('recipient_id', 'pk')
+    )
+
+
+def finish_deliveries(delivery_ids, worker_id, status):
+    """Record the outcome of leased deliveries, provided we still own their leases"""
+    if not delivery_ids:
+        return 0
+    return Delivery.objects.filter(pk__in=delivery_ids, lease_owner=worker_id).update(
+        status=status,
+        lease_owner='',
+        lease_expires_at=None,
+    )
+
+
+def renew_leases(delivery_ids, worker_id, lease_seconds):
+    """Extend the leases ``worker_id`` still holds on ``delivery_ids`` and return the ids it holds"""
+    if not delivery_ids:
+        return set()
+    held = Delivery.objects.filter(pk__in=delivery_ids, lease_owner=worker_id, status='pending')
+    held.update(lease_expires_at=timezone.now() + timedelta(seconds=lease_seconds))
+    return set(held.values_list('pk', flat=True))
+
+
+class LeaseKeeper:
+    """
+    Keeps a worker's leases on one batch alive while the batch is being sent.
+
+    Sending a batch can outlast its lease (throttled domains, long email
+    delays), and another worker would then lease and send the same rows
+    again. holds() is called right before each send: once half of the lease
+    has passed the leases of the whole batch are renewed in one UPDATE, and
+    deliveries the worker no longer owns are reported so they are skipped.
+    """
+
+    def __init__(self, delivery_ids, worker_id, lease_seconds, leased_at=None):
+        self.held = set(delivery_ids)
+        self.worker_id = worker_id
+        self.lease_seconds = lease_seconds
+        self.renew_at = (leased_at or time.monotonic()) + lease_seconds / 2
+
+    def holds(self, delivery_id):
+        if time.monotonic() >= self.renew_at:
+            self.renew_at = time.monotonic() + self.lease_seconds / 2
+            self.held = renew_leases(self.held, self.worker_id, self.lease_seconds)
+        return delivery_id in self.held
@@ -0,0 +1,135 @@
+import atexit
+import logging
+import threading
+from django.conf import settings
+from django.db import close_old_connections, connections, router
+from .models import EmailLog, TrackingEvent
+
+logger = logging.getLogger(__name__)
+
+
+class EmailLogBuffer:
+    """
+    Collects EmailLog rows and writes them in batches.
+
+    On PostgreSQL (psycopg 3) batches are streamed with COPY, elsewhere they are
+    inserted with one multi-row INSERT per batch. Either way a send writes one
+    statement per ``batch_size`` logs instead of one per recipient, which keeps
+    concurrent workers from queueing on the database writer lock.
+
+    Use as a context manager, or call flush() before reading the logs back.
+    """
+
+    model = EmailLog
+
+    def __init__(self, batch_size=None):
+        self.batch_size = batch_size or getattr(settings, 'EMAIL_LOG_BATCH_SIZE', 500)
+        self.pending = []
+        self.written = 0
+
+    def __enter__(self):
+        return self
+
+    def __exit__(self, *exc_info):
+        self.flush()
+
+    def add(self, **fields):
+        if 'tenant' not in fields and 'tenant_id' not in fields:
+            # A log belongs to the tenant of its campaign, or else of its recipient
+            campaign = fields.get('campaign')
+            fields['tenant_id'] = campaign.tenant_id if campaign is not None else fields['recipient'].tenant_id
+        self.pending.append(self.model(**fields))
+        if len(self.pending) >= self.batch_size:
+            self.flush()
+
+    def flush(self):
+        if not self.pending:
+            return 0
+        logs, self.pending = self.pending, []
+        self._write(logs)
+        self.written += len(logs)
+        return len(logs)
+
+    def _write(self, rows):
+        connection = connections[router.db_for_write(self.model)]
+        if not (connection.vendor == 'postgresql' and self._copy(connection, rows)):
+            self.model.objects.bulk_create(rows, batch_size=self.batch_size)
+
+    def _copy(self, connection, logs):
+        """Stream rows with COPY FROM STDIN; returns False when the driver can't"""
+        fields = [field for field in self.model._meta.concrete_fields if not field.primary_key]
+        columns = ', '.join(connection.ops.quote_name(field.column) for field in fields)
+        table = connection.ops.quote_name(self.model._meta.db_table)
+
+        with connection.cursor() as cursor:
+            if not hasattr(cursor.cursor, 'copy'):
+                # psycopg2 has no row-based COPY API; use multi-row INSERT instead
+                return False
+            with cursor.cursor.copy(f'COPY {table} ({columns}) FROM STDIN') as copy:
+                for log in logs:
+                    copy.write_row([
+                        field.get_db_prep_save(field.pre_save(log, add=True), connection)
+                        for field in fields
+                    ])
+        return True
+
+
+class TrackingEventBuffer(EmailLogBuffer):
+    """
+    Process-wide buffer for open and click events.
+
+    Tracking requests only append to memory; a background thread writes the
+    buffer every TRACKING_FLUSH_SECONDS, or as soon as a batch is full. Above
+    TRACKING_BUFFER_MAX pending events new ones are dropped (and counted) so
+    a burst of opens can never exhaust memory or stall request threads on
+    the database.
+    """
+
+    model = TrackingEvent
+
+    def __init__(self, batch_size=None, flush_seconds=None, max_pending=None):
+        super().__init__(batch_size or getattr(settings, 'TRACKING_BATCH_SIZE', 1000))
+        self.flush_seconds = flush_seconds or getattr(settings, 'TRACKING_FLUSH_SECONDS', 2.0)
+        self.max_pending = max_pending or getattr(settings, 'TRACKING_BUFFER_MAX', 100000)
+        self.dropped = 0
+        self.lock = threading.Lock()
+        self.wakeup = threading.Event()
+        self.thread = None
+
+    def add(self, **fields):
+        with self.lock:
+            if len(self.pending) >= self.max_pending:
+                self.dropped += 1
+                return
+            self.pending.append(self.model(**fields))
+            if self.thread is None:
+                # Started lazily so every (forked) server process gets its own
+                self.thread = threading.Thread(target=self._run, name='tracking-flush', daemon=True)
+                self.thread.start()
+                atexit.register(self.flush)
+            if len(self.pending) >= self.batch_size:
+                self.wakeup.set()
+
+    def flush(self):
+        with self.lock:
+            events, self.pending = self.pending, []
+            dropped, self.dropped = self.dropped, 0
+        if dropped:
+            logger.warning(f"Tracking buffer full, dropped {dropped} events")
+        if not events:
+            return 0
+        try:
+            for start in range(0, len(events), self.batch_size):
+                self._write(events[start:start + self.batch_size])
+        except Exception as e:
+            logger.error(f"Dropped {len(events)} tracking events: {str(e)}")
+            return 0
+        self.written += len(events)
+        return len(events)
+
+    def _run(self):
+        while True:
+            self.wakeup.wait(self.flush_seconds)
+            self.wakeup.clear()
+            self.flush()
+            close_old_connections()
@@ -0,0 +1,106 @@
+import json
+import statistics
+import threading
+import time
+import urllib.error
+import urllib.request
+from concurrent.futures import ThreadPoolExecutor
+from django.core.management.base import BaseCommand, CommandError
+from emails.tracking import Tracker
+
+
+class Command(BaseCommand):
+    help = "Load test the JSON API of a running server (e.g. manage.py runserver) and report throughput and latency."
+
+    def add_arguments(self, parser):
+        parser.add_argument('--url', default='http://127.0.0.1:8000', help='Base URL of the server')
+        parser.add_argument('--token', help='API token (see create_api_token); not needed for open')
+        parser.add_argument('--endpoint', choices=['status', 'upsert', 'send', 'transactional', 'open'], default='status')
+        parser.add_argument('--requests', type=int, default=1000)
+        parser.add_argument('--concurrency', type=int, default=8)
+        parser.add_argument('--batch', type=int, default=100, help='Recipients per upsert request')
+        parser.add_argument('--campaign', type=int, help='Campaign ID for the status endpoint')
+
+    def handle(self, *args, **options):
+        base = options['url'].rstrip('/')
+        headers = {'Authorization': f"Bearer {options['token']}"}
+        counter = iter(range(options['requests']))
+        lock = threading.Lock()
+
+        if options['endpoint'] != 'open' and not options['token']:
+            raise CommandError('--token is required for API endpoints')
+
+        if options['endpoint'] == 'open':
+            # Signed the same way as pixels in sent emails; recipients need not exist
+            tracker = Tracker(options['campaign'])
+            make_request = lambda i: urllib.request.Request(tracker.open_url(i + 1).replace(tracker.base_url, base))
+        elif options['endpoint'] == 'status':
+            if not options['campaign']:
+                raise CommandError('--campaign is required for the status endpoint')
+            make_request = lambda i: urllib.request.Request(f"{base}/api/campaigns/{options['campaign']}/", headers=headers)
+        elif options['endpoint'] == 'upsert':
+            def make_request(i):
+                lines = '\n'.join(
+                    json.dumps({'email': f'load{i}-{j}@loadtest.invalid', 'company': 'Load Test'})
+                    for j in range(options['batch'])
+                )
+                return urllib.request.Request(
+                    f'{base}/api/recipients/bulk/', data=lines.encode(), method='POST',
+                    headers={**headers, 'Content-Type': 'application/x-ndjson'},
+                )
+        elif options['endpoint'] == 'transactional':
+            def make_request(i):
+                payload = {'to': f'load{i}@loadtest.invalid', 'subject': 'Reset your password',
+                           'body': 'Your code is {{code}}', 'context': {'code': i}}
+                return urllib.request.Request(
+                    f'{base}/api/transactional/', data=json.dumps(payload).encode(), method='POST',
+                    headers={**headers, 'Content-Type': 'application/json'},
+                )
+        else:
+            def make_request(i):
+                payload = {'name': f'loadtest-{i}', 'subject': 'Load test', 'body': 'Hello {{email}}',
+                           'emails': [f'load{i}-0@loadtest.invalid']}
+                return urllib.request.Request(
+                    f'{base}/api/sends/', data=json.dumps(payload).encode(), method='POST',
+                    headers={**headers, 'Content-Type': 'application/json'},
+                )
+
+        latencies = []
+        errors = {}
+
+        def worker():
+            while True:
+                with lock:
+                    i = next(counter, None)
+                if i is None:
+                    return
+                started = time.perf_counter()
+                try:
+                    with urllib.request.urlopen(make_request(i)) as response:
+                        response.read()
+                except urllib.error.HTTPError as e:
+                    with lock:
+                        errors[e.code] = errors.get(e.code, 0) + 1
+                except OSError as e:
+                    with lock:
+                        errors[type(e).__name__] = errors.get(type(e).__name__, 0) + 1
+                else:
+                    elapsed = time.perf_counter() - started
+                    with lock:
+                        latencies.append(elapsed)
+
+        started = time.perf_counter()
+        with ThreadPoolExecutor(max_workers=options['concurrency']) as executor:
+            for _ in range(options['concurrency']):
+                executor.submit(worker)
+        total = time.perf_counter() - started
+
+        if not latencies:
+            raise CommandError(f'All requests failed: {errors}')
+        latencies.sort()
+        percentile = lambda p: latencies[min(int(len(latencies) * p), len(latencies) - 1)] * 1000
+        self.stdout.write(f"Endpoint:    {options['endpoint']}")
+        self.stdout.write(f"Requests:    {len(latencies)} ok, {sum(errors.values())} failed {errors or ''}")
+        self.stdout.write(f"Throughput:  {len(latencies) / total:.1f} req/s")
+        self.stdout.write(f"Latency ms:  mean {statistics.mean(latencies) * 1000:.1f}, "
+                          f"p50 {percentile(0.50):.1f}, p95 {percentile(0.95):.1f}, p99 {percentile(0.99):.1f}")
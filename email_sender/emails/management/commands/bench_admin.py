@@ -0,0 +1,118 @@
+import statistics
+import time
+from datetime import timedelta
+from functools import partial
+from django.contrib import admin
+from django.contrib.auth import get_user_model
+from django.core.management.base import BaseCommand
+from django.core.paginator import Paginator
+from django.db import connection
+from django.test import Client
+from django.test.utils import CaptureQueriesContext
+from django.utils import timezone
+from emails.models import EmailLog, Recipient
+
+BENCH_DOMAIN = 'adminbench.echomailer.invalid'
+BENCH_USER = 'admin-bench'
+
+PAGES = [
+    ('logs', '/admin/emails/emaillog/'),
+    ('logs, page 50', '/admin/emails/emaillog/?p=50'),
+    ('logs, failed', '/admin/emails/emaillog/?status__exact=failed'),
+    ('logs, by year', '/admin/emails/emaillog/?created_at__year={year}'),
+    ('logs, search', f'/admin/emails/emaillog/?q=admin7@{BENCH_DOMAIN}'),
+    ('recipients', '/admin/emails/recipient/'),
+    ('recipients, search', '/admin/emails/recipient/?q=admin12'),
+]
+
+
+class Command(BaseCommand):
+    help = ("Benchmark admin changelist rendering for EmailLog and Recipient on generated rows, "
+            "with --baseline to compare against stock ModelAdmin behaviour (COUNT(*) paging, "
+            "per-row recipient queries, icontains search, DISTINCT date hierarchy).")
+
+    def add_arguments(self, parser):
+        parser.add_argument('--logs', type=int, default=200000, help='EmailLog rows to generate')
+        parser.add_argument('--recipients', type=int, default=20000, help='Recipients to generate')
+        parser.add_argument('--repeat', type=int, default=3, help='Requests per page; the median is reported')
+        parser.add_argument('--baseline', action='store_true', help='Also measure stock ModelAdmin behaviour')
+        parser.add_argument('--keep', action='store_true', help='Keep the generated rows')
+
+    def handle(self, *args, **options):
+        self._generate(options['recipients'], options['logs'])
+        user, _ = get_user_model().objects.get_or_create(
+            username=BENCH_USER, defaults={'is_staff': True, 'is_superuser': True}
+        )
+        client = Client()
+        client.force_login(user)
+        year = timezone.localtime().year
+
+        self.stdout.write(f"Database: {connection.vendor}, {EmailLog.objects.count()} logs, "
+                          f"{Recipient.objects.count()} recipients")
+        self.stdout.write(f"{'page':<20} {'mode':<10} {'ms':>8} {'queries':>8}")
+        try:
+            modes = ['baseline', 'optimized'] if options['baseline'] else ['optimized']
+            for name, url in PAGES:
+                for mode in modes:
+                    if mode == 'baseline':
+                        self._use_stock_admin()
+                    try:
+                        timings, queries = [], 0
+                        for _ in range(options['repeat']):
+                            with CaptureQueriesContext(connection) as captured:
+                                started = time.perf_counter()
+                                response = client.get(url.format(year=year))
+                                timings.append(time.perf_counter() - started)
+                            queries = len(captured)
+                            if response.status_code != 200:
+                                self.stderr.write(f"  {url} returned {response.status_code}")
+                    finally:
+                        if mode == 'baseline':
+                            self._restore_admin()
+                    self.stdout.write(f"{name:<20} {mode:<10} {statistics.median(timings) * 1000:>8.1f} {queries:>8}")
+        finally:
+            user.delete()
+            if not options['keep']:
+                Recipient.objects.filter(email__endswith=f'@{BENCH_DOMAIN}').delete()
+
+    def _generate(self, recipient_count, log_count):
+        Recipient.objects.filter(email__endswith=f'@{BENCH_DOMAIN}').delete()
+        Recipient.objects.bulk_create(
+            [Recipient(email=f'admin{i}@{BENCH_DOMAIN}', email_normalized=f'admin{i}@{BENCH_DOMAIN}',
+                       company=f'Company {i % 100}') for i in range(recipient_count)],
+            batch_size=1000,
+        )
+        recipient_ids = list(
+            Recipient.objects.filter(email__endswith=f'@{BENCH_DOMAIN}').order_by('pk').values_list('pk', flat=True)
+        )
+
+        # Spread the logs over the last two years; auto_now_add would stamp them all with now()
+        created_at = EmailLog._meta.get_field('created_at')
+        now = timezone.now()
+        step = timedelta(days=730) / max(log_count, 1)
+        created_at.auto_now_add = False
+        try:
+            for offset in range(0, log_count, 10000):
+                EmailLog.objects.bulk_create([
+                    EmailLog(recipient_id=recipient_ids[i % len(recipient_ids)], subject='Benchmark', body='Benchmark',
+                             status='failed' if i % 50 == 0 else 'sent', created_at=now - step * i, sent_at=now - step * i)
+                    for i in range(offset, min(offset + 10000, log_count))
+                ], batch_size=1000)
+        finally:
+            created_at.auto_now_add = True
+
+    def _use_stock_admin(self):
+        for model in (EmailLog, Recipient):
+            model_admin = admin.site._registry[model]
+            model_admin.paginator = Paginator
+            model_admin.show_full_result_count = True
+            model_admin.list_select_related = False
+            model_admin.get_queryset = partial(admin.ModelAdmin.get_queryset, model_admin)
+            model_admin.get_search_results = partial(admin.ModelAdmin.get_search_results, model_admin)
+
+    def _restore_admin(self):
+        for model in (EmailLog, Recipient):
+            model_admin = admin.site._registry[model]
+            for attribute in ('paginator', 'show_full_result_count', 'list_select_related',
+                              'get_queryset', 'get_search_results'):
+                model_admin.__dict__.pop(attribute, None)
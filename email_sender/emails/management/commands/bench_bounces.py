@@ -0,0 +1,88 @@
+import os
+import tempfile
+import time
+from django.core.management.base import BaseCommand
+from django.utils import timezone
+from emails.bounces import MailboxSource, process_bounces
+from emails.models import EmailLog, Recipient
+
+BENCH_DOMAIN = 'bouncebench.echomailer.invalid'
+
+DSN_TEMPLATE = """From MAILER-DAEMON Mon Jan  5 12:00:00 2026
+Return-Path: <>
+From: Mail Delivery System <MAILER-DAEMON@mx.{domain}>
+To: {to}
+Subject: Undelivered Mail Returned to Sender
+MIME-Version: 1.0
+Content-Type: multipart/report; report-type=delivery-status; boundary="dsn{i}"
+
+--dsn{i}
+Content-Type: text/plain
+
+This is the mail system at host mx.{domain}. Your message could not be delivered.
+
+--dsn{i}
+Content-Type: message/delivery-status
+
+Reporting-MTA: dns; mx.{domain}
+
+Final-Recipient: rfc822; {email}
+Action: failed
+Status: 5.1.1
+Diagnostic-Code: smtp; 550 5.1.1 <{email}>: Recipient address rejected: User unknown
+
+--dsn{i}
+Content-Type: text/rfc822-headers
+
+Message-ID: {message_id}
+From: sender@echomailer.invalid
+To: {email}
+Subject: Benchmark
+
+--dsn{i}--
+
+"""
+
+
+class Command(BaseCommand):
+    help = "Benchmark bounce processing: write an mbox of DSNs for generated sent emails and process it."
+
+    def add_arguments(self, parser):
+        parser.add_argument('--count', type=int, default=10000, help='Number of DSNs')
+        parser.add_argument('--chunk-size', type=int, default=1000)
+        parser.add_argument('--keep', action='store_true', help='Keep the generated recipients and logs')
+
+    def handle(self, *args, **options):
+        count = options['count']
+        Recipient.objects.filter(email__endswith=f'@{BENCH_DOMAIN}').delete()
+        Recipient.objects.bulk_create(
+            [Recipient(email=f'bounce{i}@{BENCH_DOMAIN}') for i in range(count)], batch_size=1000
+        )
+        recipients = Recipient.objects.filter(email__endswith=f'@{BENCH_DOMAIN}').values_list('pk', 'email')
+        now = timezone.now()
+        EmailLog.objects.bulk_create(
+            [EmailLog(recipient_id=pk, subject='Benchmark', body='Benchmark', status='sent', sent_at=now,
+                      message_id=f'<bench.{pk}@{BENCH_DOMAIN}>') for pk, _ in recipients.iterator()],
+            batch_size=1000,
+        )
+
+        fd, path = tempfile.mkstemp(suffix='.mbox')
+        try:
+            with os.fdopen(fd, 'w') as mbox:
+                for i, (pk, email) in enumerate(recipients.iterator()):
+                    mbox.write(DSN_TEMPLATE.format(
+                        i=i, domain=BENCH_DOMAIN, to='sender@echomailer.invalid', email=email,
+                        message_id=f'<bench.{pk}@{BENCH_DOMAIN}>',
+                    ))
+            self.stdout.write(f"Wrote {count} DSNs ({os.path.getsize(path) / 1024 / 1024:.1f} MB)")
+
+            started = time.perf_counter()
+            results = process_bounces(MailboxSource(path), options['chunk_size'])
+            elapsed = time.perf_counter() - started
+        finally:
+            os.unlink(path)
+            if not options['keep']:
+                Recipient.objects.filter(email__endswith=f'@{BENCH_DOMAIN}').delete()
+
+        self.stdout.write(f"Results:    {results}")
+        self.stdout.write(f"Elapsed:    {elapsed:.1f}s ({results['messages'] / elapsed:.0f} DSNs/s)")
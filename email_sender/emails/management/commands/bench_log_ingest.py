@@ -0,0 +1,69 @@
+import threading
+import time
+from django.core.management.base import BaseCommand
+from django.db import connection, connections
+from django.utils import timezone
+from emails.logbuffer import EmailLogBuffer
+from emails.models import EmailLog, Recipient
+
+BENCH_DOMAIN = 'logbench.echomailer.invalid'
+
+
+class Command(BaseCommand):
+    help = ("Benchmark concurrent EmailLog ingestion on the configured database: one INSERT per "
+            "log vs EmailLogBuffer batches. Run once per backend, e.g. with "
+            "DATABASE_URL=postgresql://... for PostgreSQL.")
+
+    def add_arguments(self, parser):
+        parser.add_argument('--writers', type=int, nargs='+', default=[1, 4, 8], help='Concurrent writer threads')
+        parser.add_argument('--logs', type=int, default=2000, help='Logs written per writer')
+        parser.add_argument('--batch-size', type=int, default=500)
+
+    def handle(self, *args, **options):
+        Recipient.objects.filter(email__endswith=f'@{BENCH_DOMAIN}').delete()
+        Recipient.objects.bulk_create([Recipient(email=f'log{i}@{BENCH_DOMAIN}') for i in range(100)])
+        recipients = list(Recipient.objects.filter(email__endswith=f'@{BENCH_DOMAIN}'))
+
+        self.stdout.write(f"Database: {connection.vendor}")
+        self.stdout.write(f"{'writers':>8} {'mode':<10} {'seconds':>8} {'logs/s':>10} {'errors':>7}")
+        try:
+            for writers in options['writers']:
+                for mode in ('per-row', 'buffered'):
+                    errors = []
+
+                    def write():
+                        try:
+                            buffer = EmailLogBuffer(options['batch_size']) if mode == 'buffered' else None
+                            for i in range(options['logs']):
+                                fields = {
+                                    'recipient': recipients[i % len(recipients)],
+                                    'subject': 'Benchmark',
+                                    'body': 'Benchmark body',
+                                    'status': 'sent',
+                                    'sent_at': timezone.now(),
+                                }
+                                if buffer:
+                                    buffer.add(**fields)
+                                else:
+                                    EmailLog.objects.create(**fields)
+                            if buffer:
+                                buffer.flush()
+                        except Exception as e:
+                            errors.append(e)
+                        finally:
+                            connections.close_all()
+
+                    threads = [threading.Thread(target=write) for _ in range(writers)]
+                    started = time.perf_counter()
+                    for thread in threads:
+                        thread.start()
+                    for thread in threads:
+                        thread.join()
+                    elapsed = time.perf_counter() - started
+
+                    total = writers * options['logs']
+                    self.stdout.write(f"{writers:>8} {mode:<10} {elapsed:>8.2f} {total / elapsed:>10.0f} {len(errors):>7}")
+                    if errors:
+                        self.stderr.write(f"  first error: {errors[0]}")
+        finally:
+            Recipient.objects.filter(email__endswith=f'@{BENCH_DOMAIN}').delete()
@@ -0,0 +1,62 @@
+import io
+import os
+import time
+from django.core.mail import EmailMessage
+from django.core.management.base import BaseCommand
+from emails.mime import MessageFactory
+from emails.utils import personalize_message
+
+
+class BenchAttachment(io.BytesIO):
+    def __init__(self, name, size):
+        super().__init__(os.urandom(size))
+        self.name = name
+        self.content_type = 'application/octet-stream'
+
+
+class Recipient:
+    def __init__(self, index):
+        self.email = f'user{index}@example.com'
+        self.company = f'Company {index % 50}'
+
+
+class Command(BaseCommand):
+    help = "Benchmark wire-ready messages built per second: per-recipient EmailMessage vs MessageFactory."
+
+    def add_arguments(self, parser):
+        parser.add_argument('--messages', type=int, default=2000)
+        parser.add_argument('--attachments', type=int, default=3, help='Attachments in the attachment-heavy case')
+        parser.add_argument('--attachment-kb', type=int, default=512)
+
+    def handle(self, *args, **options):
+        subject = 'Hello {{company}}'
+        body = 'Hi {{email}},\n\nThanks for your interest, {{company}}.\n' + 'Lorem ipsum dolor sit amet. ' * 40
+        attachments = [
+            BenchAttachment(f'file{i}.bin', options['attachment_kb'] * 1024)
+            for i in range(options['attachments'])
+        ]
+        recipients = [Recipient(i) for i in range(options['messages'])]
+
+        self.stdout.write(f"{'case':<12} {'builder':<16} {'msgs/s':>10} {'MB/s':>8}")
+        for case, files in (('plain', []), ('attachments', attachments)):
+            for builder in ('EmailMessage', 'MessageFactory'):
+                # The attachment-heavy case uses fewer messages so each run takes similar time
+                count = len(recipients) if not files else max(len(recipients) // 10, 50)
+                started = time.perf_counter()
+                total_bytes = 0
+                factory = MessageFactory('sender@example.com', files) if builder == 'MessageFactory' else None
+                for recipient in recipients[:count]:
+                    personalized_subject = personalize_message(subject, recipient)
+                    personalized_body = personalize_message(body, recipient)
+                    if factory:
+                        message = factory.build(recipient.email, personalized_subject, personalized_body)
+                    else:
+                        message = EmailMessage(personalized_subject, personalized_body, 'sender@example.com', [recipient.email])
+                        for attachment in files:
+                            attachment.seek(0)
+                            message.attach(attachment.name, attachment.read(), attachment.content_type)
+                    total_bytes += len(message.message().as_bytes(linesep='\r\n'))
+                elapsed = time.perf_counter() - started
+                self.stdout.write(
+                    f"{case:<12} {builder:<16} {count / elapsed:>10.1f} {total_bytes / elapsed / 1e6:>8.1f}"
+                )
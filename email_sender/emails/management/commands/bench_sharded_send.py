@@ -0,0 +1,64 @@
+import subprocess
+import sys
+from django.core.management.base import BaseCommand
+from django.db.models import Max
+from emails.models import Campaign, EmailLog, Recipient
+from emails.sharding import create_campaign
+
+BENCH_DOMAIN = 'bench.echomailer.invalid'
+
+
+class Command(BaseCommand):
+    help = ("Benchmark sharded sending throughput with 1, 2, 4 and 8 worker processes. Only the send loop "
+            "is timed, from the first lease to the last email, not process startup. On SQLite every lease and "
+            "log write takes the single database write lock, so more workers are expected to be slower; "
+            "run it against PostgreSQL to measure scaling.")
+
+    def add_arguments(self, parser):
+        parser.add_argument('--recipients', type=int, default=2000)
+        parser.add_argument('--workers', type=int, nargs='+', default=[1, 2, 4, 8])
+        parser.add_argument('--shards', type=int, default=16)
+        parser.add_argument('--batch-size', type=int, default=50)
+        parser.add_argument('--backend', default='django.core.mail.backends.locmem.EmailBackend',
+                            help='Backend used by the workers (builds full MIME messages without network I/O)')
+
+    def handle(self, *args, **options):
+        Recipient.objects.filter(email__endswith=f'@{BENCH_DOMAIN}').delete()
+        Recipient.objects.bulk_create(
+            [Recipient(email=f'user{i}@{BENCH_DOMAIN}', company=f'Company {i % 50}') for i in range(options['recipients'])],
+            batch_size=1000,
+        )
+        recipients = Recipient.objects.filter(email__endswith=f'@{BENCH_DOMAIN}')
+
+        self.stdout.write(f"{'workers':>8} {'seconds':>10} {'emails/s':>10} {'sent':>8}")
+        try:
+            for worker_count in options['workers']:
+                campaign = create_campaign(
+                    'Benchmark {{company}}', 'Hello {{email}} from {{company}}', recipients,
+                    name=f'bench-{worker_count}', shard_count=options['shards'],
+                )
+                command = [
+                    sys.executable, sys.argv[0], 'send_worker',
+                    '--campaign', str(campaign.pk),
+                    '--worker-count', str(worker_count),
+                    '--batch-size', str(options['batch_size']),
+                    '--backend', options['backend'],
+                ]
+                processes = [
+                    subprocess.Popen(command + ['--worker-index', str(index)], stdout=subprocess.DEVNULL)
+                    for index in range(worker_count)
+                ]
+                for process in processes:
+                    process.wait()
+
+                # The first batch sets started_at; each email's sent_at ends the send loop
+                campaign.refresh_from_db()
+                last_sent = EmailLog.objects.filter(campaign=campaign).aggregate(last=Max('sent_at'))['last']
+                elapsed = (last_sent - campaign.started_at).total_seconds() if last_sent else 0.0
+                elapsed = max(elapsed, 1e-6)
+                sent = campaign.deliveries.filter(status='sent').count()
+                self.stdout.write(f"{worker_count:>8} {elapsed:>10.2f} {sent / elapsed:>10.1f} {sent:>8}")
+                campaign.delete()
+        finally:
+            Campaign.objects.filter(name__startswith='bench-').delete()
+            recipients.delete()
@@ -0,0 +1,20 @@
+from django.core.management.base import BaseCommand, CommandError
+from emails.models import ApiToken, Tenant
+
+
+class Command(BaseCommand):
+    help = "Create a JSON API token. The key is printed once and cannot be recovered later."
+
+    def add_arguments(self, parser):
+        parser.add_argument('name', help='Descriptive name for the token')
+        parser.add_argument('--tenant', help='Tenant (slug) whose data the token can access; the default tenant if omitted')
+
+    def handle(self, *args, **options):
+        tenant = None
+        if options['tenant']:
+            tenant = Tenant.objects.filter(slug=options['tenant']).first()
+            if tenant is None:
+                raise CommandError(f"Unknown tenant: {options['tenant']}")
+        token, raw_key = ApiToken.create_token(options['name'], tenant)
+        self.stdout.write(self.style.SUCCESS(f"Created API token '{token.name}' for tenant {token.tenant}"))
+        self.stdout.write(raw_key)
@@ -0,0 +1,31 @@
+from django.core.management.base import BaseCommand, CommandError
+from emails.models import Tenant
+from emails.exports import FORMATS, export_chunks, recipient_export, write_export
+
+
+class Command(BaseCommand):
+    help = "Stream recipients, including custom fields, to a CSV or NDJSON file (or stdout) in constant memory."
+
+    def add_arguments(self, parser):
+        parser.add_argument('--format', choices=list(FORMATS), default='csv')
+        parser.add_argument('--output', '-o', help='File to write (default: stdout)')
+        parser.add_argument('--suppressed', choices=['yes', 'no'], help='Only suppressed or only active recipients')
+        parser.add_argument('--campaign', help='Only recipients of this campaign ID')
+        parser.add_argument('--since', help='Created on or after this date/datetime')
+        parser.add_argument('--until', help='Created on or before this date/datetime')
+        parser.add_argument('--tenant', help='Only rows of this tenant (slug)')
+
+    def handle(self, *args, **options):
+        tenant = None
+        if options['tenant']:
+            tenant = Tenant.objects.filter(slug=options['tenant']).first()
+            if tenant is None:
+                raise CommandError(f"Unknown tenant: {options['tenant']}")
+        try:
+            columns, rows = recipient_export(options, tenant)
+            chunks = export_chunks(options['format'], columns, rows)
+        except ValueError as e:
+            raise CommandError(str(e))
+        written = write_export(chunks, options['output'])
+        if options['output']:
+            self.stderr.write(self.style.SUCCESS(f"Wrote {written} bytes to {options['output']}"))
@@ -0,0 +1,37 @@
+from django.core.management.base import BaseCommand, CommandError
+from emails.bounces import ImapSource, MailboxSource, process_bounces
+
+
+class Command(BaseCommand):
+    help = "Read bounce notifications (DSNs) from an mbox, Maildir or IMAP folder and mark matching emails as bounced."
+
+    def add_arguments(self, parser):
+        source = parser.add_mutually_exclusive_group(required=True)
+        source.add_argument('--mbox', help='Path to an mbox file')
+        source.add_argument('--maildir', help='Path to a Maildir directory')
+        source.add_argument('--imap', help='IMAP server host')
+        parser.add_argument('--imap-user')
+        parser.add_argument('--imap-password')
+        parser.add_argument('--imap-folder', default='INBOX')
+        parser.add_argument('--imap-port', type=int)
+        parser.add_argument('--no-ssl', action='store_true', help='Connect to IMAP without SSL')
+        parser.add_argument('--chunk-size', type=int, default=1000, help='Bounces matched and updated per batch')
+        parser.add_argument('--delete', action='store_true', help='Remove processed DSNs from the source')
+
+    def handle(self, *args, **options):
+        if options['imap']:
+            if not options['imap_user'] or not options['imap_password']:
+                raise CommandError('--imap-user and --imap-password are required with --imap')
+            source = ImapSource(
+                options['imap'], options['imap_user'], options['imap_password'], options['imap_folder'],
+                port=options['imap_port'], use_ssl=not options['no_ssl'],
+            )
+        else:
+            source = MailboxSource(options['maildir'] or options['mbox'], maildir=bool(options['maildir']))
+
+        results = process_bounces(source, options['chunk_size'], delete=options['delete'])
+        self.stdout.write(self.style.SUCCESS(
+            f"Read {results['messages']} messages ({results['ignored']} not DSNs): {results['bounced']} emails "
+            f"marked bounced, {results['already_bounced']} already bounced, {results['unmatched']} unmatched, "
+            f"{results['suppressed']} recipients suppressed"
+        ))
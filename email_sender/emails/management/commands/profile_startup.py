@@ -0,0 +1,99 @@
+import os
+import statistics
+import subprocess
+import sys
+import time
+from collections import defaultdict
+from django.conf import settings
+from django.core.management.base import BaseCommand, CommandError
+
+# How each process type starts, run from BASE_DIR with its own settings module
+ENTRY_POINTS = {
+    # A web worker loading the ASGI app (see gunicorn.conf.py) and URLconf, as before its first request
+    'web': ['-c', 'from email_sender.asgi import application\n'
+                  'from django.urls import get_resolver\n'
+                  'get_resolver().url_patterns'],
+    # A send worker started and exiting idle (campaign -1 never exists)
+    'worker': ['-m', 'email_sender.worker', '--campaign', '-1'],
+    # The same worker started through manage.py with the full web settings
+    'manage-worker': ['manage.py', 'send_worker', '--campaign', '-1'],
+}
+
+
+def _run(arguments, importtime=False):
+    """Run a Python process; returns (wall seconds, peak RSS in MB, stderr)"""
+    command = [sys.executable] + (['-X', 'importtime'] if importtime else []) + arguments
+    environment = {key: value for key, value in os.environ.items() if key != 'DJANGO_SETTINGS_MODULE'}
+    started = time.perf_counter()
+    process = subprocess.Popen(command, cwd=settings.BASE_DIR, env=environment,
+                               stdout=subprocess.DEVNULL, stderr=subprocess.PIPE)
+    stderr = process.stderr.read().decode(errors='replace')
+    _, status, usage = os.wait4(process.pid, 0)
+    elapsed = time.perf_counter() - started
+    process.returncode = os.waitstatus_to_exitcode(status)
+    if process.returncode:
+        raise CommandError(f"{' '.join(arguments)} exited with {process.returncode}:\n{stderr[-2000:]}")
+    # ru_maxrss is in kilobytes on Linux
+    return elapsed, usage.ru_maxrss / 1024, stderr
+
+
+def _import_profile(stderr):
+    """{module: self microseconds} from -X importtime output"""
+    modules = {}
+    for line in stderr.splitlines():
+        if not line.startswith('import time:') or 'imported package' in line:
+            continue
+        self_us, _, name = line[len('import time:'):].split('|')
+        modules[name.strip()] = int(self_us)
+    return modules
+
+
+class Command(BaseCommand):
+    help = ("Measure startup time and peak memory of the web and send worker processes, show where "
+            "import time goes, and check them against settings.STARTUP_BUDGETS.")
+
+    def add_arguments(self, parser):
+        parser.add_argument('--entry', choices=list(ENTRY_POINTS), nargs='+', default=list(ENTRY_POINTS))
+        parser.add_argument('--repeat', type=int, default=5, help='Runs per entry point; the median is reported')
+        parser.add_argument('--top', type=int, default=15, help='Packages and modules listed in the import profile')
+
+    def handle(self, *args, **options):
+        budgets = getattr(settings, 'STARTUP_BUDGETS', {})
+        over_budget = []
+        for name in options['entry']:
+            arguments = ENTRY_POINTS[name]
+            runs = [_run(arguments) for _ in range(max(options['repeat'], 1))]
+            seconds = statistics.median(run[0] for run in runs)
+            rss_mb = max(run[1] for run in runs)
+            modules = _import_profile(_run(arguments, importtime=True)[2])
+
+            self.stdout.write(self.style.MIGRATE_HEADING(name))
+            self.stdout.write(f"  startup {seconds * 1000:.0f} ms (median of {len(runs)}), peak RSS {rss_mb:.1f} MB, "
+                              f"{len(modules)} modules imported in {sum(modules.values()) / 1000:.0f} ms")
+            budget = budgets.get(name)
+            if budget:
+                problems = []
+                if seconds > budget['seconds']:
+                    problems.append(f"{seconds:.2f}s > {budget['seconds']}s")
+                if rss_mb > budget['rss_mb']:
+                    problems.append(f"{rss_mb:.1f} MB > {budget['rss_mb']} MB")
+                if problems:
+                    over_budget.append(name)
+                    self.stdout.write(self.style.ERROR(f"  over budget: {', '.join(problems)}"))
+                else:
+                    self.stdout.write(self.style.SUCCESS(
+                        f"  within budget ({budget['seconds']}s, {budget['rss_mb']} MB)"
+                    ))
+
+            packages = defaultdict(int)
+            for module, self_us in modules.items():
+                packages[module.split('.')[0]] += self_us
+            self.stdout.write("  import time by package (self, ms):")
+            for package, self_us in sorted(packages.items(), key=lambda item: -item[1])[:options['top']]:
+                self.stdout.write(f"    {package:<28} {self_us / 1000:>7.1f}")
+            self.stdout.write("  slowest modules (self, ms):")
+            for module, self_us in sorted(modules.items(), key=lambda item: -item[1])[:options['top']]:
+                self.stdout.write(f"    {module:<48} {self_us / 1000:>7.1f}")
+
+        if over_budget:
+            raise CommandError(f"Over the startup budget: {', '.join(over_budget)}")
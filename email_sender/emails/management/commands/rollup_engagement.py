@@ -0,0 +1,24 @@
+import time
+from django.core.management.base import BaseCommand
+from emails.tracking import rollup_events
+
+
+class Command(BaseCommand):
+    help = "Aggregate buffered open/click events into per-campaign, per-recipient engagement counts."
+
+    def add_arguments(self, parser):
+        parser.add_argument('--limit', type=int, default=50000, help='Events aggregated per transaction')
+        parser.add_argument('--loop', type=float, default=0,
+                            help='Keep running, checking for new events every N seconds')
+
+    def handle(self, *args, **options):
+        total = 0
+        while True:
+            processed = rollup_events(options['limit'])
+            total += processed
+            if processed >= options['limit']:
+                continue
+            if options['loop'] <= 0:
+                break
+            time.sleep(options['loop'])
+        self.stdout.write(self.style.SUCCESS(f"Rolled up {total} tracking events"))
@@ -0,0 +1,211 @@
+import statistics
+import threading
+import time
+from collections import Counter
+from contextlib import contextmanager, nullcontext
+from django.core.management.base import BaseCommand, CommandError
+from django.db import connections
+from emails.backends import EmailBackend
+from emails.models import Campaign, EmailLog, EmailSettings, Recipient
+from emails.sharding import create_campaign, run_worker
+from emails.smtpsink import SmtpSink
+from emails.utils import send_bulk_emails
+
+BENCH_DOMAIN = 'loadtest.echomailer.invalid'
+FROM_EMAIL = f'sender@{BENCH_DOMAIN}'
+CAMPAIGN_NAME = 'send-loadtest'
+
+
+class TimedEmailBackend(EmailBackend):
+    """SMTP backend that records how long each send took, connection setup included"""
+
+    def __init__(self, latencies, **kwargs):
+        super().__init__(**kwargs)
+        self.latencies = latencies
+
+    def send_messages(self, email_messages):
+        started = time.perf_counter()
+        try:
+            return super().send_messages(email_messages)
+        finally:
+            self.latencies.append(time.perf_counter() - started)
+
+
+@contextmanager
+def _without_delays():
+    """
+    Serve EmailSettings with the email and batch delays set to 0, in this process only.
+
+    The shared settings row is never written, so sends running in other
+    processes keep their delays and nothing needs restoring after a crash.
+    """
+    original = EmailSettings.__dict__['get_settings']
+
+    def get_settings():
+        instance = original.__get__(None, EmailSettings)()
+        instance.email_delay = instance.batch_delay = 0
+        return instance
+
+    EmailSettings.get_settings = staticmethod(get_settings)
+    try:
+        yield
+    finally:
+        EmailSettings.get_settings = original
+
+
+def _percentile(values, percent):
+    if not values:
+        return 0.0
+    values = sorted(values)
+    return values[min(len(values) - 1, int(len(values) * percent / 100))]
+
+
+class Command(BaseCommand):
+    help = ("Measure sustainable send throughput: seed recipients, start a local SMTP sink with the given "
+            "latency, failure rates and throttling, send a campaign through the real send path and report "
+            "throughput, latency percentiles and whether every outcome was recorded correctly.")
+
+    def add_arguments(self, parser):
+        parser.add_argument('--recipients', type=int, default=2000)
+        parser.add_argument('--domains', type=int, default=10, help='Destination domains the recipients are spread over')
+        parser.add_argument('--mode', choices=['immediate', 'worker'], default='worker',
+                            help='Send with send_bulk_emails (immediate) or send_worker threads (worker)')
+        parser.add_argument('--workers', type=int, default=1, help='send_worker threads in worker mode')
+        parser.add_argument('--batch-size', type=int, default=50, help='Deliveries leased per claim in worker mode')
+        parser.add_argument('--latency-ms', type=float, default=20, help='Sink delay before acknowledging a message')
+        parser.add_argument('--jitter-ms', type=float, default=10, help='Random extra sink delay of up to this much')
+        parser.add_argument('--fail-rate', type=float, default=0.01, help='Fraction of addresses the sink rejects (550)')
+        parser.add_argument('--defer-rate', type=float, default=0.01, help='Fraction of addresses the sink defers (451)')
+        parser.add_argument('--domain-rate', type=float, help='Messages per second a domain accepts before answering 451')
+        parser.add_argument('--ignore-delays', action='store_true',
+                            help='Send without the email and batch delays (in this process only; the settings are not changed)')
+        parser.add_argument('--keep', action='store_true', help='Keep the generated recipients, campaign and logs')
+
+    def handle(self, *args, **options):
+        for rate in ('fail_rate', 'defer_rate'):
+            if not 0 <= options[rate] <= 1:
+                raise CommandError(f"--{rate.replace('_', '-')} must be between 0 and 1")
+        if options['fail_rate'] + options['defer_rate'] > 1:
+            raise CommandError('--fail-rate and --defer-rate add up to more than 1')
+
+        recipients = self._generate(options['recipients'], options['domains'])
+        sink = SmtpSink(
+            '127.0.0.1', 0, latency_ms=options['latency_ms'], jitter_ms=options['jitter_ms'],
+            fail_rate=options['fail_rate'], defer_rate=options['defer_rate'], domain_rate=options['domain_rate'],
+        ).start()
+        host, port = sink.address
+        latencies = []
+
+        def make_connection():
+            return TimedEmailBackend(latencies, host=host, port=port, username='', password='',
+                                     use_tls=False, use_ssl=False, timeout=30)
+
+        subject, body = 'Load test for {{ company }}', 'Hello {{ email }},\n\nThis is a capacity test.'
+        try:
+            with _without_delays() if options['ignore_delays'] else nullcontext():
+                self._send(options, subject, body, recipients, sink, make_connection, latencies)
+        finally:
+            sink.stop()
+            if not options['keep']:
+                Campaign.objects.filter(name=CAMPAIGN_NAME).delete()
+                recipients.delete()
+
+    def _send(self, options, subject, body, recipients, sink, make_connection, latencies):
+        host, port = sink.address
+        self.stdout.write(f"Sending to {options['recipients']} recipients over {options['domains']} domains "
+                          f"({options['mode']} mode) via the sink on {host}:{port}")
+        started = time.perf_counter()
+        if options['mode'] == 'immediate':
+            campaign = create_campaign(subject, body, recipients, name=CAMPAIGN_NAME, status='sending')
+            send_bulk_emails(
+                subject, body, recipients.filter(delivery__campaign=campaign), campaign=campaign,
+                connection=make_connection(), from_email=FROM_EMAIL,
+            )
+        else:
+            campaign = create_campaign(subject, body, recipients, name=CAMPAIGN_NAME)
+            self._run_workers(campaign, options['workers'], options['batch_size'], make_connection)
+        elapsed = time.perf_counter() - started
+        self._report(campaign, sink, latencies, elapsed, options['recipients'])
+
+    def _generate(self, count, domains):
+        Recipient.objects.filter(email__endswith=f'.{BENCH_DOMAIN}').delete()
+        Recipient.objects.bulk_create(
+            [Recipient(email=f'load{i}@d{i % domains}.{BENCH_DOMAIN}',
+                       email_normalized=f'load{i}@d{i % domains}.{BENCH_DOMAIN}',
+                       company=f'Company {i % 50}') for i in range(count)],
+            batch_size=1000,
+        )
+        return Recipient.objects.filter(email__endswith=f'.{BENCH_DOMAIN}')
+
+    def _run_workers(self, campaign, worker_count, batch_size, make_connection):
+        errors = []
+
+        def work(index):
+            try:
+                run_worker(
+                    worker_id=f'loadtest-{index}', campaign_id=campaign.pk, worker_index=index,
+                    worker_count=worker_count, batch_size=batch_size,
+                    connection=make_connection(), from_email=FROM_EMAIL,
+                )
+            except Exception as e:
+                errors.append(e)
+            finally:
+                connections.close_all()
+
+        threads = [threading.Thread(target=work, args=(index,)) for index in range(worker_count)]
+        for thread in threads:
+            thread.start()
+        for thread in threads:
+            thread.join()
+        if errors:
+            raise errors[0]
+
+    def _report(self, campaign, sink, latencies, elapsed, total):
+        stats = sink.stats.snapshot()
+        self.stdout.write(f"Elapsed:        {elapsed:.2f}s")
+        self.stdout.write(f"Throughput:     {stats['accepted'] / elapsed:.1f} accepted/s, "
+                          f"{len(latencies) / elapsed:.1f} attempts/s")
+        self.stdout.write(f"Send latency:   p50 {_percentile(latencies, 50) * 1000:.1f} ms  "
+                          f"p95 {_percentile(latencies, 95) * 1000:.1f} ms  "
+                          f"p99 {_percentile(latencies, 99) * 1000:.1f} ms  "
+                          f"max {max(latencies, default=0) * 1000:.1f} ms")
+        if sink.stats.transaction_seconds:
+            self.stdout.write(f"Sink time:      mean {statistics.mean(sink.stats.transaction_seconds) * 1000:.1f} ms "
+                              f"per message")
+        self.stdout.write(f"Sink:           accepted {stats['accepted']}  rejected {stats['rejected']}  "
+                          f"deferred {stats['deferred']}  throttled {stats['throttled']}  "
+                          f"connections {stats['connections']}")
+
+        logs = Counter()
+        outcomes = {'sent': set(), 'failed': set()}
+        for email, status in EmailLog.objects.filter(campaign=campaign).values_list('recipient__email', 'status'):
+            logs[email] += 1
+            outcomes.setdefault(status, set()).add(email)
+        accepted = set(sink.stats.accepted)
+        deferred = set(sink.stats.deferred) | set(sink.stats.throttled)
+        refused = set(sink.stats.rejected) | deferred
+        # Send workers keep deferred deliveries pending and retry them after a backoff
+        retrying = set(
+            campaign.deliveries.filter(status='pending').values_list('recipient__email', flat=True)
+        )
+        if retrying:
+            self.stdout.write(f"Awaiting retry: {len(retrying)} deferred deliveries")
+
+        checks = [
+            ('every recipient logged or awaiting retry', total - len(set(logs) | retrying)),
+            ('no recipient logged twice', sum(1 for count in logs.values() if count > 1)),
+            ('no duplicate deliveries', stats['duplicates']),
+            ('sent logs match the sink', len(outcomes['sent'] ^ accepted)),
+            ('refusals logged as failed or retried', len(refused - accepted - outcomes['failed'] - retrying)),
+            ('only deferred deliveries left pending', len(retrying - deferred)),
+            ('no deliveries left leased', campaign.deliveries.exclude(lease_owner='').count()),
+            ('no deliveries in another status', campaign.deliveries.exclude(status__in=['sent', 'failed', 'pending']).count()),
+        ]
+        failed = [name for name, problems in checks if problems]
+        for name, problems in checks:
+            if problems:
+                self.stdout.write(self.style.ERROR(f"FAIL  {name}: {problems} mismatched"))
+            else:
+                self.stdout.write(self.style.SUCCESS(f"ok    {name}"))
+        if failed:
+            raise CommandError(f"{len(failed)} correctness checks failed")
@@ -0,0 +1,54 @@
+from django.core.mail import get_connection
+from django.core.management.base import BaseCommand, CommandError
+from django.conf import settings
+from emails.models import Tenant
+from emails.sharding import run_worker
+
+
+class Command(BaseCommand):
+    help = "Send queued campaigns. Run several copies (on one or more hosts) to shard the work."
+
+    def add_arguments(self, parser):
+        parser.add_argument('--campaign', type=int, help='Only process this campaign ID')
+        parser.add_argument('--tenant', help="Only process this tenant's campaigns (slug), e.g. for workers dedicated to a large tenant")
+        parser.add_argument('--worker-index', type=int, default=0, help='Index of this worker (0-based)')
+        parser.add_argument('--worker-count', type=int, default=1, help='Total number of workers sharing the shards')
+        parser.add_argument('--worker-id', help='Lease owner name (defaults to host:pid:random)')
+        parser.add_argument('--batch-size', type=int, default=50, help='Deliveries leased per claim')
+        parser.add_argument('--lease-seconds', type=int, default=300, help='How long a claim is held before others may take it over')
+        parser.add_argument('--poll-interval', type=float, default=0, help='Keep polling for new campaigns every N seconds (0 = exit when idle)')
+        parser.add_argument('--backend', help='Email backend to use instead of the active credential (e.g. for benchmarks)')
+
+    def handle(self, *args, **options):
+        if not 0 <= options['worker_index'] < options['worker_count']:
+            raise CommandError('--worker-index must be between 0 and --worker-count - 1')
+
+        tenant_id = None
+        if options['tenant']:
+            tenant_id = Tenant.objects.filter(slug=options['tenant']).values_list('pk', flat=True).first()
+            if tenant_id is None:
+                raise CommandError(f"Unknown tenant: {options['tenant']}")
+
+        connection = from_email = None
+        if options['backend']:
+            connection = get_connection(backend=options['backend'])
+            from_email = settings.DEFAULT_FROM_EMAIL or 'noreply@localhost'
+
+        totals = run_worker(
+            worker_id=options['worker_id'],
+            campaign_id=options['campaign'],
+            worker_index=options['worker_index'],
+            worker_count=options['worker_count'],
+            batch_size=options['batch_size'],
+            lease_seconds=options['lease_seconds'],
+            poll_interval=options['poll_interval'],
+            connection=connection,
+            from_email=from_email,
+            tenant_id=tenant_id,
+        )
+        self.stdout.write(self.style.SUCCESS(f"Sent {totals['success']} emails. Failed: {totals['failed']}"))
+        for lane, metrics in totals['lanes'].items():
+            self.stdout.write(
+                f"  {lane:<14} sent {metrics['sent']:>7}  wait p50 {metrics['wait_p50_ms']} ms"
+                f"  p95 {metrics['wait_p95_ms']} ms  max {metrics['wait_max_ms']} ms"
+            )
@@ -0,0 +1,77 @@
+from django.core.management.base import BaseCommand, CommandError
+from emails.attachments import campaign_attachment_refs
+from emails.models import Campaign, EmailTemplate, Recipient
+from emails.simulation import ASSUMED_SMTP_SECONDS, DEFAULT_SAMPLE, simulate_send
+
+
+def _format_bytes(size):
+    for unit in ('B', 'KB', 'MB', 'GB'):
+        if size < 1024 or unit == 'GB':
+            return f"{size:.1f} {unit}"
+        size /= 1024
+
+
+def _format_duration(seconds):
+    minutes, seconds = divmod(int(round(seconds)), 60)
+    hours, minutes = divmod(minutes, 60)
+    return f"{hours}h {minutes:02d}m {seconds:02d}s"
+
+
+class Command(BaseCommand):
+    help = (
+        "Dry-run a send: render and build the messages against a null transport and estimate its "
+        "size and duration under the current pacing settings. Nothing is sent or logged."
+    )
+
+    def add_arguments(self, parser):
+        source = parser.add_mutually_exclusive_group(required=True)
+        source.add_argument('--campaign', type=int, help='Simulate the pending deliveries of this campaign')
+        source.add_argument('--template', type=int, help="Simulate this template sent to every active recipient of its tenant")
+        parser.add_argument('--sample', type=int, default=DEFAULT_SAMPLE,
+                            help='Recipients actually rendered; the rest is extrapolated (0 renders all)')
+        parser.add_argument('--smtp-ms', type=float, default=ASSUMED_SMTP_SECONDS * 1000,
+                            help='Assumed milliseconds per SMTP transaction')
+        parser.add_argument('--workers', type=int, default=0,
+                            help='Project a queued send over this many send_worker processes')
+
+    def handle(self, *args, **options):
+        if options['campaign']:
+            campaign = Campaign.objects.filter(pk=options['campaign']).first()
+            if campaign is None:
+                raise CommandError(f"Campaign {options['campaign']} does not exist")
+            subject, body = campaign.subject, campaign.body
+            recipients = Recipient.objects.filter(delivery__campaign=campaign, delivery__status='pending')
+            attachments = campaign_attachment_refs(campaign)
+            tracking = {'track_opens': campaign.track_opens, 'track_clicks': campaign.track_clicks}
+        else:
+            template = EmailTemplate.objects.filter(pk=options['template']).first()
+            if template is None:
+                raise CommandError(f"Template {options['template']} does not exist")
+            subject, body = template.subject, template.body
+            recipients = Recipient.objects.for_tenant(template.tenant_id)
+            attachments = []
+            tracking = {}
+
+        results = simulate_send(
+            subject, body, recipients, attachments,
+            sample=options['sample'] or None,
+            smtp_seconds=options['smtp_ms'] / 1000,
+            workers=options['workers'] or None,
+            **tracking,
+        )
+
+        self.stdout.write(f"Recipients:          {results['recipients']} ({results['simulated']} rendered)")
+        self.stdout.write(f"Render throughput:   {results['render_per_second']} msgs/s")
+        self.stdout.write(f"Build throughput:    {results['build_per_second']} msgs/s")
+        self.stdout.write(f"Message size:        {_format_bytes(results['bytes_per_message'])} "
+                          f"({results['attachments']} attachments)")
+        self.stdout.write(f"Total on the wire:   {_format_bytes(results['total_bytes'])}")
+        self.stdout.write(f"Rendering/building:  {_format_duration(results['cpu_seconds'])}")
+        self.stdout.write(f"SMTP (assumed):      {_format_duration(results['smtp_seconds'])}")
+        self.stdout.write(f"Configured delays:   {_format_duration(results['delay_seconds'])}")
+        if results['slowest_domain']:
+            self.stdout.write(f"Slowest domain:      {results['slowest_domain']} needs "
+                              f"{_format_duration(results['slowest_domain_seconds'])} at its rate limit")
+        for error in results['errors']:
+            self.stdout.write(self.style.WARNING(f"Render failed for {error}"))
+        self.stdout.write(self.style.SUCCESS(f"Projected duration:  {_format_duration(results['projected_seconds'])}"))
@@ -0,0 +1,40 @@
+import time
+from django.core.management.base import BaseCommand
+from emails.smtpsink import SmtpSink
+
+
+class Command(BaseCommand):
+    help = ("Run a local SMTP server that accepts and discards mail, with configurable latency, failure "
+            "rates and per-domain throttling. Point an email credential (host, port, no TLS) at it to "
+            "measure send capacity without reaching real providers.")
+
+    def add_arguments(self, parser):
+        parser.add_argument('--host', default='127.0.0.1')
+        parser.add_argument('--port', type=int, default=2525)
+        parser.add_argument('--latency-ms', type=float, default=0, help='Delay before each message is acknowledged')
+        parser.add_argument('--jitter-ms', type=float, default=0, help='Random extra delay of up to this much')
+        parser.add_argument('--fail-rate', type=float, default=0.0, help='Fraction of addresses rejected with 550')
+        parser.add_argument('--defer-rate', type=float, default=0.0, help='Fraction of addresses deferred with 451')
+        parser.add_argument('--domain-rate', type=float, help='Messages per second a domain accepts before answering 451')
+        parser.add_argument('--stats-interval', type=float, default=5, help='Print counters every N seconds')
+
+    def handle(self, *args, **options):
+        sink = SmtpSink(
+            options['host'], options['port'], latency_ms=options['latency_ms'], jitter_ms=options['jitter_ms'],
+            fail_rate=options['fail_rate'], defer_rate=options['defer_rate'], domain_rate=options['domain_rate'],
+        ).start()
+        host, port = sink.address
+        self.stdout.write(self.style.SUCCESS(f"SMTP sink listening on {host}:{port} (Ctrl+C to stop)"))
+        try:
+            while True:
+                time.sleep(options['stats_interval'])
+                stats = sink.stats.snapshot()
+                self.stdout.write(
+                    f"accepted {stats['accepted']} ({stats['accepted_per_second']}/s)  rejected {stats['rejected']}  "
+                    f"deferred {stats['deferred']}  throttled {stats['throttled']}  "
+                    f"duplicates {stats['duplicates']}  connections {stats['connections']}"
+                )
+        except KeyboardInterrupt:
+            pass
+        finally:
+            sink.stop()
@@ -0,0 +1,58 @@
+import bisect
+import threading
+
+# Upper bounds in milliseconds; the last bucket catches everything slower
+DEFAULT_BUCKETS_MS = [5, 10, 25, 50, 100, 200, 300, 500, 1000, 2000, 5000, 10000, 30000]
+
+
+class LatencyHistogram:
+    """Thread-safe fixed-bucket latency histogram with percentile estimates"""
+
+    def __init__(self, buckets_ms=None):
+        self.buckets_ms = list(buckets_ms or DEFAULT_BUCKETS_MS)
+        self.lock = threading.Lock()
+        self.reset()
+
+    def reset(self):
+        with self.lock:
+            self.counts = [0] * (len(self.buckets_ms) + 1)
+            self.count = 0
+            self.total_ms = 0.0
+            self.max_ms = 0.0
+
+    def observe(self, seconds, count=1):
+        ms = seconds * 1000
+        with self.lock:
+            self.counts[bisect.bisect_left(self.buckets_ms, ms)] += count
+            self.count += count
+            self.total_ms += ms * count
+            self.max_ms = max(self.max_ms, ms)
+
+    def percentile(self, fraction):
+        """Upper bound of the bucket containing the given percentile (0-1), capped at the max seen"""
+        with self.lock:
+            if not self.count:
+                return None
+            threshold = fraction * self.count
+            seen = 0
+            for index, bucket_count in enumerate(self.counts):
+                seen += bucket_count
+                if seen >= threshold:
+                    bound = self.buckets_ms[index] if index < len(self.buckets_ms) else self.max_ms
+                    return round(min(bound, self.max_ms), 1)
+            return self.max_ms
+
+    def snapshot(self):
+        with self.lock:
+            buckets = {f"le_{bound}ms": count for bound, count in zip(self.buckets_ms, self.counts)}
+            buckets['le_inf'] = self.counts[-1]
+            count, total_ms, max_ms = self.count, self.total_ms, self.max_ms
+        return {
+            'count': count,
+            'mean_ms': round(total_ms / count, 2) if count else None,
+            'max_ms': round(max_ms, 2),
+            'p50_ms': self.percentile(0.50),
+            'p95_ms': self.percentile(0.95),
+            'p99_ms': self.percentile(0.99),
+            'buckets': buckets,
+        }
@@ -0,0 +1,57 @@
+# Generated by Django 5.2.7 on 2026-10-19 18:52
+
+import django.db.models.deletion
+from django.db import migrations, models
+
+
+class Migration(migrations.Migration):
+
+    dependencies = [
+        ('emails', '0004_emailsettings_emaillog_attachment_count_and_more'),
+    ]
+
+    operations = [
+        migrations.CreateModel(
+            name='Campaign',
+            fields=[
+                ('id', models.BigAutoField(auto_created=True, primary_key=True, serialize=False, verbose_name='ID')),
+                ('name', models.CharField(blank=True, max_length=200)),
+                ('subject', models.CharField(max_length=300)),
+                ('body', models.TextField()),
+                ('status', models.CharField(choices=[('queued', 'Queued'), ('running', 'Running'), ('completed', 'Completed'), ('cancelled', 'Cancelled')], default='queued', max_length=20)),
+                ('shard_count', models.PositiveIntegerField(default=16, help_text='Number of shards recipients are partitioned into')),
+                ('shard_key', models.CharField(choices=[('id', 'Recipient ID'), ('domain', 'Recipient domain')], default='id', max_length=10)),
+                ('created_at', models.DateTimeField(auto_now_add=True)),
+                ('started_at', models.DateTimeField(blank=True, null=True)),
+                ('completed_at', models.DateTimeField(blank=True, null=True)),
+                ('template', models.ForeignKey(blank=True, null=True, on_delete=django.db.models.deletion.SET_NULL, to='emails.emailtemplate')),
+            ],
+            options={
+                'ordering': ['-created_at'],
+            },
+        ),
+        migrations.AddField(
+            model_name='emaillog',
+            name='campaign',
+            field=models.ForeignKey(blank=True, null=True, on_delete=django.db.models.deletion.SET_NULL, to='emails.campaign'),
+        ),
+        migrations.CreateModel(
+            name='Delivery',
+            fields=[
+                ('id', models.BigAutoField(auto_created=True, primary_key=True, serialize=False, verbose_name='ID')),
+                ('shard', models.PositiveIntegerField()),
+                ('status', models.CharField(choices=[('pending', 'Pending'), ('sent', 'Sent'), ('failed', 'Failed')], default='pending', max_length=20)),
+                ('lease_owner', models.CharField(blank=True, max_length=100)),
+                ('lease_expires_at', models.DateTimeField(blank=True, null=True)),
+                ('attempts', models.PositiveIntegerField(default=0)),
+                ('updated_at', models.DateTimeField(auto_now=True)),
+                ('campaign', models.ForeignKey(on_delete=django.db.models.deletion.CASCADE, related_name='deliveries', to='emails.campaign')),
+                ('recipient', models.ForeignKey(on_delete=django.db.models.deletion.CASCADE, to='emails.recipient')),
+            ],
+            options={
+                'verbose_name_plural': 'Deliveries',
+                'indexes': [models.Index(fields=['campaign', 'status', 'shard'], name='delivery_claim_idx')],
+                'constraints': [models.UniqueConstraint(fields=('campaign', 'recipient'), name='unique_campaign_recipient')],
+            },
+        ),
+    ]
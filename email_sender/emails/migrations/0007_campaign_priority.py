@@ -0,0 +1,18 @@
+# Generated by Django 5.2.7 on 2026-10-19 18:56
+
+from django.db import migrations, models
+
+
+class Migration(migrations.Migration):
+
+    dependencies = [
+        ('emails', '0006_apitoken'),
+    ]
+
+    operations = [
+        migrations.AddField(
+            model_name='campaign',
+            name='priority',
+            field=models.PositiveSmallIntegerField(choices=[(0, 'Transactional'), (5, 'Normal'), (10, 'Bulk')], default=10),
+        ),
+    ]
@@ -0,0 +1,18 @@
+# Generated by Django 5.2.7 on 2026-10-19 18:57
+
+from django.db import migrations, models
+
+
+class Migration(migrations.Migration):
+
+    dependencies = [
+        ('emails', '0007_campaign_priority'),
+    ]
+
+    operations = [
+        migrations.AddField(
+            model_name='campaign',
+            name='weight',
+            field=models.PositiveSmallIntegerField(default=1, help_text='Share of sending capacity relative to other campaigns in the same priority lane'),
+        ),
+    ]
@@ -0,0 +1,18 @@
+# Generated by Django 5.2.7 on 2026-10-19 19:01
+
+from django.db import migrations, models
+
+
+class Migration(migrations.Migration):
+
+    dependencies = [
+        ('emails', '0008_campaign_weight'),
+    ]
+
+    operations = [
+        migrations.AddField(
+            model_name='emailsettings',
+            name='version',
+            field=models.PositiveIntegerField(default=0, editable=False, help_text='Incremented on every save so processes can detect changes cheaply'),
+        ),
+    ]
@@ -0,0 +1,75 @@
+# Generated by Django 5.2.7 on 2026-10-19 19:07
+
+import django.db.models.deletion
+import django.utils.timezone
+from django.db import migrations, models
+
+
+class Migration(migrations.Migration):
+
+    dependencies = [
+        ('emails', '0010_attachment_store'),
+    ]
+
+    operations = [
+        migrations.CreateModel(
+            name='RollupCursor',
+            fields=[
+                ('id', models.BigAutoField(auto_created=True, primary_key=True, serialize=False, verbose_name='ID')),
+                ('name', models.CharField(max_length=50, unique=True)),
+                ('position', models.BigIntegerField(default=0, help_text='Highest row id already aggregated')),
+                ('updated_at', models.DateTimeField(auto_now=True)),
+            ],
+        ),
+        migrations.AddField(
+            model_name='campaign',
+            name='track_clicks',
+            field=models.BooleanField(default=False, help_text='Rewrite links to go through the click tracker'),
+        ),
+        migrations.AddField(
+            model_name='campaign',
+            name='track_opens',
+            field=models.BooleanField(default=False, help_text='Add an open-tracking pixel (sends an HTML part)'),
+        ),
+        migrations.AddField(
+            model_name='emailsettings',
+            name='track_clicks',
+            field=models.BooleanField(default=False, help_text='Rewrite links so clicks are recorded before redirecting'),
+        ),
+        migrations.AddField(
+            model_name='emailsettings',
+            name='track_opens',
+            field=models.BooleanField(default=False, help_text='Track opens with a pixel in an HTML version of each email'),
+        ),
+        migrations.CreateModel(
+            name='TrackingEvent',
+            fields=[
+                ('id', models.BigAutoField(auto_created=True, primary_key=True, serialize=False, verbose_name='ID')),
+                ('kind', models.CharField(choices=[('open', 'Open'), ('click', 'Click')], max_length=10)),
+                ('url', models.TextField(blank=True)),
+                ('user_agent', models.CharField(blank=True, max_length=255)),
+                ('created_at', models.DateTimeField(default=django.utils.timezone.now)),
+                ('campaign', models.ForeignKey(blank=True, db_constraint=False, null=True, on_delete=django.db.models.deletion.DO_NOTHING, to='emails.campaign')),
+                ('recipient', models.ForeignKey(db_constraint=False, on_delete=django.db.models.deletion.DO_NOTHING, to='emails.recipient')),
+            ],
+            options={
+                'ordering': ['-pk'],
+            },
+        ),
+        migrations.CreateModel(
+            name='Engagement',
+            fields=[
+                ('id', models.BigAutoField(auto_created=True, primary_key=True, serialize=False, verbose_name='ID')),
+                ('opens', models.PositiveIntegerField(default=0)),
+                ('clicks', models.PositiveIntegerField(default=0)),
+                ('first_opened_at', models.DateTimeField(blank=True, null=True)),
+                ('first_clicked_at', models.DateTimeField(blank=True, null=True)),
+                ('last_event_at', models.DateTimeField(blank=True, null=True)),
+                ('campaign', models.ForeignKey(blank=True, null=True, on_delete=django.db.models.deletion.CASCADE, related_name='engagements', to='emails.campaign')),
+                ('recipient', models.ForeignKey(on_delete=django.db.models.deletion.CASCADE, related_name='engagements', to='emails.recipient')),
+            ],
+            options={
+                'constraints': [models.UniqueConstraint(fields=('campaign', 'recipient'), name='unique_engagement')],
+            },
+        ),
+    ]
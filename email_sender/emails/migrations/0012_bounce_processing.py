@@ -0,0 +1,38 @@
+# Generated by Django 5.2.7 on 2026-10-19 19:11
+
+from django.db import migrations, models
+
+
+class Migration(migrations.Migration):
+
+    dependencies = [
+        ('emails', '0011_engagement_tracking'),
+    ]
+
+    operations = [
+        migrations.AddField(
+            model_name='emaillog',
+            name='message_id',
+            field=models.CharField(blank=True, db_index=True, help_text='Message-ID header, used to match bounces', max_length=255),
+        ),
+        migrations.AddField(
+            model_name='recipient',
+            name='bounce_count',
+            field=models.PositiveIntegerField(default=0, help_text='Bounces received for this address'),
+        ),
+        migrations.AddField(
+            model_name='recipient',
+            name='is_suppressed',
+            field=models.BooleanField(default=False, help_text='Hard bounced; excluded from new sends'),
+        ),
+        migrations.AddField(
+            model_name='recipient',
+            name='last_bounced_at',
+            field=models.DateTimeField(blank=True, null=True),
+        ),
+        migrations.AlterField(
+            model_name='emaillog',
+            name='status',
+            field=models.CharField(choices=[('pending', 'Pending'), ('sent', 'Sent'), ('failed', 'Failed'), ('bounced', 'Bounced')], default='pending', max_length=20),
+        ),
+    ]
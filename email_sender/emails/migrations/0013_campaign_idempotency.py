@@ -0,0 +1,23 @@
+# Generated by Django 5.2.7 on 2026-10-19 19:17
+
+from django.db import migrations, models
+
+
+class Migration(migrations.Migration):
+
+    dependencies = [
+        ('emails', '0012_bounce_processing'),
+    ]
+
+    operations = [
+        migrations.AddField(
+            model_name='campaign',
+            name='idempotency_key',
+            field=models.CharField(blank=True, help_text='Client supplied key; repeating a request with the same key returns this campaign instead of sending again', max_length=100, null=True, unique=True),
+        ),
+        migrations.AlterField(
+            model_name='campaign',
+            name='status',
+            field=models.CharField(choices=[('queued', 'Queued'), ('running', 'Running'), ('sending', 'Sending (immediate)'), ('completed', 'Completed'), ('cancelled', 'Cancelled')], default='queued', max_length=20),
+        ),
+    ]
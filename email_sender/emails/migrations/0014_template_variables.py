@@ -0,0 +1,32 @@
+# Generated by Django 5.2.7 on 2026-10-19 19:21
+
+from django.db import migrations, models
+from django.template import TemplateSyntaxError
+
+
+def fill_variables(apps, schema_editor):
+    from emails.templating import template_variables
+
+    EmailTemplate = apps.get_model('emails', 'EmailTemplate')
+    for template in EmailTemplate.objects.all():
+        try:
+            template.variables = sorted(set(template_variables(template.subject)) | set(template_variables(template.body)))
+        except TemplateSyntaxError:
+            continue
+        template.save(update_fields=['variables'])
+
+
+class Migration(migrations.Migration):
+
+    dependencies = [
+        ('emails', '0013_campaign_idempotency'),
+    ]
+
+    operations = [
+        migrations.AddField(
+            model_name='emailtemplate',
+            name='variables',
+            field=models.JSONField(blank=True, default=list, editable=False, help_text='Variables used by subject and body, filled in on save'),
+        ),
+        migrations.RunPython(fill_variables, migrations.RunPython.noop),
+    ]
@@ -0,0 +1,29 @@
+# Generated by Django 5.2.7 on 2026-10-19 19:24
+
+from django.db import migrations, models
+
+
+class Migration(migrations.Migration):
+
+    dependencies = [
+        ('emails', '0014_template_variables'),
+    ]
+
+    operations = [
+        migrations.CreateModel(
+            name='CustomField',
+            fields=[
+                ('id', models.BigAutoField(auto_created=True, primary_key=True, serialize=False, verbose_name='ID')),
+                ('name', models.CharField(max_length=50, unique=True)),
+                ('created_at', models.DateTimeField(auto_now_add=True)),
+            ],
+            options={
+                'ordering': ['name'],
+            },
+        ),
+        migrations.AddField(
+            model_name='recipient',
+            name='custom_fields',
+            field=models.JSONField(blank=True, default=dict, help_text='Extra merge fields such as first_name or plan, imported from CSV columns'),
+        ),
+    ]
@@ -0,0 +1,59 @@
+# Generated by Django 5.2.7 on 2026-10-19 19:30
+
+from django.db import migrations, models
+
+
+def normalize_email(email):
+    """
+    Frozen copy of emails.validation.normalize_email, so later changes there
+    cannot change what this migration writes.
+    """
+    local, at, domain = (email or '').strip().rpartition('@')
+    if not at:
+        return domain.lower()
+    domain = domain.rstrip('.').lower()
+    try:
+        domain = domain.encode('idna').decode('ascii')
+    except UnicodeError:
+        pass
+    return f'{local.lower()}@{domain}'
+
+
+def fill_email_normalized(apps, schema_editor):
+    Recipient = apps.get_model('emails', 'Recipient')
+    seen = set()
+    batch = []
+    for recipient in Recipient.objects.order_by('pk').only('pk', 'email').iterator(chunk_size=2000):
+        normalized = normalize_email(recipient.email)
+        # Existing case-variant duplicates keep NULL; they can be merged by hand
+        if normalized in seen:
+            continue
+        seen.add(normalized)
+        recipient.email_normalized = normalized
+        batch.append(recipient)
+        if len(batch) >= 2000:
+            Recipient.objects.bulk_update(batch, ['email_normalized'])
+            batch = []
+    if batch:
+        Recipient.objects.bulk_update(batch, ['email_normalized'])
+
+
+class Migration(migrations.Migration):
+
+    dependencies = [
+        ('emails', '0015_recipient_custom_fields'),
+    ]
+
+    operations = [
+        migrations.AddField(
+            model_name='recipient',
+            name='email_check',
+            field=models.CharField(blank=True, choices=[('', 'Not checked'), ('ok', 'Valid'), ('role', 'Role address'), ('disposable', 'Disposable domain')], help_text='Result of the import validation', max_length=20),
+        ),
+        migrations.AddField(
+            model_name='recipient',
+            name='email_normalized',
+            field=models.CharField(editable=False, help_text='Trimmed, lowercased address; duplicates are detected on this key', max_length=254, null=True, unique=True),
+        ),
+        migrations.RunPython(fill_email_normalized, migrations.RunPython.noop),
+    ]
@@ -0,0 +1,29 @@
+# Generated by Django 5.2.7 on 2026-10-19 19:34
+
+from django.db import migrations, models
+
+
+class Migration(migrations.Migration):
+
+    dependencies = [
+        ('emails', '0016_recipient_email_normalized'),
+    ]
+
+    operations = [
+        migrations.AddIndex(
+            model_name='emaillog',
+            index=models.Index(fields=['created_at', 'id'], name='emaillog_created_idx'),
+        ),
+        migrations.AddIndex(
+            model_name='emaillog',
+            index=models.Index(fields=['status', 'created_at'], name='emaillog_status_created_idx'),
+        ),
+        migrations.AddIndex(
+            model_name='recipient',
+            index=models.Index(fields=['created_at'], name='recipient_created_idx'),
+        ),
+        migrations.AddIndex(
+            model_name='recipient',
+            index=models.Index(fields=['email_normalized'], name='recipient_email_prefix_idx', opclasses=['varchar_pattern_ops']),
+        ),
+    ]
@@ -0,0 +1,72 @@
+# Generated by Django 5.2.7 on 2026-10-19 19:37
+
+import django.db.models.deletion
+from django.db import migrations, models
+
+
+class Migration(migrations.Migration):
+
+    dependencies = [
+        ('emails', '0017_admin_indexes'),
+    ]
+
+    operations = [
+        migrations.AddField(
+            model_name='campaign',
+            name='test_percent',
+            field=models.PositiveSmallIntegerField(default=0, help_text='Percentage of recipients that receive the A/B test variants; 0 when the campaign has no variants'),
+        ),
+        migrations.AddField(
+            model_name='campaign',
+            name='test_wait_minutes',
+            field=models.PositiveIntegerField(default=240, help_text='Time between the last test email and choosing the winner'),
+        ),
+        migrations.AddField(
+            model_name='campaign',
+            name='winner_decide_at',
+            field=models.DateTimeField(blank=True, help_text='When the winner is chosen, set once the test emails are sent', null=True),
+        ),
+        migrations.AddField(
+            model_name='campaign',
+            name='winner_metric',
+            field=models.CharField(choices=[('opens', 'Open rate'), ('clicks', 'Click rate')], default='opens', help_text='Rate the winning variant is chosen by', max_length=10),
+        ),
+        migrations.AlterField(
+            model_name='campaign',
+            name='status',
+            field=models.CharField(choices=[('queued', 'Queued'), ('running', 'Running'), ('sending', 'Sending (immediate)'), ('testing', 'Testing variants'), ('completed', 'Completed'), ('cancelled', 'Cancelled')], default='queued', max_length=20),
+        ),
+        migrations.AlterField(
+            model_name='delivery',
+            name='status',
+            field=models.CharField(choices=[('pending', 'Pending'), ('held', 'Held for winner'), ('sent', 'Sent'), ('failed', 'Failed')], default='pending', max_length=20),
+        ),
+        migrations.CreateModel(
+            name='CampaignVariant',
+            fields=[
+                ('id', models.BigAutoField(auto_created=True, primary_key=True, serialize=False, verbose_name='ID')),
+                ('label', models.CharField(max_length=1)),
+                ('subject', models.CharField(max_length=300)),
+                ('body', models.TextField()),
+                ('sent', models.PositiveIntegerField(default=0)),
+                ('failed', models.PositiveIntegerField(default=0)),
+                ('opens', models.PositiveIntegerField(default=0, help_text='Recipients who opened at least once')),
+                ('clicks', models.PositiveIntegerField(default=0, help_text='Recipients who clicked at least once')),
+                ('is_winner', models.BooleanField(default=False)),
+                ('campaign', models.ForeignKey(on_delete=django.db.models.deletion.CASCADE, related_name='variants', to='emails.campaign')),
+                ('template', models.ForeignKey(blank=True, null=True, on_delete=django.db.models.deletion.SET_NULL, to='emails.emailtemplate')),
+            ],
+            options={
+                'ordering': ['label'],
+            },
+        ),
+        migrations.AddField(
+            model_name='delivery',
+            name='variant',
+            field=models.ForeignKey(blank=True, null=True, on_delete=django.db.models.deletion.SET_NULL, related_name='deliveries', to='emails.campaignvariant'),
+        ),
+        migrations.AddConstraint(
+            model_name='campaignvariant',
+            constraint=models.UniqueConstraint(fields=('campaign', 'label'), name='unique_campaign_variant'),
+        ),
+    ]
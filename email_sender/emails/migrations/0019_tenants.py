@@ -0,0 +1,162 @@
+# Generated by Django 5.2.7 on 2026-10-19 19:57
+
+import django.db.models.deletion
+import emails.models
+from django.conf import settings
+from django.db import migrations, models
+
+TENANT_MODELS = ['ApiToken', 'Campaign', 'EmailCredential', 'EmailLog', 'EmailTemplate', 'Recipient']
+
+
+def assign_default_tenant(apps, schema_editor):
+    Tenant = apps.get_model('emails', 'Tenant')
+    tenant, _ = Tenant.objects.get_or_create(slug='default', defaults={'name': 'Default'})
+    for name in TENANT_MODELS:
+        apps.get_model('emails', name).objects.update(tenant=tenant)
+
+
+class Migration(migrations.Migration):
+
+    dependencies = [
+        ('emails', '0018_campaign_variants'),
+        migrations.swappable_dependency(settings.AUTH_USER_MODEL),
+    ]
+
+    operations = [
+        migrations.CreateModel(
+            name='Tenant',
+            fields=[
+                ('id', models.BigAutoField(auto_created=True, primary_key=True, serialize=False, verbose_name='ID')),
+                ('name', models.CharField(max_length=200)),
+                ('slug', models.SlugField(unique=True)),
+                ('daily_quota', models.PositiveIntegerField(default=0, help_text='Emails this tenant may send per day (0 = unlimited)')),
+                ('weight', models.PositiveSmallIntegerField(default=1, help_text='Share of send worker capacity relative to other tenants in the same priority lane')),
+                ('is_active', models.BooleanField(default=True)),
+                ('created_at', models.DateTimeField(auto_now_add=True)),
+                ('members', models.ManyToManyField(blank=True, help_text='Users who may switch to this tenant; superusers can use every tenant', related_name='tenants', to=settings.AUTH_USER_MODEL)),
+            ],
+            options={
+                'ordering': ['name'],
+            },
+        ),
+        migrations.CreateModel(
+            name='TenantUsage',
+            fields=[
+                ('id', models.BigAutoField(auto_created=True, primary_key=True, serialize=False, verbose_name='ID')),
+                ('day', models.DateField()),
+                ('sent', models.PositiveIntegerField(default=0)),
+                ('tenant', models.ForeignKey(on_delete=django.db.models.deletion.CASCADE, related_name='usage', to='emails.tenant')),
+            ],
+            options={
+                'constraints': [models.UniqueConstraint(fields=('tenant', 'day'), name='unique_tenant_usage_day')],
+            },
+        ),
+        migrations.AddField(
+            model_name='apitoken',
+            name='tenant',
+            field=models.ForeignKey(null=True, help_text="Requests made with this token only see and create this tenant's data", on_delete=django.db.models.deletion.CASCADE, related_name='api_tokens', to='emails.tenant'),
+        ),
+        migrations.AddField(
+            model_name='campaign',
+            name='tenant',
+            field=models.ForeignKey(null=True, on_delete=django.db.models.deletion.CASCADE, related_name='campaigns', to='emails.tenant'),
+        ),
+        migrations.AddField(
+            model_name='emailcredential',
+            name='tenant',
+            field=models.ForeignKey(null=True, on_delete=django.db.models.deletion.CASCADE, related_name='credentials', to='emails.tenant'),
+        ),
+        migrations.AddField(
+            model_name='emaillog',
+            name='tenant',
+            field=models.ForeignKey(null=True, on_delete=django.db.models.deletion.CASCADE, related_name='email_logs', to='emails.tenant'),
+        ),
+        migrations.AddField(
+            model_name='emailtemplate',
+            name='tenant',
+            field=models.ForeignKey(null=True, on_delete=django.db.models.deletion.CASCADE, related_name='templates', to='emails.tenant'),
+        ),
+        migrations.AddField(
+            model_name='recipient',
+            name='tenant',
+            field=models.ForeignKey(null=True, on_delete=django.db.models.deletion.CASCADE, related_name='recipients', to='emails.tenant'),
+        ),
+        migrations.RunPython(assign_default_tenant, migrations.RunPython.noop),
+        migrations.AlterField(
+            model_name='apitoken',
+            name='tenant',
+            field=models.ForeignKey(default=emails.models.default_tenant_id, help_text="Requests made with this token only see and create this tenant's data", on_delete=django.db.models.deletion.CASCADE, related_name='api_tokens', to='emails.tenant'),
+        ),
+        migrations.AlterField(
+            model_name='campaign',
+            name='tenant',
+            field=models.ForeignKey(default=emails.models.default_tenant_id, on_delete=django.db.models.deletion.CASCADE, related_name='campaigns', to='emails.tenant'),
+        ),
+        migrations.AlterField(
+            model_name='emailcredential',
+            name='tenant',
+            field=models.ForeignKey(default=emails.models.default_tenant_id, on_delete=django.db.models.deletion.CASCADE, related_name='credentials', to='emails.tenant'),
+        ),
+        migrations.AlterField(
+            model_name='emaillog',
+            name='tenant',
+            field=models.ForeignKey(default=emails.models.default_tenant_id, on_delete=django.db.models.deletion.CASCADE, related_name='email_logs', to='emails.tenant'),
+        ),
+        migrations.AlterField(
+            model_name='emailtemplate',
+            name='tenant',
+            field=models.ForeignKey(default=emails.models.default_tenant_id, on_delete=django.db.models.deletion.CASCADE, related_name='templates', to='emails.tenant'),
+        ),
+        migrations.AlterField(
+            model_name='recipient',
+            name='tenant',
+            field=models.ForeignKey(default=emails.models.default_tenant_id, on_delete=django.db.models.deletion.CASCADE, related_name='recipients', to='emails.tenant'),
+        ),
+        migrations.AlterField(
+            model_name='campaign',
+            name='idempotency_key',
+            field=models.CharField(blank=True, help_text='Client supplied key, unique per tenant; repeating a request with the same key returns this campaign instead of sending again', max_length=100, null=True),
+        ),
+        migrations.AlterField(
+            model_name='recipient',
+            name='email',
+            field=models.EmailField(max_length=254),
+        ),
+        migrations.AlterField(
+            model_name='recipient',
+            name='email_normalized',
+            field=models.CharField(editable=False, help_text='Trimmed, lowercased address; duplicates are detected on this key within a tenant', max_length=254, null=True),
+        ),
+        migrations.AddIndex(
+            model_name='campaign',
+            index=models.Index(fields=['tenant', 'status'], name='campaign_tenant_status_idx'),
+        ),
+        migrations.AddIndex(
+            model_name='emailcredential',
+            index=models.Index(fields=['tenant', 'is_active'], name='credential_tenant_active_idx'),
+        ),
+        migrations.AddIndex(
+            model_name='emaillog',
+            index=models.Index(fields=['tenant', 'created_at', 'id'], name='emaillog_tenant_created_idx'),
+        ),
+        migrations.AddIndex(
+            model_name='emaillog',
+            index=models.Index(fields=['tenant', 'status', 'created_at'], name='emaillog_tenant_status_idx'),
+        ),
+        migrations.AddIndex(
+            model_name='recipient',
+            index=models.Index(fields=['tenant', 'created_at'], name='recipient_tenant_created_idx'),
+        ),
+        migrations.AddConstraint(
+            model_name='campaign',
+            constraint=models.UniqueConstraint(fields=('tenant', 'idempotency_key'), name='unique_tenant_campaign_key'),
+        ),
+        migrations.AddConstraint(
+            model_name='recipient',
+            constraint=models.UniqueConstraint(fields=('tenant', 'email'), name='unique_tenant_recipient_email'),
+        ),
+        migrations.AddConstraint(
+            model_name='recipient',
+            constraint=models.UniqueConstraint(fields=('tenant', 'email_normalized'), name='unique_tenant_recipient_normalized'),
+        ),
+    ]
@@ -0,0 +1,17 @@
+# Generated by Django 5.2.7 on 2026-10-19 20:06
+
+from django.db import migrations, models
+
+
+class Migration(migrations.Migration):
+
+    dependencies = [
+        ('emails', '0019_tenants'),
+    ]
+
+    operations = [
+        migrations.AddIndex(
+            model_name='emaillog',
+            index=models.Index(fields=['template', 'status', 'recipient'], name='emaillog_template_history_idx'),
+        ),
+    ]
@@ -0,0 +1,52 @@
+# Generated by Django 5.2.7 on 2026-10-19 20:18
+
+import django.db.models.deletion
+import emails.models
+from django.db import migrations, models
+
+
+def assign_tenants(apps, schema_editor):
+    """Existing names go to the default tenant; other tenants get the names their recipients use"""
+    Tenant = apps.get_model('emails', 'Tenant')
+    CustomField = apps.get_model('emails', 'CustomField')
+    Recipient = apps.get_model('emails', 'Recipient')
+    default, _ = Tenant.objects.get_or_create(slug='default', defaults={'name': 'Default'})
+    CustomField.objects.update(tenant=default)
+    for tenant_id in Tenant.objects.exclude(pk=default.pk).values_list('pk', flat=True):
+        names = set()
+        fields = Recipient.objects.filter(tenant_id=tenant_id).exclude(custom_fields={}).values_list('custom_fields', flat=True)
+        for custom_fields in fields.iterator(chunk_size=2000):
+            names.update(custom_fields or {})
+        CustomField.objects.bulk_create(
+            [CustomField(tenant_id=tenant_id, name=name) for name in names], ignore_conflicts=True,
+        )
+
+
+class Migration(migrations.Migration):
+
+    dependencies = [
+        ('emails', '0020_emaillog_template_history'),
+    ]
+
+    operations = [
+        migrations.AddField(
+            model_name='customfield',
+            name='tenant',
+            field=models.ForeignKey(null=True, on_delete=django.db.models.deletion.CASCADE, related_name='custom_fields', to='emails.tenant'),
+        ),
+        migrations.AlterField(
+            model_name='customfield',
+            name='name',
+            field=models.CharField(max_length=50),
+        ),
+        migrations.RunPython(assign_tenants, migrations.RunPython.noop),
+        migrations.AlterField(
+            model_name='customfield',
+            name='tenant',
+            field=models.ForeignKey(default=emails.models.default_tenant_id, on_delete=django.db.models.deletion.CASCADE, related_name='custom_fields', to='emails.tenant'),
+        ),
+        migrations.AddConstraint(
+            model_name='customfield',
+            constraint=models.UniqueConstraint(fields=('tenant', 'name'), name='unique_tenant_custom_field'),
+        ),
+    ]
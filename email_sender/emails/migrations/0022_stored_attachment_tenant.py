@@ -0,0 +1,56 @@
+# Generated by Django 5.2.7 on 2026-10-19 21:04
+
+import django.db.models.deletion
+import emails.models
+from django.db import migrations, models
+
+
+def assign_tenants(apps, schema_editor):
+    """
+    Stored content goes to the tenants whose campaigns use it, one row each; unused content to the default tenant.
+
+    The rows of a shared file all point at the same file on disk, so nothing is copied.
+    """
+    Tenant = apps.get_model('emails', 'Tenant')
+    StoredAttachment = apps.get_model('emails', 'StoredAttachment')
+    CampaignAttachment = apps.get_model('emails', 'CampaignAttachment')
+    default, _ = Tenant.objects.get_or_create(slug='default', defaults={'name': 'Default'})
+    for stored in StoredAttachment.objects.all():
+        tenant_ids = sorted(set(
+            CampaignAttachment.objects.filter(attachment=stored).values_list('campaign__tenant_id', flat=True)
+        ))
+        stored.tenant_id = tenant_ids[0] if tenant_ids else default.pk
+        stored.save(update_fields=['tenant'])
+        for tenant_id in tenant_ids[1:]:
+            copy = StoredAttachment.objects.create(tenant_id=tenant_id, sha256=stored.sha256, size=stored.size)
+            CampaignAttachment.objects.filter(attachment=stored, campaign__tenant_id=tenant_id).update(attachment=copy)
+
+
+class Migration(migrations.Migration):
+
+    dependencies = [
+        ('emails', '0021_tenant_custom_fields'),
+    ]
+
+    operations = [
+        migrations.AddField(
+            model_name='storedattachment',
+            name='tenant',
+            field=models.ForeignKey(null=True, on_delete=django.db.models.deletion.CASCADE, related_name='stored_attachments', to='emails.tenant'),
+        ),
+        migrations.AlterField(
+            model_name='storedattachment',
+            name='sha256',
+            field=models.CharField(max_length=64),
+        ),
+        migrations.RunPython(assign_tenants, migrations.RunPython.noop),
+        migrations.AlterField(
+            model_name='storedattachment',
+            name='tenant',
+            field=models.ForeignKey(default=emails.models.default_tenant_id, on_delete=django.db.models.deletion.CASCADE, related_name='stored_attachments', to='emails.tenant'),
+        ),
+        migrations.AddConstraint(
+            model_name='storedattachment',
+            constraint=models.UniqueConstraint(fields=('tenant', 'sha256'), name='unique_tenant_attachment_sha256'),
+        ),
+    ]
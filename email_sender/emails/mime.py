@@ -0,0 +1,238 @@
+import itertools
+import logging
+import re
+import time
+import uuid
+from email.charset import QP, Charset
+from email.header import Header
+from email.mime.base import MIMEBase
+from email.utils import formatdate
+from django.conf import settings
+from django.core.mail import EmailMessage, EmailMultiAlternatives
+from django.core.mail.message import sanitize_address
+from django.core.mail.utils import DNS_NAME
+
+# RFC 5322 line length limit; longer lines force quoted-printable like Django does
+MAX_LINE_LENGTH = 998
+
+logger = logging.getLogger(__name__)
+
+_qp_charset = Charset('utf-8')
+_qp_charset.body_encoding = QP
+
+
+class WireMessage:
+    """Pre-serialized message exposing the part of the email.message API the mail backends use"""
+
+    def __init__(self, segments):
+        self.segments = segments
+
+    def as_bytes(self, unixfrom=False, linesep='\r\n'):
+        data = b''.join(self.segments)
+        if linesep == '\r\n':
+            return data
+        return data.replace(b'\r\n', linesep.encode())
+
+    def as_string(self, unixfrom=False, linesep='\n'):
+        return self.as_bytes(linesep=linesep).decode('utf-8', errors='replace')
+
+    def get_charset(self):
+        return None
+
+
+class PrebuiltEmailMessage(EmailMessage):
+    """
+    EmailMessage whose wire bytes were produced by a MessageFactory.
+
+    The bytes are kept as the factory's segments and never joined:
+    emails.backends.EmailBackend writes them to the socket one by one, and
+    other backends join them through message().as_bytes(). ``size`` counts
+    only the bytes rendered for this recipient, not the skeleton and mapped
+    attachments every message of the factory shares.
+    """
+
+    def __init__(self, segments, message_id, size, **kwargs):
+        super().__init__(**kwargs)
+        self.segments = segments
+        self.message_id = message_id
+        self.size = size
+
+    def message(self):
+        return WireMessage(self.segments)
+
+
+def _encode_body(text):
+    """Return (Content-Transfer-Encoding, CRLF-terminated payload bytes) for a text part"""
+    text = text.replace('\r\n', '\n').replace('\r', '\n')
+    if not any(len(line) > MAX_LINE_LENGTH for line in text.split('\n')):
+        try:
+            return b'7bit', text.encode('ascii').replace(b'\n', b'\r\n')
+        except UnicodeEncodeError:
+            return b'8bit', text.encode('utf-8').replace(b'\n', b'\r\n')
+    return b'quoted-printable', _qp_charset.body_encode(text).encode('ascii').replace(b'\n', b'\r\n')
+
+
+def _encode_subject(subject):
+    subject = subject.replace('\r', ' ').replace('\n', ' ')
+    try:
+        subject.encode('ascii')
+        charset = 'us-ascii'
+    except UnicodeEncodeError:
+        charset = 'utf-8'
+    return Header(subject, charset, header_name='Subject').encode(linesep='\r\n').encode('ascii')
+
+
+class MessageFactory:
+    """
+    Builds the MIME structure of a campaign once and stamps out per-recipient copies.
+
+    The skeleton is a real Django EmailMessage (so headers, the multipart tree,
+    boundaries and base64-encoded attachments are exactly what Django would
+    produce) serialized with placeholder tokens for the fields that vary per
+    recipient: To, Subject, Date, Message-ID and each text part with its
+    Content-Transfer-Encoding. build() then only encodes those fields and
+    lists them between the pre-serialized byte segments.
+
+    Attachments may be file-like objects (read and encoded once) or stored
+    attachments exposing open_encoded(), whose base64 content stays in a
+    read-only mmap: every message references it through the same memoryview,
+    and it is only read when the message is written to the socket.
+
+    With ``html=True`` the skeleton gets a text/html alternative, and build()
+    must be given the rendered HTML for every recipient.
+    """
+
+    def __init__(self, from_email, attachments=None, headers=None, html=False):
+        self.from_email = from_email
+        self.token = uuid.uuid4().hex
+        self.msgid_counter = itertools.count()
+        self.msgid_domain = str(DNS_NAME)
+        self.date_second = None
+        self.date_value = b''
+
+        placeholders = {
+            'to': f'to{self.token}@skeleton.invalid',
+            'subject': f'EchoMailerSubject{self.token}',
+            'date': f'EchoMailerDate{self.token}',
+            'message_id': f'EchoMailerMessageId{self.token}',
+            'text_cte': f'EchoMailerTextCte{self.token}',
+            'text': f'EchoMailerText{self.token}',
+        }
+        self.html = html
+        if html:
+            placeholders['html_cte'] = f'EchoMailerHtmlCte{self.token}'
+            placeholders['html'] = f'EchoMailerHtml{self.token}'
+
+        skeleton = (EmailMultiAlternatives if html else EmailMessage)(
+            subject=placeholders['subject'],
+            body=placeholders['text'],
+            from_email=from_email,
+            to=[placeholders['to']],
+            headers={**(headers or {}), 'Date': placeholders['date'], 'Message-ID': placeholders['message_id']},
+        )
+        if html:
+            skeleton.attach_alternative(placeholders['html'], 'text/html')
+        self.attachment_count = 0
+        self.mapped = {}
+        self.maps = []
+        for index, attachment in enumerate(attachments or []):
+            try:
+                if hasattr(attachment, 'open_encoded'):
+                    name = f'attachment{index}'
+                    placeholders[name] = f'EchoMailerAttachment{index}x{self.token}'
+                    self.mapped[name] = self._map(attachment)
+                    maintype, _, subtype = attachment.content_type.partition('/')
+                    part = MIMEBase(maintype, subtype or 'octet-stream')
+                    part.set_payload(placeholders[name])
+                    part['Content-Transfer-Encoding'] = 'base64'
+                    part.add_header('Content-Disposition', 'attachment', filename=attachment.name)
+                    skeleton.attach(part)
+                else:
+                    attachment.seek(0)
+                    skeleton.attach(attachment.name, attachment.read(), attachment.content_type)
+                self.attachment_count += 1
+            except Exception as attach_error:
+                logger.warning(f"Failed to attach {attachment.name}: {str(attach_error)}")
+        msg = skeleton.message()
+
+        # Point the text part's Content-Transfer-Encoding at a placeholder, because
+        # the encoding is only known once the personalized body is rendered
+        text_part = msg if not msg.is_multipart() else next(
+            part for part in msg.walk() if part.get_content_type() == 'text/plain'
+        )
+        text_part.replace_header('Content-Transfer-Encoding', placeholders['text_cte'])
+        if html:
+            html_part = next(part for part in msg.walk() if part.get_content_type() == 'text/html')
+            html_part.replace_header('Content-Transfer-Encoding', placeholders['html_cte'])
+
+        data = msg.as_bytes(linesep='\r\n')
+        pattern = re.compile('|'.join(re.escape(value) for value in placeholders.values()).encode())
+        names = {value.encode(): name for name, value in placeholders.items()}
+
+        self.segments = []
+        position = 0
+        for match in pattern.finditer(data):
+            self.segments.append(data[position:match.start()])
+            self.segments.append(names[match.group()])
+            position = match.end()
+        self.segments.append(data[position:])
+
+    def _map(self, attachment):
+        """A memoryview of the attachment's encoded content, so messages share its mmap without copying it"""
+        mapped = attachment.open_encoded()
+        if not mapped:
+            return mapped
+        self.maps.append(mapped)
+        return memoryview(mapped)
+
+    def close(self):
+        for view in self.mapped.values():
+            if isinstance(view, memoryview):
+                view.release()
+        for mapped in self.maps:
+            mapped.close()
+        self.mapped = {}
+        self.maps = []
+
+    def _date(self):
+        second = int(time.time())
+        if second != self.date_second:
+            self.date_second = second
+            self.date_value = formatdate(second, localtime=settings.EMAIL_USE_LOCALTIME).encode('ascii')
+        return self.date_value
+
+    def build(self, to_email, subject, body, connection=None, html=None, envelope_from=None):
+        """
+        Return a ready-to-send PrebuiltEmailMessage for one recipient.
+
+        ``envelope_from`` sets the SMTP envelope sender (e.g. a VERP bounce
+        address) without changing the From header.
+        """
+        message_id = f'<{self.token}.{next(self.msgid_counter)}@{self.msgid_domain}>'
+        text_cte, text = _encode_body(body)
+        fields = {
+            'to': sanitize_address(to_email, 'utf-8').encode('ascii'),
+            'subject': _encode_subject(subject),
+            'date': self._date(),
+            'message_id': message_id.encode('ascii'),
+            'text_cte': text_cte,
+            'text': text,
+        }
+        if self.html:
+            fields['html_cte'], fields['html'] = _encode_body(html or '')
+        size = sum(len(value) for value in fields.values())
+        fields.update(self.mapped)
+        segments = [
+            segment if isinstance(segment, bytes) else fields[segment]
+            for segment in self.segments
+        ]
+        return PrebuiltEmailMessage(
+            segments,
+            message_id,
+            size,
+            subject=subject,
+            body=body,
+            from_email=envelope_from or self.from_email,
+            to=[to_email],
+            connection=connection,
+        )
@@ -1,59 +1,471 @@
 from django.db import models
 from django.contrib.auth.models import User
-from cryptography.fernet import Fernet
+from django.core.exceptions import ValidationError
+from django.template import TemplateSyntaxError
 from django.conf import settings
+from django.utils import timezone
 import base64
+import copy
+import hashlib
+import secrets
+import time
+from pathlib import Path
+from .templating import template_variables, validate_template
+from .validation import normalize_email
+
+DEFAULT_TENANT_SLUG = 'default'
+
+
+class Tenant(models.Model):
+    """
+    A workspace with its own recipients, templates, credentials, campaigns and logs.
+
+    Installations that never create a second tenant keep everything in the
+    default one, created by the migration that introduced tenants.
+    """
+    name = models.CharField(max_length=200)
+    slug = models.SlugField(max_length=50, unique=True)
+    daily_quota = models.PositiveIntegerField(default=0, help_text="Emails this tenant may send per day (0 = unlimited)")
+    weight = models.PositiveSmallIntegerField(default=1, help_text="Share of send worker capacity relative to other tenants in the same priority lane")
+    members = models.ManyToManyField(User, blank=True, related_name='tenants', help_text="Users who may switch to this tenant; superusers can use every tenant")
+    is_active = models.BooleanField(default=True)
+    created_at = models.DateTimeField(auto_now_add=True)
+
+    _default_id = None
+
+    class Meta:
+        ordering = ['name']
+
+    def __str__(self):
+        return self.name
+
+    @classmethod
+    def default_id(cls):
+        """Primary key of the default tenant, looked up once per process"""
+        if cls._default_id is None:
+            # Only the key is selected, so this also works while later migrations are pending
+            tenant_id = cls.objects.filter(slug=DEFAULT_TENANT_SLUG).values_list('pk', flat=True).first()
+            if tenant_id is None:
+                tenant_id = cls.objects.create(slug=DEFAULT_TENANT_SLUG, name='Default').pk
+            cls._default_id = tenant_id
+        return cls._default_id
+
+
+def default_tenant_id():
+    """Default for tenant foreign keys: rows created without a tenant belong to the default one"""
+    return Tenant.default_id()
+
+
+class TenantUsage(models.Model):
+    """Emails a tenant sent (or has reserved for sending) on one day, counted against its daily quota"""
+    tenant = models.ForeignKey(Tenant, on_delete=models.CASCADE, related_name='usage')
+    day = models.DateField()
+    sent = models.PositiveIntegerField(default=0)
+
+    class Meta:
+        constraints = [
+            models.UniqueConstraint(fields=['tenant', 'day'], name='unique_tenant_usage_day'),
+        ]
+
+    def __str__(self):
+        return f"{self.tenant} {self.day}: {self.sent}"
+
+
+class TenantQuerySet(models.QuerySet):
+    def for_tenant(self, tenant):
+        """Rows of ``tenant`` (a Tenant or its primary key)"""
+        return self.filter(tenant=tenant)
+
 
 class Recipient(models.Model):
-    email = models.EmailField(unique=True)
+    EMAIL_CHECK_CHOICES = [
+        ('', 'Not checked'),
+        ('ok', 'Valid'),
+        ('role', 'Role address'),
+        ('disposable', 'Disposable domain'),
+    ]
+
+    tenant = models.ForeignKey(Tenant, on_delete=models.CASCADE, default=default_tenant_id, related_name='recipients')
+    email = models.EmailField()
+    email_normalized = models.CharField(max_length=254, null=True, editable=False, help_text="Trimmed, lowercased address; duplicates are detected on this key within a tenant")
+    email_check = models.CharField(max_length=20, choices=EMAIL_CHECK_CHOICES, blank=True, help_text="Result of the import validation")
     company = models.CharField(max_length=200, blank=True)
+    bounce_count = models.PositiveIntegerField(default=0, help_text="Bounces received for this address")
+    last_bounced_at = models.DateTimeField(null=True, blank=True)
+    is_suppressed = models.BooleanField(default=False, help_text="Hard bounced; excluded from new sends")
+    custom_fields = models.JSONField(default=dict, blank=True, help_text="Extra merge fields such as first_name or plan, imported from CSV columns")
     created_at = models.DateTimeField(auto_now_add=True)
+
+    objects = TenantQuerySet.as_manager()
     
     class Meta:
         ordering = ['email']
+        constraints = [
+            models.UniqueConstraint(fields=['tenant', 'email'], name='unique_tenant_recipient_email'),
+            models.UniqueConstraint(fields=['tenant', 'email_normalized'], name='unique_tenant_recipient_normalized'),
+        ]
+        indexes = [
+            models.Index(fields=['created_at'], name='recipient_created_idx'),
+            models.Index(fields=['tenant', 'created_at'], name='recipient_tenant_created_idx'),
+            # Prefix (LIKE 'abc%') searches in the admin; the opclass only applies on PostgreSQL
+            models.Index(fields=['email_normalized'], name='recipient_email_prefix_idx', opclasses=['varchar_pattern_ops']),
+        ]
     
     def __str__(self):
         return f"{self.email} ({self.company})" if self.company else self.email
 
+    def save(self, *args, **kwargs):
+        self.email_normalized = normalize_email(self.email)
+        update_fields = kwargs.get('update_fields')
+        if update_fields is not None and 'email' in update_fields:
+            kwargs['update_fields'] = {*update_fields, 'email_normalized'}
+        super().save(*args, **kwargs)
+
+class CustomField(models.Model):
+    """
+    A custom merge field name used by at least one import of a tenant, e.g. first_name.
+    The tenant's templates may use these names in addition to email and company.
+    """
+    tenant = models.ForeignKey(Tenant, on_delete=models.CASCADE, default=default_tenant_id, related_name='custom_fields')
+    name = models.CharField(max_length=50)
+    created_at = models.DateTimeField(auto_now_add=True)
+
+    objects = TenantQuerySet.as_manager()
+
+    class Meta:
+        ordering = ['name']
+        constraints = [
+            models.UniqueConstraint(fields=['tenant', 'name'], name='unique_tenant_custom_field'),
+        ]
+
+    def __str__(self):
+        return self.name
+
+    @classmethod
+    def names(cls, tenant=None):
+        """Custom field names of ``tenant`` (a Tenant or its primary key; the default tenant when omitted)"""
+        return list(cls.objects.for_tenant(tenant or Tenant.default_id()).values_list('name', flat=True))
+
+    @classmethod
+    def register(cls, names, tenant=None):
+        tenant_id = getattr(tenant, 'pk', tenant) or Tenant.default_id()
+        cls.objects.bulk_create([cls(tenant_id=tenant_id, name=name) for name in names], ignore_conflicts=True)
+
 class EmailTemplate(models.Model):
+    tenant = models.ForeignKey(Tenant, on_delete=models.CASCADE, default=default_tenant_id, related_name='templates')
     name = models.CharField(max_length=200)
     subject = models.CharField(max_length=300)
     body = models.TextField(help_text="Use {{email}}, {{company}} for personalization")
+    variables = models.JSONField(default=list, blank=True, editable=False, help_text="Variables used by subject and body, filled in on save")
     created_at = models.DateTimeField(auto_now_add=True)
     updated_at = models.DateTimeField(auto_now=True)
+
+    objects = TenantQuerySet.as_manager()
     
     def __str__(self):
         return self.name
 
+    def clean(self):
+        # Syntax errors and unknown variables are reported here rather than once per recipient at send time
+        errors = {}
+        custom_fields = CustomField.names(self.tenant_id)
+        for field in ('subject', 'body'):
+            try:
+                validate_template(getattr(self, field), custom_fields)
+            except ValidationError as e:
+                errors[field] = e.messages
+        if errors:
+            raise ValidationError(errors)
+
+    def save(self, *args, **kwargs):
+        try:
+            self.variables = sorted(set(template_variables(self.subject)) | set(template_variables(self.body)))
+        except TemplateSyntaxError:
+            self.variables = []
+        super().save(*args, **kwargs)
+
+class StoredAttachment(models.Model):
+    """
+    Attachment content in the on-disk store, deduplicated by SHA-256.
+    The same file uploaded for many campaigns is stored once.
+
+    Rows belong to the tenant that uploaded the content, and sends can only
+    reference their own tenant's; tenants uploading identical content get a
+    row each but share the file.
+    """
+    tenant = models.ForeignKey(Tenant, on_delete=models.CASCADE, default=default_tenant_id, related_name='stored_attachments')
+    sha256 = models.CharField(max_length=64)
+    size = models.BigIntegerField()
+    created_at = models.DateTimeField(auto_now_add=True)
+
+    objects = TenantQuerySet.as_manager()
+
+    class Meta:
+        constraints = [
+            models.UniqueConstraint(fields=['tenant', 'sha256'], name='unique_tenant_attachment_sha256'),
+        ]
+
+    def __str__(self):
+        return f"{self.sha256[:12]} ({self.size} bytes)"
+
+    @property
+    def path(self):
+        return Path(settings.ATTACHMENT_STORE_ROOT) / self.sha256[:2] / self.sha256[2:4] / self.sha256
+
+    @property
+    def encoded_path(self):
+        """Base64 (MIME line-wrapped, CRLF) copy of the content, created on first use"""
+        return self.path.with_suffix('.b64')
+
+
+class Campaign(models.Model):
+    """
+    A send whose recipients are materialized as Delivery rows so that it can be
+    processed by one or more worker processes sharing the same database.
+    """
+    STATUS_CHOICES = [
+        ('queued', 'Queued'),
+        ('running', 'Running'),
+        # Sent from the web process rather than by send_worker
+        ('sending', 'Sending (immediate)'),
+        # A/B test sent; the rest waits for the winning variant
+        ('testing', 'Testing variants'),
+        ('completed', 'Completed'),
+        ('cancelled', 'Cancelled'),
+    ]
+    SHARD_KEY_CHOICES = [
+        ('id', 'Recipient ID'),
+        ('domain', 'Recipient domain'),
+    ]
+    WINNER_METRIC_CHOICES = [
+        ('opens', 'Open rate'),
+        ('clicks', 'Click rate'),
+    ]
+    # Lower values are sent first
+    PRIORITY_TRANSACTIONAL = 0
+    PRIORITY_NORMAL = 5
+    PRIORITY_BULK = 10
+    PRIORITY_CHOICES = [
+        (PRIORITY_TRANSACTIONAL, 'Transactional'),
+        (PRIORITY_NORMAL, 'Normal'),
+        (PRIORITY_BULK, 'Bulk'),
+    ]
+
+    tenant = models.ForeignKey(Tenant, on_delete=models.CASCADE, default=default_tenant_id, related_name='campaigns')
+    name = models.CharField(max_length=200, blank=True)
+    template = models.ForeignKey(EmailTemplate, on_delete=models.SET_NULL, null=True, blank=True)
+    subject = models.CharField(max_length=300)
+    body = models.TextField()
+    status = models.CharField(max_length=20, choices=STATUS_CHOICES, default='queued')
+    shard_count = models.PositiveIntegerField(default=16, help_text="Number of shards recipients are partitioned into")
+    shard_key = models.CharField(max_length=10, choices=SHARD_KEY_CHOICES, default='id')
+    priority = models.PositiveSmallIntegerField(choices=PRIORITY_CHOICES, default=PRIORITY_BULK)
+    weight = models.PositiveSmallIntegerField(default=1, help_text="Share of sending capacity relative to other campaigns in the same priority lane")
+    track_opens = models.BooleanField(default=False, help_text="Add an open-tracking pixel (sends an HTML part)")
+    track_clicks = models.BooleanField(default=False, help_text="Rewrite links to go through the click tracker")
+    idempotency_key = models.CharField(max_length=100, null=True, blank=True, help_text="Client supplied key, unique per tenant; repeating a request with the same key returns this campaign instead of sending again")
+    test_percent = models.PositiveSmallIntegerField(default=0, help_text="Percentage of recipients that receive the A/B test variants; 0 when the campaign has no variants")
+    winner_metric = models.CharField(max_length=10, choices=WINNER_METRIC_CHOICES, default='opens', help_text="Rate the winning variant is chosen by")
+    test_wait_minutes = models.PositiveIntegerField(default=240, help_text="Time between the last test email and choosing the winner")
+    winner_decide_at = models.DateTimeField(null=True, blank=True, help_text="When the winner is chosen, set once the test emails are sent")
+    created_at = models.DateTimeField(auto_now_add=True)
+    started_at = models.DateTimeField(null=True, blank=True)
+    completed_at = models.DateTimeField(null=True, blank=True)
+
+    objects = TenantQuerySet.as_manager()
+
+    class Meta:
+        ordering = ['-created_at']
+        constraints = [
+            models.UniqueConstraint(fields=['tenant', 'idempotency_key'], name='unique_tenant_campaign_key'),
+        ]
+        indexes = [
+            models.Index(fields=['tenant', 'status'], name='campaign_tenant_status_idx'),
+        ]
+
+    def __str__(self):
+        return self.name or f"Campaign #{self.pk}"
+
+
+class CampaignVariant(models.Model):
+    """
+    One subject/body of an A/B tested campaign, with its outcomes so far.
+
+    Counters are incremented as batches are sent and tracking events are
+    rolled up, so comparing variants never scans the logs.
+    """
+    campaign = models.ForeignKey(Campaign, on_delete=models.CASCADE, related_name='variants')
+    label = models.CharField(max_length=1)
+    template = models.ForeignKey(EmailTemplate, on_delete=models.SET_NULL, null=True, blank=True)
+    subject = models.CharField(max_length=300)
+    body = models.TextField()
+    sent = models.PositiveIntegerField(default=0)
+    failed = models.PositiveIntegerField(default=0)
+    opens = models.PositiveIntegerField(default=0, help_text="Recipients who opened at least once")
+    clicks = models.PositiveIntegerField(default=0, help_text="Recipients who clicked at least once")
+    is_winner = models.BooleanField(default=False)
+
+    class Meta:
+        ordering = ['label']
+        constraints = [
+            models.UniqueConstraint(fields=['campaign', 'label'], name='unique_campaign_variant'),
+        ]
+
+    def __str__(self):
+        return f"{self.campaign} variant {self.label}"
+
+
+class CampaignAttachment(models.Model):
+    """A stored attachment as it is sent with one campaign"""
+    campaign = models.ForeignKey(Campaign, on_delete=models.CASCADE, related_name='attachments')
+    attachment = models.ForeignKey(StoredAttachment, on_delete=models.PROTECT, related_name='campaign_uses')
+    filename = models.CharField(max_length=255)
+    content_type = models.CharField(max_length=200, default='application/octet-stream')
+
+    class Meta:
+        ordering = ['pk']
+
+    def __str__(self):
+        return self.filename
+
+
+class Delivery(models.Model):
+    """
+    One recipient of a campaign. Workers lease rows before sending so that no
+    recipient is mailed twice, even across hosts.
+    """
+    STATUS_CHOICES = [
+        ('pending', 'Pending'),
+        # Not part of an A/B test; sent once the winning variant is known
+        ('held', 'Held for winner'),
+        ('sent', 'Sent'),
+        ('failed', 'Failed'),
+    ]
+
+    campaign = models.ForeignKey(Campaign, on_delete=models.CASCADE, related_name='deliveries')
+    recipient = models.ForeignKey(Recipient, on_delete=models.CASCADE)
+    variant = models.ForeignKey(CampaignVariant, on_delete=models.SET_NULL, null=True, blank=True, related_name='deliveries')
+    shard = models.PositiveIntegerField()
+    status = models.CharField(max_length=20, choices=STATUS_CHOICES, default='pending')
+    lease_owner = models.CharField(max_length=100, blank=True)
+    lease_expires_at = models.DateTimeField(null=True, blank=True)
+    attempts = models.PositiveIntegerField(default=0)
+    updated_at = models.DateTimeField(auto_now=True)
+
+    class Meta:
+        verbose_name_plural = "Deliveries"
+        constraints = [
+            models.UniqueConstraint(fields=['campaign', 'recipient'], name='unique_campaign_recipient'),
+        ]
+        indexes = [
+            models.Index(fields=['campaign', 'status', 'shard'], name='delivery_claim_idx'),
+        ]
+
+    def __str__(self):
+        return f"{self.campaign_id}:{self.recipient_id} - {self.status}"
+
+
 class EmailLog(models.Model):
     STATUS_CHOICES = [
         ('pending', 'Pending'),
         ('sent', 'Sent'),
         ('failed', 'Failed'),
+        ('bounced', 'Bounced'),
     ]
 
+    tenant = models.ForeignKey(Tenant, on_delete=models.CASCADE, default=default_tenant_id, related_name='email_logs')
     recipient = models.ForeignKey(Recipient, on_delete=models.CASCADE)
     template = models.ForeignKey(EmailTemplate, on_delete=models.SET_NULL, null=True)
+    campaign = models.ForeignKey(Campaign, on_delete=models.SET_NULL, null=True, blank=True)
     subject = models.CharField(max_length=300)
     body = models.TextField()
     status = models.CharField(max_length=20, choices=STATUS_CHOICES, default='pending')
     error_message = models.TextField(blank=True)
+    message_id = models.CharField(max_length=255, blank=True, db_index=True, help_text="Message-ID header, used to match bounces")
     has_attachments = models.BooleanField(default=False, help_text="Whether this email had attachments")
     attachment_count = models.IntegerField(default=0, help_text="Number of attachments sent")
     sent_at = models.DateTimeField(null=True, blank=True)
     created_at = models.DateTimeField(auto_now_add=True)
 
+    objects = TenantQuerySet.as_manager()
+
     class Meta:
         ordering = ['-created_at']
+        indexes = [
+            # The admin orders by (created_at, id) and its date hierarchy probes created_at ranges
+            models.Index(fields=['created_at', 'id'], name='emaillog_created_idx'),
+            models.Index(fields=['status', 'created_at'], name='emaillog_status_created_idx'),
+            # The same orderings within one tenant, for the web UI and exports
+            models.Index(fields=['tenant', 'created_at', 'id'], name='emaillog_tenant_created_idx'),
+            models.Index(fields=['tenant', 'status', 'created_at'], name='emaillog_tenant_status_idx'),
+            # Delta sends probe a recipient's history with one template (emails.audience)
+            models.Index(fields=['template', 'status', 'recipient'], name='emaillog_template_history_idx'),
+        ]
 
     def __str__(self):
         return f"{self.recipient.email} - {self.status}"
 
 
+class TrackingEvent(models.Model):
+    """
+    One open or click, as recorded by the tracking endpoints.
+
+    Rows are appended in batches and never updated; rollup_engagement folds
+    them into Engagement. Foreign keys carry no database constraint so a batch
+    never fails because a recipient or campaign was deleted in the meantime.
+    """
+    KIND_CHOICES = [
+        ('open', 'Open'),
+        ('click', 'Click'),
+    ]
+
+    campaign = models.ForeignKey(Campaign, on_delete=models.DO_NOTHING, db_constraint=False, null=True, blank=True)
+    recipient = models.ForeignKey(Recipient, on_delete=models.DO_NOTHING, db_constraint=False)
+    kind = models.CharField(max_length=10, choices=KIND_CHOICES)
+    url = models.TextField(blank=True)
+    user_agent = models.CharField(max_length=255, blank=True)
+    created_at = models.DateTimeField(default=timezone.now)
+
+    class Meta:
+        ordering = ['-pk']
+
+    def __str__(self):
+        return f"{self.kind} {self.campaign_id}:{self.recipient_id}"
+
+
+class Engagement(models.Model):
+    """Opens and clicks of one recipient for one campaign (or for immediate sends when campaign is empty)"""
+    campaign = models.ForeignKey(Campaign, on_delete=models.CASCADE, null=True, blank=True, related_name='engagements')
+    recipient = models.ForeignKey(Recipient, on_delete=models.CASCADE, related_name='engagements')
+    opens = models.PositiveIntegerField(default=0)
+    clicks = models.PositiveIntegerField(default=0)
+    first_opened_at = models.DateTimeField(null=True, blank=True)
+    first_clicked_at = models.DateTimeField(null=True, blank=True)
+    last_event_at = models.DateTimeField(null=True, blank=True)
+
+    class Meta:
+        constraints = [
+            models.UniqueConstraint(fields=['campaign', 'recipient'], name='unique_engagement'),
+        ]
+
+    def __str__(self):
+        return f"{self.recipient} - {self.opens} opens, {self.clicks} clicks"
+
+
+class RollupCursor(models.Model):
+    """Position of an aggregation job in an append-only table"""
+    name = models.CharField(max_length=50, unique=True)
+    position = models.BigIntegerField(default=0, help_text="Highest row id already aggregated")
+    updated_at = models.DateTimeField(auto_now=True)
+
+    def __str__(self):
+        return f"{self.name} @ {self.position}"
+
+
 class EmailCredential(models.Model):
     """
     Stores SMTP email credentials with encryption.
-    Only one active credential set should exist at a time.
+    Only one active credential set should exist per tenant at a time.
     """
     PROVIDER_CHOICES = [
         ('gmail', 'Gmail'),
@@ -62,6 +474,7 @@ class EmailCredential(models.Model):
         ('custom', 'Custom SMTP'),
     ]
 
+    tenant = models.ForeignKey(Tenant, on_delete=models.CASCADE, default=default_tenant_id, related_name='credentials')
     name = models.CharField(max_length=200, help_text="Descriptive name for this credential set")
     provider = models.CharField(max_length=50, choices=PROVIDER_CHOICES, default='gmail')
     email_host = models.CharField(max_length=200, default='smtp.gmail.com')
@@ -75,20 +488,28 @@ class EmailCredential(models.Model):
     created_at = models.DateTimeField(auto_now_add=True)
     updated_at = models.DateTimeField(auto_now=True)
 
+    objects = TenantQuerySet.as_manager()
+
     class Meta:
         ordering = ['-is_active', '-created_at']
+        indexes = [
+            models.Index(fields=['tenant', 'is_active'], name='credential_tenant_active_idx'),
+        ]
 
     def __str__(self):
         return f"{self.name} ({self.email_host_user})"
 
     def save(self, *args, **kwargs):
-        # Ensure only one credential is active at a time
+        # Ensure only one credential per tenant is active at a time
         if self.is_active:
-            EmailCredential.objects.filter(is_active=True).exclude(pk=self.pk).update(is_active=False)
+            EmailCredential.objects.filter(tenant_id=self.tenant_id, is_active=True).exclude(pk=self.pk).update(is_active=False)
         super().save(*args, **kwargs)
 
     def encrypt_password(self, raw_password):
         """Encrypt password using Fernet symmetric encryption"""
+        # Imported on use: most processes never touch credentials
+        from cryptography.fernet import Fernet
+
         try:
             # Get encryption key from settings or generate one
             key = settings.EMAIL_ENCRYPTION_KEY.encode() if hasattr(settings, 'EMAIL_ENCRYPTION_KEY') else Fernet.generate_key()
@@ -101,6 +522,8 @@ class EmailCredential(models.Model):
 
     def decrypt_password(self):
         """Decrypt password for use in email sending"""
+        from cryptography.fernet import Fernet
+
         try:
             if hasattr(settings, 'EMAIL_ENCRYPTION_KEY'):
                 key = settings.EMAIL_ENCRYPTION_KEY.encode()
@@ -140,9 +563,25 @@ class EmailSettings(models.Model):
         default=10,
         help_text="Maximum size per attachment in MB"
     )
+    track_opens = models.BooleanField(
+        default=False,
+        help_text="Track opens with a pixel in an HTML version of each email"
+    )
+    track_clicks = models.BooleanField(
+        default=False,
+        help_text="Rewrite links so clicks are recorded before redirecting"
+    )
+    version = models.PositiveIntegerField(
+        default=0,
+        editable=False,
+        help_text="Incremented on every save so processes can detect changes cheaply"
+    )
     updated_at = models.DateTimeField(auto_now=True)
     created_at = models.DateTimeField(auto_now_add=True)
 
+    # In-process cache used by get_settings()
+    _cache = None
+
     class Meta:
         verbose_name = "Email Settings"
         verbose_name_plural = "Email Settings"
@@ -168,8 +607,68 @@ class EmailSettings(models.Model):
 
         super().save(*args, **kwargs)
 
+        # Bump the version in the database so concurrent saves never reuse a number
+        EmailSettings.objects.filter(pk=self.pk).update(version=models.F('version') + 1)
+        self.version = EmailSettings.objects.filter(pk=self.pk).values_list('version', flat=True).get()
+        EmailSettings._cache = {'instance': copy.copy(self), 'checked_at': time.monotonic()}
+
     @classmethod
     def get_settings(cls):
-        """Get or create the singleton settings instance"""
-        settings, created = cls.objects.get_or_create(pk=1)
-        return settings
\ No newline at end of file
+        """
+        Get the singleton settings instance, served from an in-process cache.
+
+        The cache is revalidated at most every EMAIL_SETTINGS_CACHE_SECONDS by
+        reading only the version column, and saves in this process refresh it
+        immediately. Long-running sends can therefore call this per email and
+        pick up changes made from any process. A copy is returned so callers
+        (e.g. a ModelForm) can modify it without touching the cache.
+        """
+        cache = cls._cache
+        now = time.monotonic()
+        max_age = getattr(settings, 'EMAIL_SETTINGS_CACHE_SECONDS', 1.0)
+
+        if cache and now - cache['checked_at'] < max_age:
+            return copy.copy(cache['instance'])
+
+        if cache:
+            version = cls.objects.filter(pk=cache['instance'].pk).values_list('version', flat=True).first()
+            if version == cache['instance'].version:
+                cache['checked_at'] = now
+                return copy.copy(cache['instance'])
+
+        instance, created = cls.objects.get_or_create(pk=1)
+        cls._cache = {'instance': instance, 'checked_at': now}
+        return copy.copy(instance)
+
+
+class ApiToken(models.Model):
+    """
+    Bearer token for the JSON API. Only a SHA-256 hash of the key is stored;
+    the raw key is shown once when the token is created.
+    """
+    tenant = models.ForeignKey(Tenant, on_delete=models.CASCADE, default=default_tenant_id, related_name='api_tokens', help_text="Requests made with this token only see and create this tenant's data")
+    name = models.CharField(max_length=200)
+    key_hash = models.CharField(max_length=64, unique=True)
+    prefix = models.CharField(max_length=8, help_text="First characters of the key, for identification")
+    is_active = models.BooleanField(default=True)
+    created_at = models.DateTimeField(auto_now_add=True)
+
+    class Meta:
+        ordering = ['-created_at']
+
+    def __str__(self):
+        return f"{self.name} ({self.prefix}...)"
+
+    @staticmethod
+    def hash_key(raw_key):
+        return hashlib.sha256(raw_key.encode()).hexdigest()
+
+    @classmethod
+    def create_token(cls, name, tenant=None):
+        """Create a token (for the default tenant unless ``tenant`` is given) and return it together with its raw key"""
+        raw_key = secrets.token_urlsafe(32)
+        token = cls(name=name, key_hash=cls.hash_key(raw_key), prefix=raw_key[:8])
+        if tenant is not None:
+            token.tenant = tenant
+        token.save()
+        return token, raw_key
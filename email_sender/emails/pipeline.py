@@ -0,0 +1,225 @@
+import queue
+import threading
+import time
+import logging
+from django.db import connections
+
+logger = logging.getLogger(__name__)
+
+# How often blocked stages check whether the pipeline was stopped
+POLL_SECONDS = 0.1
+
+
+class PipelineStopped(Exception):
+    """Raised inside a stage when another stage failed and the pipeline is shutting down"""
+
+
+class Marker:
+    """
+    Passed through every stage in order with the items around it, e.g. the end of a chunk.
+
+    Stages hand markers to their ``on_marker`` callback (if any) and forward
+    them, so a later stage sees a marker only after every item before it.
+    """
+
+    def __init__(self, value=None):
+        self.value = value
+
+
+_END = Marker()
+
+
+class StageQueue:
+    """Bounded queue in front of a stage, with depth and blocking metrics"""
+
+    def __init__(self, maxsize):
+        self.queue = queue.Queue(maxsize)
+        self.peak = 0
+        self.blocked_seconds = 0.0
+
+    @property
+    def depth(self):
+        return self.queue.qsize()
+
+    def put(self, item, stopped):
+        try:
+            self.queue.put_nowait(item)
+        except queue.Full:
+            # The next stage is lagging: wait for it instead of piling up work
+            started = time.monotonic()
+            while True:
+                if stopped.is_set():
+                    raise PipelineStopped
+                try:
+                    self.queue.put(item, timeout=POLL_SECONDS)
+                    break
+                except queue.Full:
+                    continue
+            self.blocked_seconds += time.monotonic() - started
+        self.peak = max(self.peak, self.queue.qsize())
+
+    def get(self, stopped):
+        while True:
+            if stopped.is_set():
+                raise PipelineStopped
+            try:
+                return self.queue.get(timeout=POLL_SECONDS)
+            except queue.Empty:
+                continue
+
+
+class MemoryBudget:
+    """
+    Bytes that may be held at once by items in flight, e.g. built messages.
+
+    acquire() blocks while the budget is used up, so a stage producing large
+    items waits for a later stage to release() earlier ones. An item larger
+    than the whole budget is still let through, on its own.
+    """
+
+    def __init__(self, limit):
+        self.limit = limit
+        self.used = 0
+        self.peak = 0
+        self.waited_seconds = 0.0
+        self.condition = threading.Condition()
+
+    def acquire(self, size, stopped):
+        with self.condition:
+            started = time.monotonic()
+            while self.used and self.used + size > self.limit:
+                if stopped.is_set():
+                    raise PipelineStopped
+                self.condition.wait(POLL_SECONDS)
+            self.waited_seconds += time.monotonic() - started
+            self.used += size
+            self.peak = max(self.peak, self.used)
+
+    def release(self, size):
+        with self.condition:
+            self.used -= size
+            self.condition.notify_all()
+
+    def metrics(self):
+        return {
+            'limit_bytes': self.limit,
+            'used_bytes': self.used,
+            'peak_bytes': self.peak,
+            'waited_seconds': round(self.waited_seconds, 3),
+        }
+
+
+class Stage:
+    """
+    One step of a Pipeline.
+
+    ``process(item)`` returns the item to pass on, or None to drop it.
+    ``on_marker(marker)`` and ``on_finish()`` are optional callbacks for
+    markers and for the end of the stream.
+    """
+
+    def __init__(self, name, process, on_marker=None, on_finish=None):
+        self.name = name
+        self.process = process
+        self.on_marker = on_marker
+        self.on_finish = on_finish
+        self.processed = 0
+        self.busy_seconds = 0.0
+
+
+class Pipeline:
+    """
+    Runs a source and a chain of stages in their own threads, connected by bounded queues.
+
+    Each stage works on the next item while later stages handle earlier ones,
+    so CPU-bound stages overlap with stages waiting on the network or the
+    database. A full queue blocks the stage feeding it, so a fast stage can
+    never run more than ``queue_size`` items ahead of a slow one. When a stage
+    raises, the others are stopped and run() re-raises the first error.
+    Database connections opened by stage threads are closed when they finish.
+    """
+
+    def __init__(self, stages, queue_size=64, budget=None):
+        self.stages = stages
+        self.queues = [StageQueue(queue_size) for _ in stages]
+        self.budget = budget
+        self.stopped = threading.Event()
+        self.errors = []
+        self.source_items = 0
+
+    def _fail(self, name, error):
+        if not isinstance(error, PipelineStopped):
+            logger.error(f"Pipeline stage {name} failed: {str(error)}")
+            self.errors.append(error)
+        self.stopped.set()
+
+    def _run_source(self, source):
+        try:
+            for item in source:
+                self.queues[0].put(item, self.stopped)
+                if not isinstance(item, Marker):
+                    self.source_items += 1
+            self.queues[0].put(_END, self.stopped)
+        except BaseException as e:
+            self._fail('source', e)
+        finally:
+            connections.close_all()
+
+    def _run_stage(self, index):
+        stage = self.stages[index]
+        inbox = self.queues[index]
+        outbox = self.queues[index + 1] if index + 1 < len(self.queues) else None
+        try:
+            while True:
+                item = inbox.get(self.stopped)
+                if item is _END:
+                    if stage.on_finish:
+                        stage.on_finish()
+                    if outbox:
+                        outbox.put(_END, self.stopped)
+                    return
+                started = time.monotonic()
+                if isinstance(item, Marker):
+                    if stage.on_marker:
+                        stage.on_marker(item)
+                else:
+                    item = stage.process(item)
+                    stage.processed += 1
+                stage.busy_seconds += time.monotonic() - started
+                if outbox and item is not None:
+                    outbox.put(item, self.stopped)
+        except BaseException as e:
+            self._fail(stage.name, e)
+        finally:
+            connections.close_all()
+
+    def run(self, source):
+        """Feed ``source`` through the stages and wait for everything to finish"""
+        threads = [threading.Thread(target=self._run_source, args=(source,), name='pipeline-source')]
+        threads += [
+            threading.Thread(target=self._run_stage, args=(index,), name=f'pipeline-{stage.name}')
+            for index, stage in enumerate(self.stages)
+        ]
+        for thread in threads:
+            thread.start()
+        for thread in threads:
+            thread.join()
+        if self.errors:
+            raise self.errors[0]
+
+    def metrics(self):
+        """Per-stage queue depth, peak depth, time spent blocked by the next stage, and the memory budget"""
+        stages = {'source': {'processed': self.source_items, 'blocked_seconds': round(self.queues[0].blocked_seconds, 3)}}
+        for index, stage in enumerate(self.stages):
+            outbox = self.queues[index + 1] if index + 1 < len(self.queues) else None
+            stages[stage.name] = {
+                'queue_depth': self.queues[index].depth,
+                'peak_queue_depth': self.queues[index].peak,
+                'processed': stage.processed,
+                'busy_seconds': round(stage.busy_seconds, 3),
+                'blocked_seconds': round(outbox.blocked_seconds, 3) if outbox else 0.0,
+            }
+        metrics = {'stages': stages}
+        if self.budget is not None:
+            metrics['memory'] = self.budget.metrics()
+        return metrics
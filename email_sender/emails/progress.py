@@ -0,0 +1,136 @@
+import threading
+import time
+from django.db.models import Count, Q
+from django.utils import timezone
+from .abtest import variant_results
+from .models import Campaign
+
+# Finished sends stay visible this long, so a reopened progress page still shows the result
+RETENTION_SECONDS = 3600
+MAX_ERRORS_KEPT = 20
+
+_lock = threading.Lock()
+_registry = {}
+
+
+class SendProgress:
+    """
+    Live counters of one running send, updated by the sending thread.
+
+    Progress pages read snapshots of these counters, so following a send
+    costs no database queries however many pages are watching it.
+    """
+
+    def __init__(self, key, total, tenant_id=None):
+        self.key = key
+        self.total = total
+        # Only users working in this tenant may follow the send
+        self.tenant_id = tenant_id
+        self.sent = 0
+        self.failed = 0
+        self.skipped = 0
+        self.errors = []
+        self.started = time.monotonic()
+        self.finished = None
+        # The send's Pipeline, whose stage metrics are included in snapshots
+        self.pipeline = None
+        self.lock = threading.Lock()
+
+    def record(self, sent=0, failed=0, skipped=0, error=None):
+        with self.lock:
+            self.sent += sent
+            self.failed += failed
+            self.skipped += skipped
+            if error and len(self.errors) < MAX_ERRORS_KEPT:
+                self.errors.append(error)
+
+    def finish(self):
+        self.finished = time.monotonic()
+
+    @property
+    def done(self):
+        return self.finished is not None
+
+    def snapshot(self):
+        with self.lock:
+            sent, failed, skipped, errors = self.sent, self.failed, self.skipped, list(self.errors)
+        elapsed = (self.finished or time.monotonic()) - self.started
+        processed = sent + failed
+        rate = processed / elapsed if elapsed > 0 else 0.0
+        remaining = max(self.total - processed - skipped, 0)
+        return {
+            'total': self.total,
+            'sent': sent,
+            'failed': failed,
+            'skipped': skipped,
+            'remaining': remaining,
+            'rate': round(rate, 2),
+            'eta_seconds': round(remaining / rate) if rate and not self.done else None,
+            'elapsed_seconds': round(elapsed, 1),
+            'errors': errors,
+            'done': self.done,
+            'pipeline': self.pipeline.metrics() if self.pipeline is not None else None,
+        }
+
+
+def start_progress(key, total, tenant_id=None):
+    """Register a new send of ``tenant_id`` and drop sends that finished long ago"""
+    progress = SendProgress(key, total, tenant_id)
+    now = time.monotonic()
+    with _lock:
+        for old_key in [k for k, p in _registry.items() if p.done and now - p.finished > RETENTION_SECONDS]:
+            del _registry[old_key]
+        _registry[key] = progress
+    return progress
+
+
+def get_progress(key, tenant=None):
+    """The send registered under ``key``; with ``tenant``, only if it is that tenant's send"""
+    progress = _registry.get(key)
+    if progress is not None and tenant is not None and progress.tenant_id != getattr(tenant, 'pk', tenant):
+        return None
+    return progress
+
+
+def campaign_snapshot(pk):
+    """
+    Progress of a queued campaign, for campaigns sent by send_worker processes.
+
+    Their counters live in other processes, so this reads Delivery counts with
+    one grouped query on the (campaign, status) index instead.
+    """
+    campaign = (
+        Campaign.objects.filter(pk=pk)
+        .annotate(
+            total=Count('deliveries'),
+            sent=Count('deliveries', filter=Q(deliveries__status='sent')),
+            failed=Count('deliveries', filter=Q(deliveries__status='failed')),
+        )
+        .only('status', 'started_at', 'completed_at', 'test_percent', 'winner_metric', 'winner_decide_at')
+        .first()
+    )
+    if campaign is None:
+        return None
+
+    done = campaign.status in ('completed', 'cancelled')
+    elapsed = 0.0
+    if campaign.started_at:
+        elapsed = ((campaign.completed_at or timezone.now()) - campaign.started_at).total_seconds()
+    processed = campaign.sent + campaign.failed
+    rate = processed / elapsed if elapsed > 0 else 0.0
+    remaining = campaign.total - processed
+    return {
+        'total': campaign.total,
+        'sent': campaign.sent,
+        'failed': campaign.failed,
+        'skipped': 0,
+        'remaining': remaining,
+        'rate': round(rate, 2),
+        'eta_seconds': round(remaining / rate) if rate and not done else None,
+        'elapsed_seconds': round(elapsed, 1),
+        'errors': [],
+        'done': done,
+        'status': campaign.status,
+        'variants': variant_results(campaign) if campaign.test_percent else [],
+        'winner_decide_at': campaign.winner_decide_at.isoformat() if campaign.winner_decide_at else None,
+    }
@@ -0,0 +1,488 @@
+import os
+import socket
+import time
+import uuid
+import zlib
+import logging
+from collections import Counter
+from datetime import timedelta
+from django.db import IntegrityError, transaction
+from django.db.models import Exists, F, OuterRef, Q
+from django.template import TemplateSyntaxError
+from django.utils import timezone
+from .logbuffer import EmailLogBuffer
+from .models import Campaign, CampaignAttachment, Delivery, EmailSettings, Tenant
+from .attachments import campaign_attachment_refs
+from .abtest import (
+    DEFAULT_TEST_PERCENT, DEFAULT_TEST_WAIT_MINUTES, add_counts, create_variants, decide_winners, start_test_wait,
+    variant_index,
+)
+from .dispatch import Dispatcher
+from .leases import LeaseKeeper, finish_deliveries
+from .mime import MessageFactory
+from .templating import compile_template, recipient_fields
+from .tenants import release_quota, reserve_quota
+from .throttling import DomainThrottle, is_deferral
+from .tracking import Tracker
+from .utils import (
+    LEASE_MARGIN_SECONDS, SEND_SECONDS_PER_EMAIL, get_email_connection, open_connection, personalize_message,
+    recover_connection, send_personalized_email,
+)
+
+logger = logging.getLogger(__name__)
+
+DELIVERY_CREATE_CHUNK = 1000
+MAX_DELIVERY_ATTEMPTS = 5
+DEFERRAL_BACKOFF_SECONDS = 300
+# How often workers choose A/B test winners and resume interrupted immediate sends
+CHECK_SECONDS = 30
+# An immediate send that holds no lease this long after starting has lost its thread
+RESUME_GRACE_SECONDS = 300
+
+
+def shard_for(recipient, shard_count, shard_key='id'):
+    """
+    Map a recipient to a shard number.
+
+    Uses crc32 rather than hash() so every process (and host) agrees on the
+    mapping regardless of PYTHONHASHSEED.
+    """
+    if shard_key == 'domain':
+        value = recipient.email.rsplit('@', 1)[-1].lower()
+    else:
+        value = str(recipient.pk)
+    return zlib.crc32(value.encode()) % shard_count
+
+
+def make_worker_id():
+    """Identifier used as the lease owner for this process"""
+    return f"{socket.gethostname()}:{os.getpid()}:{uuid.uuid4().hex[:8]}"
+
+
+def create_campaign(subject, body, recipients, template=None, name='', shard_count=16, shard_key='id',
+                    priority=Campaign.PRIORITY_BULK, weight=1, attachments=None, track_opens=None, track_clicks=None,
+                    status='queued', idempotency_key=None, variants=None, test_percent=DEFAULT_TEST_PERCENT,
+                    winner_metric='opens', test_wait_minutes=DEFAULT_TEST_WAIT_MINUTES, tenant=None):
+    """
+    Create a queued campaign and one pending Delivery per recipient.
+
+    Deliveries are inserted in chunks with bulk_create, so large recipient
+    querysets never have to be held in memory at once. Everything happens in
+    one transaction so workers never see a half-populated campaign.
+    ``attachments`` are AttachmentRefs from the attachment store. Open and
+    click tracking default to the current EmailSettings. Campaigns sent
+    right away from the web process are created with status 'sending', which
+    send workers ignore until resume_interrupted_sends() queues them.
+
+    With ``variants`` (dicts with subject, body and optionally template) the
+    campaign is an A/B test: ``test_percent`` of the recipients, split by
+    hash, get one variant each and the others are held until the variant
+    with the best ``winner_metric`` is sent to them (see emails.abtest).
+
+    The campaign belongs to ``tenant`` (the default tenant when omitted);
+    ``recipients`` are expected to be that tenant's.
+    """
+    email_settings = EmailSettings.get_settings()
+    fields = {
+        'track_opens': email_settings.track_opens if track_opens is None else track_opens,
+        'track_clicks': email_settings.track_clicks if track_clicks is None else track_clicks,
+        'status': status,
+        'idempotency_key': idempotency_key or None,
+    }
+    if tenant is not None:
+        fields['tenant'] = tenant
+    if variants:
+        fields.update(test_percent=test_percent, winner_metric=winner_metric, test_wait_minutes=test_wait_minutes)
+    if status == 'sending':
+        fields['started_at'] = timezone.now()
+    with transaction.atomic():
+        campaign = _create_campaign(
+            subject, body, recipients, template, name, shard_count, shard_key, priority, weight, variants, **fields
+        )
+        CampaignAttachment.objects.bulk_create([
+            CampaignAttachment(campaign=campaign, attachment=ref.stored, filename=ref.name, content_type=ref.content_type)
+            for ref in attachments or []
+        ])
+    logger.info(f"Queued campaign {campaign.pk} with {campaign.deliveries.count()} deliveries in {shard_count} shards")
+    return campaign
+
+
+def get_or_create_campaign(idempotency_key, *args, **kwargs):
+    """
+    create_campaign, unless a campaign with ``idempotency_key`` already exists.
+
+    Returns (campaign, created). A retried form post or API call carrying the
+    same key gets the original campaign back, so its recipients are never
+    queued twice; the unique index on (tenant, key) also settles concurrent
+    retries. Without a key a new campaign is always created.
+    """
+    campaigns = Campaign.objects.for_tenant(kwargs.get('tenant') or Tenant.default_id())
+    if idempotency_key:
+        existing = campaigns.filter(idempotency_key=idempotency_key).first()
+        if existing is not None:
+            logger.info(f"Campaign {existing.pk} already exists for idempotency key {idempotency_key}")
+            return existing, False
+    try:
+        return create_campaign(*args, idempotency_key=idempotency_key, **kwargs), True
+    except IntegrityError:
+        if not idempotency_key:
+            raise
+        return campaigns.get(idempotency_key=idempotency_key), False
+
+
+def resume_interrupted_sends(now=None):
+    """
+    Queue immediate sends whose web process stopped before finishing them; returns how many.
+
+    Such a send runs in a thread of the web process that keeps the deliveries
+    it is working on leased. A 'sending' campaign started more than
+    RESUME_GRACE_SECONDS ago with pending deliveries but no live lease has
+    lost that thread (a restart or a crash), so it is handed to the send
+    workers, which lease and send its pending deliveries like any queued
+    campaign's.
+    """
+    now = now or timezone.now()
+    pending = Delivery.objects.filter(campaign=OuterRef('pk'), status='pending')
+    return (
+        Campaign.objects.filter(status='sending', started_at__lt=now - timedelta(seconds=RESUME_GRACE_SECONDS))
+        .filter(Exists(pending))
+        .exclude(Exists(pending.filter(lease_expires_at__gt=now)))
+        .update(status='queued')
+    )
+
+
+def _create_campaign(subject, body, recipients, template, name, shard_count, shard_key, priority, weight,
+                     variants=None, **fields):
+    campaign = Campaign.objects.create(
+        **fields,
+        name=name,
+        template=template,
+        subject=subject,
+        body=body,
+        shard_count=shard_count,
+        shard_key=shard_key,
+        priority=priority,
+        weight=weight,
+    )
+    variant_ids = [variant.pk for variant in create_variants(campaign, variants)] if variants else []
+
+    if hasattr(recipients, 'iterator'):
+        # Hard-bounced addresses are never queued again
+        recipients = recipients.filter(is_suppressed=False).only('id', 'email').iterator(chunk_size=DELIVERY_CREATE_CHUNK)
+
+    batch = []
+    for recipient in recipients:
+        delivery = Delivery(
+            campaign=campaign,
+            recipient=recipient,
+            shard=shard_for(recipient, shard_count, shard_key),
+        )
+        if variant_ids:
+            index = variant_index(campaign.pk, recipient.pk, len(variant_ids), campaign.test_percent)
+            if index is None:
+                delivery.status = 'held'
+            else:
+                delivery.variant_id = variant_ids[index]
+        batch.append(delivery)
+        if len(batch) >= DELIVERY_CREATE_CHUNK:
+            Delivery.objects.bulk_create(batch, ignore_conflicts=True)
+            batch = []
+    if batch:
+        Delivery.objects.bulk_create(batch, ignore_conflicts=True)
+    return campaign
+
+
+def worker_shards(shard_count, worker_index, worker_count):
+    """Shards preferred by worker ``worker_index`` of ``worker_count``"""
+    return [shard for shard in range(shard_count) if shard % worker_count == worker_index]
+
+
+def claim_deliveries(campaign, worker_id, shards=None, batch_size=50, lease_seconds=300, recipient_fields=None):
+    """
+    Lease up to ``batch_size`` pending deliveries of ``campaign`` for ``worker_id``.
+
+    Candidates are read first and then leased with a single conditional UPDATE
+    that only matches rows whose lease is free or expired. When two workers race
+    for the same rows the database serializes the UPDATEs and the loser's WHERE
+    clause no longer matches, so each row is owned by exactly one worker. This
+    works on SQLite as well as on PostgreSQL, without SELECT ... FOR UPDATE.
+    With ``recipient_fields`` only those columns of the recipients are loaded.
+    """
+    now = timezone.now()
+    claimable = Q(status='pending') & (Q(lease_expires_at__isnull=True) | Q(lease_expires_at__lt=now))
+
+    candidates = Delivery.objects.filter(claimable, campaign=campaign)
+    if shards is not None:
+        candidates = candidates.filter(shard__in=shards)
+    candidate_ids = list(candidates.order_by('shard', 'pk').values_list('pk', flat=True)[:batch_size])
+    if not candidate_ids:
+        return []
+
+    Delivery.objects.filter(claimable, pk__in=candidate_ids).update(
+        lease_owner=worker_id,
+        lease_expires_at=now + timedelta(seconds=lease_seconds),
+        attempts=F('attempts') + 1,
+    )
+    deliveries = Delivery.objects.filter(pk__in=candidate_ids, lease_owner=worker_id, status='pending')
+    deliveries = deliveries.select_related('recipient')
+    if recipient_fields is not None:
+        deliveries = deliveries.only('attempts', 'recipient', 'variant', *(f'recipient__{field}' for field in recipient_fields))
+    return list(deliveries)
+
+
+def _defer_delivery(delivery, worker_id):
+    """Keep a delivery pending but leased out for a while after a provider deferral"""
+    return Delivery.objects.filter(pk=delivery.pk, lease_owner=worker_id).update(
+        lease_owner='',
+        lease_expires_at=timezone.now() + timedelta(seconds=DEFERRAL_BACKOFF_SECONDS),
+    )
+
+
+def _complete_campaign_if_done(campaign):
+    if not campaign.deliveries.filter(status='pending').exists():
+        if campaign.test_percent and start_test_wait(campaign):
+            return True
+        updated = Campaign.objects.filter(pk=campaign.pk, status='running').update(
+            status='completed',
+            completed_at=timezone.now(),
+        )
+        if updated:
+            logger.info(f"Campaign {campaign.pk} completed")
+        return True
+    return False
+
+
+def _batch_lease_seconds(lease_seconds, email_settings, throttle):
+    """
+    Lease length for one batch: at least twice the longest gap between two lease checks.
+
+    LeaseKeeper renews the batch's leases once half of this has passed, and the
+    gap is at most one send plus the email delay and the wait of a domain
+    throttled down to its minimum rate.
+    """
+    per_email = SEND_SECONDS_PER_EMAIL + email_settings.email_delay + 1 / throttle.config.get('min_rate', 0.1)
+    return max(lease_seconds, int(2 * (LEASE_MARGIN_SECONDS + per_email)))
+
+
+def process_batch(campaign, worker_id, shards=None, batch_size=50, lease_seconds=300,
+                  connection=None, from_email=None, throttle=None, factories=None):
+    """
+    Lease one batch of deliveries of ``campaign`` and send it.
+
+    The worker prefers its own ``shards`` and steals from any shard once they
+    are drained, so campaigns still finish when some workers die or were never
+    started. With ``shard_key='domain'`` every domain lives in a single shard,
+    so its throttle limits are enforced by one worker rather than split across
+    many.
+
+    ``factories`` caches one MessageFactory per campaign across batches, so a
+    campaign's MIME skeleton is built only once per worker.
+
+    Deliveries of A/B tested campaigns are sent their own variant's subject
+    and body, and the batch's outcomes are added to the variant counters.
+
+    No more deliveries are leased than the campaign's tenant has left of its
+    daily quota; the reservation for deliveries that were not sent (deferred,
+    or never leased) is given back afterwards. The batch is sent with the
+    tenant's active credential unless ``connection`` is given.
+
+    Leases are sized from the email delay and the throttle's minimum rate,
+    renewed while the batch is sent, and checked before every send, so a
+    slow batch is never sent a second time by another worker; deliveries
+    whose lease was lost anyway are skipped and counted as 'lost'.
+
+    Returns a dictionary with 'claimed', 'success', 'failed' and 'lost' counts.
+    """
+    results = {'claimed': 0, 'success': 0, 'failed': 0, 'lost': 0}
+    variants = {variant.pk: variant for variant in campaign.variants.all()} if campaign.test_percent else {}
+    texts = [campaign.subject, campaign.body]
+    for variant in variants.values():
+        texts += [variant.subject, variant.body]
+
+    try:
+        # Compiled once per process and cached; an invalid template stops the
+        # campaign instead of failing each of its deliveries
+        for text in texts:
+            compile_template(text)
+    except TemplateSyntaxError as e:
+        logger.error(f"[{worker_id}] Cancelling campaign {campaign.pk}, its template is invalid: {str(e)}")
+        Campaign.objects.filter(pk=campaign.pk).update(status='cancelled', completed_at=timezone.now())
+        return results
+
+    tenant = campaign.tenant
+    quota_day = timezone.localdate()
+    allowed = reserve_quota(tenant, batch_size, quota_day)
+    if not allowed:
+        logger.info(f"[{worker_id}] Tenant {tenant} has used its daily quota; campaign {campaign.pk} waits until tomorrow")
+        return results
+
+    if campaign.status == 'queued':
+        Campaign.objects.filter(pk=campaign.pk, status='queued').update(status='running', started_at=timezone.now())
+
+    # Only the recipient columns the templates actually use are loaded
+    fields = recipient_fields(*texts)
+    throttle = throttle or DomainThrottle()
+    lease_seconds = _batch_lease_seconds(lease_seconds, EmailSettings.get_settings(), throttle)
+    leased_at = time.monotonic()
+    deliveries = []
+    if shards is not None:
+        deliveries = claim_deliveries(campaign, worker_id, shards, allowed, lease_seconds, fields)
+    if not deliveries:
+        deliveries = claim_deliveries(campaign, worker_id, None, allowed, lease_seconds, fields)
+    if not deliveries:
+        release_quota(tenant, allowed, quota_day)
+        _complete_campaign_if_done(campaign)
+        return results
+    results['claimed'] = len(deliveries)
+
+    if connection is None:
+        connection, from_email = get_email_connection(campaign.tenant_id)
+    factories = factories if factories is not None else {}
+    factory = factories.get(campaign.pk)
+    if factory is None or factory.from_email != from_email:
+        factory = factories[campaign.pk] = MessageFactory(
+            from_email, campaign_attachment_refs(campaign), html=campaign.track_opens
+        )
+    tracker = Tracker.for_campaign(campaign)
+
+    log_buffer = EmailLogBuffer()
+    finished = {'sent': [], 'failed': []}
+    variant_counts = Counter()
+    leases = LeaseKeeper([delivery.pk for delivery in deliveries], worker_id, lease_seconds, leased_at)
+
+    # One SMTP session for the whole batch
+    opened = open_connection(connection)
+    try:
+        deliveries_by_recipient = {delivery.recipient_id: delivery for delivery in deliveries}
+        for recipient in throttle.schedule([delivery.recipient for delivery in deliveries]):
+            delivery = deliveries_by_recipient[recipient.pk]
+            message = variants.get(delivery.variant_id, campaign)
+            try:
+                personalized_subject = personalize_message(message.subject, recipient)
+                personalized_body = personalize_message(message.body, recipient)
+                if not leases.holds(delivery.pk):
+                    # The lease expired and another worker took the delivery over
+                    logger.warning(f"[{worker_id}] Lost the lease on delivery {delivery.pk}, not sending it")
+                    results['lost'] += 1
+                    continue
+                email = send_personalized_email(
+                    connection, from_email, personalized_subject, personalized_body, recipient,
+                    factory=factory, tracker=tracker
+                )
+                throttle.record(recipient.email)
+                log_buffer.add(
+                    recipient=recipient,
+                    template=message.template,
+                    campaign=campaign,
+                    subject=personalized_subject,
+                    body=personalized_body,
+                    status='sent',
+                    message_id=email.message_id,
+                    has_attachments=(factory.attachment_count > 0),
+                    attachment_count=factory.attachment_count,
+                    sent_at=timezone.now(),
+                )
+                finished['sent'].append(delivery.pk)
+                if delivery.variant_id:
+                    variant_counts[(delivery.variant_id, 'sent')] += 1
+                results['success'] += 1
+            except Exception as e:
+                throttle.record(recipient.email, e)
+                if opened:
+                    recover_connection(connection, e)
+                if is_deferral(e) and delivery.attempts < MAX_DELIVERY_ATTEMPTS:
+                    # Temporary rejection: retry once the backoff expires
+                    _defer_delivery(delivery, worker_id)
+                    logger.warning(f"[{worker_id}] Deferred {recipient.email}: {str(e)}")
+                    continue
+                log_buffer.add(
+                    recipient=recipient,
+                    template=message.template,
+                    campaign=campaign,
+                    subject=message.subject,
+                    body=message.body,
+                    status='failed',
+                    error_message=str(e),
+                )
+                finished['failed'].append(delivery.pk)
+                if delivery.variant_id:
+                    variant_counts[(delivery.variant_id, 'failed')] += 1
+                results['failed'] += 1
+                logger.error(f"[{worker_id}] Failed to send email to {recipient.email}: {str(e)}")
+
+            # Cached read, so delay changes apply to running campaigns
+            email_delay = EmailSettings.get_settings().email_delay
+            if email_delay > 0:
+                time.sleep(email_delay)
+    finally:
+        if opened:
+            connection.close()
+
+    # One log write and one UPDATE per outcome for the whole batch
+    log_buffer.flush()
+    for status, delivery_ids in finished.items():
+        recorded = finish_deliveries(delivery_ids, worker_id, status)
+        if recorded < len(delivery_ids):
+            logger.error(f"[{worker_id}] {len(delivery_ids) - recorded} {status} deliveries of campaign "
+                         f"{campaign.pk} were no longer leased by this worker")
+    add_counts(variant_counts)
+    release_quota(tenant, allowed - results['success'] - results['failed'], quota_day)
+
+    return results
+
+
+def run_worker(worker_id=None, campaign_id=None, worker_index=0, worker_count=1, batch_size=50,
+               lease_seconds=300, poll_interval=0, connection=None, from_email=None, metrics_interval=60,
+               tenant_id=None):
+    """
+    Send queued campaigns batch by batch until there is nothing left to lease.
+
+    The Dispatcher picks the campaign for every batch, so transactional mail
+    queued mid-campaign goes out after at most one bulk batch, and concurrent
+    campaigns share the worker by lane, tenant and campaign weight. With
+    ``tenant_id`` the worker only sends that tenant's campaigns. With
+    ``poll_interval`` > 0 the worker keeps polling for new campaigns instead
+    of exiting once idle. Lane metrics are logged every ``metrics_interval``
+    seconds and returned under 'lanes'. Every CHECK_SECONDS the worker also
+    chooses winners for A/B tests whose wait is over and queues immediate
+    sends that were interrupted (see resume_interrupted_sends).
+    """
+    worker_id = worker_id or make_worker_id()
+    totals = {'success': 0, 'failed': 0}
+    dispatcher = Dispatcher(campaign_id=campaign_id, tenant_id=tenant_id)
+    throttle = DomainThrottle()
+    factories = {}
+    metrics_logged_at = time.monotonic()
+    checked_at = None
+
+    while True:
+        if checked_at is None or time.monotonic() - checked_at >= CHECK_SECONDS:
+            # Either makes campaigns sendable that the dispatcher has not seen yet
+            if decide_winners() + resume_interrupted_sends():
+                dispatcher.refresh()
+            checked_at = time.monotonic()
+
+        campaign = dispatcher.next_campaign()
+        if campaign is None:
+            if poll_interval <= 0:
+                break
+            time.sleep(poll_interval)
+            dispatcher.refresh()
+            continue
+
+        shards = worker_shards(campaign.shard_count, worker_index, worker_count)
+        results = process_batch(
+            campaign, worker_id, shards, batch_size, lease_seconds, connection, from_email, throttle, factories
+        )
+        dispatcher.record(campaign, results['claimed'], results['success'])
+        totals['success'] += results['success']
+        totals['failed'] += results['failed']
+
+        if time.monotonic() - metrics_logged_at >= metrics_interval:
+            logger.info(f"[{worker_id}] Lane metrics: {dispatcher.metrics()}")
+            metrics_logged_at = time.monotonic()
+
+    for factory in factories.values():
+        factory.close()
+    totals['lanes'] = dispatcher.metrics()
+    return totals
@@ -0,0 +1,144 @@
+import random
+import time
+import logging
+from collections import Counter
+from django.core.mail.backends.base import BaseEmailBackend
+from .models import EmailSettings, Recipient
+from .mime import MessageFactory
+from .templating import recipient_fields
+from .throttling import DomainThrottle, throttle_key
+from .tracking import Tracker
+from .utils import personalize_message, send_personalized_email
+
+logger = logging.getLogger(__name__)
+
+# Assumed time for one SMTP transaction when projecting wall-clock time; real
+# servers typically take 0.1-0.5s per message over an open connection
+ASSUMED_SMTP_SECONDS = 0.2
+DEFAULT_SAMPLE = 500
+
+
+class NullEmailBackend(BaseEmailBackend):
+    """Serializes messages exactly as the SMTP backend would, counts them and sends nothing"""
+
+    def __init__(self, **kwargs):
+        super().__init__(**kwargs)
+        self.messages = 0
+        self.bytes = 0
+
+    def send_messages(self, email_messages):
+        for message in email_messages:
+            self.bytes += len(message.message().as_bytes(linesep='\r\n'))
+            self.messages += 1
+        return len(email_messages)
+
+
+def pacing_seconds(count, email_settings, workers=None):
+    """
+    Seconds spent sleeping between ``count`` emails under the configured delays.
+
+    Immediate sends (``workers=None``) pause batch_delay after every batch_size
+    emails and email_delay after the others. Campaigns sent by send_worker
+    sleep email_delay after every email, split across ``workers`` processes.
+    """
+    if count <= 0:
+        return 0.0
+    if workers:
+        return count * email_settings.email_delay / workers
+    gaps = count - 1
+    batch_pauses = gaps // email_settings.batch_size if email_settings.batch_size > 0 else 0
+    return batch_pauses * email_settings.batch_delay + (gaps - batch_pauses) * email_settings.email_delay
+
+
+def simulate_send(subject, body, recipients, attachments=None, sample=DEFAULT_SAMPLE, track_opens=None,
+                  track_clicks=None, smtp_seconds=ASSUMED_SMTP_SECONDS, workers=None, from_email='sender@example.com'):
+    """
+    Dry-run a send: render and build messages against a null transport and project its duration.
+
+    At most ``sample`` randomly chosen recipients are rendered (all of them
+    when ``sample`` is None); their build time and message sizes are
+    extrapolated to the whole list. Nothing is sent over SMTP and no EmailLog
+    rows are written. The projection adds the configured delays and the
+    assumed per-message SMTP time, and is never shorter than the time the
+    slowest rate-limited domain needs on its own.
+    """
+    email_settings = EmailSettings.get_settings()
+    track_opens = email_settings.track_opens if track_opens is None else track_opens
+    track_clicks = email_settings.track_clicks if track_clicks is None else track_clicks
+
+    # One pass over the addresses for the per-domain counts, then only the sample is loaded
+    if hasattr(recipients, 'values_list'):
+        recipients = recipients.filter(is_suppressed=False)
+        addresses = dict(recipients.values_list('pk', 'email').iterator(chunk_size=5000))
+    else:
+        recipients = list(recipients)
+        addresses = {recipient.pk: recipient.email for recipient in recipients}
+    total = len(addresses)
+
+    sample_ids = list(addresses)
+    if sample is not None and total > sample:
+        sample_ids = random.sample(sample_ids, sample)
+    if isinstance(recipients, list):
+        chosen = set(sample_ids)
+        sampled = [recipient for recipient in recipients if recipient.pk in chosen]
+    else:
+        sampled = list(Recipient.objects.filter(pk__in=sample_ids).only(*recipient_fields(subject, body)))
+
+    backend = NullEmailBackend()
+    tracker = Tracker(opens=track_opens, clicks=track_clicks)
+    factory = MessageFactory(from_email, attachments, html=tracker.opens)
+    render_seconds = build_seconds = 0.0
+    errors = []
+    try:
+        for recipient in sampled:
+            started = time.perf_counter()
+            try:
+                personalized_subject = personalize_message(subject, recipient)
+                personalized_body = personalize_message(body, recipient)
+                rendered = time.perf_counter()
+                send_personalized_email(
+                    backend, from_email, personalized_subject, personalized_body, recipient,
+                    factory=factory, tracker=tracker
+                )
+            except Exception as e:
+                errors.append(f"{recipient.email}: {str(e)}")
+                continue
+            finished = time.perf_counter()
+            render_seconds += rendered - started
+            build_seconds += finished - rendered
+    finally:
+        factory.close()
+
+    simulated = backend.messages
+    scale = total / simulated if simulated else 0
+    throttle = DomainThrottle()
+    slowest_domain, slowest_domain_seconds = None, 0.0
+    for key, count in Counter(throttle_key(email) for email in addresses.values()).items():
+        rate = throttle.limit(key).rate
+        if rate and count / rate > slowest_domain_seconds:
+            slowest_domain, slowest_domain_seconds = key, count / rate
+
+    cpu_seconds = (render_seconds + build_seconds) * scale
+    delays = pacing_seconds(total, email_settings, workers)
+    sending = (cpu_seconds + total * smtp_seconds) / (workers or 1)
+    projected = max(sending + delays, slowest_domain_seconds)
+
+    results = {
+        'recipients': total,
+        'simulated': simulated,
+        'failed': len(errors),
+        'errors': errors[:20],
+        'render_per_second': round(simulated / render_seconds, 1) if render_seconds else None,
+        'build_per_second': round(simulated / build_seconds, 1) if build_seconds else None,
+        'bytes_per_message': round(backend.bytes / simulated) if simulated else 0,
+        'total_bytes': round(backend.bytes * scale),
+        'attachments': factory.attachment_count,
+        'cpu_seconds': round(cpu_seconds, 2),
+        'smtp_seconds': round(total * smtp_seconds / (workers or 1), 2),
+        'delay_seconds': round(delays, 2),
+        'slowest_domain': slowest_domain,
+        'slowest_domain_seconds': round(slowest_domain_seconds, 2),
+        'projected_seconds': round(projected, 2),
+    }
+    logger.info(f"Simulated send to {total} recipients ({simulated} rendered): {results['projected_seconds']}s projected")
+    return results
@@ -0,0 +1,205 @@
+import random
+import socketserver
+import threading
+import time
+import zlib
+import logging
+from collections import Counter, deque
+
+logger = logging.getLogger(__name__)
+
+# Failure buckets are hundredths of a percent
+BUCKETS = 10000
+
+
+class SinkStats:
+    """What an SmtpSink saw: counters, per-address outcomes and server-side transaction times"""
+
+    def __init__(self):
+        self.lock = threading.Lock()
+        self.connections = 0
+        self.accepted = Counter()
+        self.rejected = Counter()
+        self.deferred = Counter()
+        self.throttled = Counter()
+        self.bytes = 0
+        self.transaction_seconds = []
+        self.started = time.monotonic()
+
+    def snapshot(self):
+        with self.lock:
+            elapsed = time.monotonic() - self.started
+            accepted = sum(self.accepted.values())
+            return {
+                'connections': self.connections,
+                'accepted': accepted,
+                'rejected': sum(self.rejected.values()),
+                'deferred': sum(self.deferred.values()),
+                'throttled': sum(self.throttled.values()),
+                'duplicates': sum(count - 1 for count in self.accepted.values() if count > 1),
+                'bytes': self.bytes,
+                'accepted_per_second': round(accepted / elapsed, 1) if elapsed > 0 else 0.0,
+            }
+
+
+class _SMTPHandler(socketserver.StreamRequestHandler):
+    """One SMTP session: enough of RFC 5321 for smtplib and Django's SMTP backend"""
+
+    def reply(self, line):
+        self.wfile.write(f'{line}\r\n'.encode())
+
+    def handle(self):
+        sink = self.server.sink
+        with sink.stats.lock:
+            sink.stats.connections += 1
+        self.reply(f'220 {sink.hostname} ESMTP echomailer sink')
+        mail_from, recipients, started = None, [], None
+        while True:
+            line = self.rfile.readline()
+            if not line:
+                return
+            command, _, argument = line.decode('utf-8', 'replace').strip().partition(' ')
+            command = command.upper()
+            if command == 'EHLO':
+                self.wfile.write(f'250-{sink.hostname}\r\n250-8BITMIME\r\n250-SMTPUTF8\r\n250 SIZE\r\n'.encode())
+            elif command == 'HELO':
+                self.reply(f'250 {sink.hostname}')
+            elif command == 'MAIL':
+                mail_from, recipients, started = argument, [], time.monotonic()
+                self.reply('250 2.1.0 OK')
+            elif command == 'RCPT':
+                if mail_from is None:
+                    self.reply('503 5.5.1 MAIL first')
+                    continue
+                address = argument.partition(':')[2].split('>', 1)[0].strip(' <').lower()
+                code, text = sink.recipient_outcome(address)
+                if code == 250:
+                    recipients.append(address)
+                self.reply(f'{code} {text}')
+            elif command == 'DATA':
+                if not recipients:
+                    self.reply('554 5.5.1 No valid recipients')
+                    continue
+                self.reply('354 End data with <CR><LF>.<CR><LF>')
+                size = 0
+                while True:
+                    data = self.rfile.readline()
+                    if not data or data in (b'.\r\n', b'.\n'):
+                        break
+                    size += len(data)
+                if not data:
+                    return
+                sink.delay()
+                with sink.stats.lock:
+                    sink.stats.bytes += size
+                    sink.stats.transaction_seconds.append(time.monotonic() - started)
+                    for address in recipients:
+                        sink.stats.accepted[address] += 1
+                mail_from, recipients = None, []
+                self.reply('250 2.0.0 Queued')
+            elif command == 'RSET':
+                mail_from, recipients = None, []
+                self.reply('250 2.0.0 OK')
+            elif command == 'NOOP':
+                self.reply('250 2.0.0 OK')
+            elif command == 'QUIT':
+                self.reply('221 2.0.0 Bye')
+                return
+            else:
+                self.reply('502 5.5.2 Command not implemented')
+
+
+class _Server(socketserver.ThreadingTCPServer):
+    daemon_threads = True
+    allow_reuse_address = True
+
+
+class SmtpSink:
+    """
+    Local SMTP server that accepts and discards mail, for capacity testing.
+
+    ``latency_ms`` (plus up to ``jitter_ms``) is added before each message is
+    acknowledged, like a remote server's processing time. ``fail_rate`` and
+    ``defer_rate`` are fractions of recipient addresses that get a permanent
+    550 or a temporary 451 at RCPT; which addresses fail is decided by a hash,
+    so it is the same on every run. With ``domain_rate`` a destination domain
+    accepts at most that many messages per second and answers 451 beyond it,
+    like a provider throttling a sender. Run it in the background with
+    start() and stop(), or in the foreground with serve_forever().
+    """
+
+    def __init__(self, host='127.0.0.1', port=2525, latency_ms=0, jitter_ms=0, fail_rate=0.0, defer_rate=0.0,
+                 domain_rate=None):
+        self.latency_ms = latency_ms
+        self.jitter_ms = jitter_ms
+        self.fail_rate = fail_rate
+        self.defer_rate = defer_rate
+        self.domain_rate = domain_rate
+        self.hostname = 'sink.echomailer.invalid'
+        self.stats = SinkStats()
+        self.domain_windows = {}
+        self.server = _Server((host, port), _SMTPHandler)
+        self.server.sink = self
+        self.thread = None
+
+    @property
+    def address(self):
+        return self.server.server_address[:2]
+
+    def planned_outcome(self, address):
+        """'rejected', 'deferred' or 'accepted': what the failure rates decide for ``address``"""
+        bucket = zlib.crc32(address.lower().encode()) % BUCKETS
+        if bucket < self.fail_rate * BUCKETS:
+            return 'rejected'
+        if bucket < (self.fail_rate + self.defer_rate) * BUCKETS:
+            return 'deferred'
+        return 'accepted'
+
+    def _over_domain_rate(self, domain):
+        if not self.domain_rate:
+            return False
+        now = time.monotonic()
+        with self.stats.lock:
+            window = self.domain_windows.setdefault(domain, deque())
+            while window and window[0] <= now - 1:
+                window.popleft()
+            if len(window) >= self.domain_rate:
+                return True
+            window.append(now)
+            return False
+
+    def recipient_outcome(self, address):
+        """SMTP code and text for a RCPT TO of ``address``, recorded in the stats"""
+        outcome = self.planned_outcome(address)
+        if outcome == 'rejected':
+            with self.stats.lock:
+                self.stats.rejected[address] += 1
+            return 550, '5.1.1 Mailbox unavailable'
+        if outcome == 'deferred':
+            with self.stats.lock:
+                self.stats.deferred[address] += 1
+            return 451, '4.3.0 Temporary failure, try again later'
+        if self._over_domain_rate(address.rpartition('@')[2]):
+            with self.stats.lock:
+                self.stats.throttled[address] += 1
+            return 451, '4.7.0 Too many messages from your IP, slow down'
+        return 250, '2.1.5 OK'
+
+    def delay(self):
+        seconds = (self.latency_ms + random.uniform(0, self.jitter_ms)) / 1000
+        if seconds > 0:
+            time.sleep(seconds)
+
+    def start(self):
+        self.thread = threading.Thread(target=self.server.serve_forever, name='smtp-sink', daemon=True)
+        self.thread.start()
+        return self
+
+    def serve_forever(self):
+        self.server.serve_forever()
+
+    def stop(self):
+        self.server.shutdown()
+        self.server.server_close()
+        if self.thread is not None:
+            self.thread.join()
@@ -0,0 +1,140 @@
+import functools
+import re
+from django.core.exceptions import ValidationError
+from django.template import Template, TemplateSyntaxError
+from django.template.base import FilterExpression, Node, NodeList, Variable
+from django.template.defaulttags import ForNode, WithNode
+from django.template.smartif import TokenBase
+
+# Variables a personalized email can use, and the Recipient fields each one needs loaded
+RECIPIENT_VARIABLES = {
+    'email': ['email'],
+    'company': ['company'],
+}
+# Any other variable is a custom field, read from this JSON column
+CUSTOM_FIELDS_COLUMN = 'custom_fields'
+FIELD_NAME_PATTERN = re.compile(r'^[a-z_][a-z0-9_]*$')
+# Always loaded: the primary key for logs/tracking, the address to send to and the tenant logs belong to
+BASE_RECIPIENT_FIELDS = ['id', 'email', 'tenant']
+
+COMPILED_CACHE_SIZE = 256
+
+
+@functools.lru_cache(maxsize=COMPILED_CACHE_SIZE)
+def compile_template(text):
+    """
+    Parsed Template for ``text``, compiled once per process.
+
+    Sends render the same subject and body for every recipient, so parsing
+    them per email was wasted work. Raises TemplateSyntaxError.
+    """
+    return Template(text)
+
+
+def _collect(value, bound, found):
+    if isinstance(value, FilterExpression):
+        variables = [value.var] + [arg for _, args in value.filters for lookup, arg in args if lookup]
+        for variable in variables:
+            if isinstance(variable, Variable) and variable.lookups and variable.lookups[0] not in bound:
+                found.add(variable.lookups[0])
+    elif isinstance(value, ForNode):
+        _collect(value.sequence, bound, found)
+        inner = bound | set(value.loopvars) | {'forloop'}
+        _collect(value.nodelist_loop, inner, found)
+        _collect(value.nodelist_empty, bound, found)
+    elif isinstance(value, WithNode):
+        _collect(value.extra_context, bound, found)
+        _collect(value.nodelist, bound | set(value.extra_context), found)
+    elif isinstance(value, Node):
+        for attribute in vars(value).values():
+            _collect(attribute, bound, found)
+    elif isinstance(value, TokenBase):
+        for attribute in ('value', 'first', 'second'):
+            _collect(getattr(value, attribute, None), bound, found)
+    elif isinstance(value, (list, tuple, NodeList)):
+        for item in value:
+            _collect(item, bound, found)
+    elif isinstance(value, dict):
+        for item in value.values():
+            _collect(item, bound, found)
+
+
+@functools.lru_cache(maxsize=COMPILED_CACHE_SIZE)
+def template_variables(text):
+    """
+    Sorted tuple of the context variables ``text`` reads, e.g. ('company', 'email').
+
+    Loop and {% with %} variables are left out. Raises TemplateSyntaxError.
+    """
+    found = set()
+    _collect(compile_template(text).nodelist, frozenset(), found)
+    return tuple(sorted(found))
+
+
+def validate_template(text, custom_fields=()):
+    """
+    Compile ``text`` and check it only uses variables available to emails.
+
+    ``custom_fields`` are the custom field names known so far (CustomField.names()).
+    """
+    try:
+        variables = template_variables(text)
+    except TemplateSyntaxError as e:
+        raise ValidationError(f'Template syntax error: {e}')
+    available = list(RECIPIENT_VARIABLES) + sorted(custom_fields)
+    unknown = [name for name in variables if name not in available]
+    if unknown:
+        raise ValidationError(
+            f"Unknown variable{'s' if len(unknown) > 1 else ''} {', '.join(unknown)}. "
+            f"Available: {', '.join(available)}"
+        )
+    return variables
+
+
+def custom_field_name(header):
+    """
+    Custom field name for a CSV column header, e.g. 'First Name' -> 'first_name'.
+
+    Returns None for headers that cannot be used as a template variable or
+    that would shadow a built-in one.
+    """
+    name = re.sub(r'\W+', '_', header.strip().lower()).strip('_')
+    if not FIELD_NAME_PATTERN.match(name) or name in RECIPIENT_VARIABLES or len(name) > 50:
+        return None
+    return name
+
+
+def recipient_context(text, recipient):
+    """
+    Context for rendering ``text`` for ``recipient``.
+
+    Only the variables the template uses are read, so recipients loaded with
+    recipient_fields() never trigger a query for a deferred column. Custom
+    fields a recipient does not have render as an empty string.
+    """
+    context = {}
+    for name in template_variables(text):
+        if name in RECIPIENT_VARIABLES:
+            context[name] = getattr(recipient, name)
+        else:
+            context[name] = recipient.custom_fields.get(name, '')
+    return context
+
+
+def recipient_fields(*texts):
+    """
+    Recipient fields to load, e.g. with .only(), to render all of ``texts``.
+
+    Invalid templates fall back to every personalization field. Custom fields
+    live in one JSON column, loaded with the row like any other field.
+    """
+    fields = list(BASE_RECIPIENT_FIELDS)
+    try:
+        variables = {name for text in texts for name in template_variables(text)}
+    except TemplateSyntaxError:
+        variables = set(RECIPIENT_VARIABLES) | {CUSTOM_FIELDS_COLUMN}
+    for name in sorted(variables):
+        for field in RECIPIENT_VARIABLES.get(name, [CUSTOM_FIELDS_COLUMN]):
+            if field not in fields:
+                fields.append(field)
+    return fields
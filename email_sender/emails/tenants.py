@@ -0,0 +1,120 @@
+import logging
+from django.db.models import F, Q
+from django.utils import timezone
+from django.utils.functional import SimpleLazyObject
+from .models import Tenant, TenantUsage
+
+logger = logging.getLogger(__name__)
+
+SESSION_KEY = 'tenant_id'
+# Attempts to reserve quota when other processes keep changing the counter
+QUOTA_RETRIES = 5
+
+
+def accessible_tenants(user):
+    """
+    Active tenants ``user`` may work in.
+
+    Superusers can use every tenant and other users the tenants they are
+    members of. The default tenant is open to everyone, as the whole
+    application was before tenants existed.
+    """
+    tenants = Tenant.objects.filter(is_active=True)
+    if user is not None and user.is_superuser:
+        return tenants
+    access = Q(pk=Tenant.default_id())
+    if user is not None and user.is_authenticated:
+        access |= Q(members=user)
+    return tenants.filter(access).distinct()
+
+
+def resolve_tenant(request):
+    """The tenant chosen in this session, or the default tenant"""
+    tenants = accessible_tenants(getattr(request, 'user', None))
+    tenant_id = request.session.get(SESSION_KEY) if hasattr(request, 'session') else None
+    tenant = tenants.filter(pk=tenant_id).first() if tenant_id else None
+    return tenant or Tenant.objects.get(pk=Tenant.default_id())
+
+
+class TenantMiddleware:
+    """
+    Sets request.tenant, the tenant whose data the web UI shows and changes.
+
+    Resolved on first use, so requests that never look at it (tracking pixels,
+    static files) cost no query. Must come after the session and
+    authentication middleware.
+    """
+
+    def __init__(self, get_response):
+        self.get_response = get_response
+
+    def __call__(self, request):
+        request.tenant = SimpleLazyObject(lambda: resolve_tenant(request))
+        return self.get_response(request)
+
+
+def tenant_context(request):
+    """Template context: the current tenant and, for signed in users, the tenants they can switch to"""
+    if not hasattr(request, 'tenant'):
+        return {}
+    user = getattr(request, 'user', None)
+    return {
+        'current_tenant': request.tenant,
+        'switchable_tenants': list(accessible_tenants(user)) if user is not None and user.is_authenticated else [],
+    }
+
+
+def reserve_quota(tenant, count, day=None):
+    """
+    Reserve up to ``count`` emails of ``tenant``'s daily quota and return how many were granted.
+
+    Usage is one counter row per tenant and day, changed with conditional
+    UPDATEs that only match the value just read, so concurrent workers and
+    web processes can never hand out more than the quota between them.
+    Tenants without a quota are granted everything without a query. Emails
+    that end up not being sent should be given back with release_quota().
+    """
+    if not tenant.daily_quota or count <= 0:
+        return count
+    day = day or timezone.localdate()
+    usage = TenantUsage.objects.filter(tenant=tenant, day=day)
+    for _ in range(QUOTA_RETRIES):
+        sent = usage.values_list('sent', flat=True).first()
+        if sent is None:
+            TenantUsage.objects.bulk_create([TenantUsage(tenant=tenant, day=day)], ignore_conflicts=True)
+            sent = 0
+        granted = min(count, tenant.daily_quota - sent)
+        if granted <= 0:
+            return 0
+        if usage.filter(sent=sent).update(sent=F('sent') + granted):
+            return granted
+    logger.warning(f"Could not reserve quota for tenant {tenant.pk} after {QUOTA_RETRIES} attempts")
+    return 0
+
+
+def release_quota(tenant, count, day=None):
+    """Give back ``count`` reserved emails that were not sent"""
+    if not tenant.daily_quota or count <= 0:
+        return
+    TenantUsage.objects.filter(tenant=tenant, day=day or timezone.localdate(), sent__gte=count).update(
+        sent=F('sent') - count
+    )
+
+
+def exhausted_tenant_ids(day=None):
+    """Tenants that have used up today's quota, with one query"""
+    return set(
+        TenantUsage.objects.filter(
+            day=day or timezone.localdate(), tenant__daily_quota__gt=0, sent__gte=F('tenant__daily_quota'),
+        ).values_list('tenant_id', flat=True)
+    )
+
+
+def quota_status(tenant):
+    """Today's quota, usage and remaining emails of ``tenant``; remaining is None without a quota"""
+    sent = TenantUsage.objects.filter(tenant=tenant, day=timezone.localdate()).values_list('sent', flat=True).first() or 0
+    return {
+        'daily_quota': tenant.daily_quota,
+        'sent_today': sent,
+        'remaining': max(tenant.daily_quota - sent, 0) if tenant.daily_quota else None,
+    }
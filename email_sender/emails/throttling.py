@@ -0,0 +1,134 @@
+import heapq
+import itertools
+import smtplib
+import threading
+import time
+import logging
+from collections import OrderedDict, deque
+from django.conf import settings
+
+logger = logging.getLogger(__name__)
+
+# Domains that are served by the same provider share one set of limits
+PROVIDER_DOMAINS = {
+    'gmail': ['gmail.com', 'googlemail.com'],
+    'outlook': ['outlook.com', 'hotmail.com', 'live.com', 'msn.com'],
+    'yahoo': ['yahoo.com', 'ymail.com', 'rocketmail.com'],
+}
+DOMAIN_PROVIDERS = {domain: provider for provider, domains in PROVIDER_DOMAINS.items() for domain in domains}
+
+# SMTP codes that mean "slow down / try later" rather than a hard failure
+DEFERRAL_CODES = {421, 450, 451, 452}
+
+
+def recipient_domain(email):
+    return email.rsplit('@', 1)[-1].strip().lower()
+
+
+def throttle_key(email):
+    """Key that limits are tracked under: the provider for known domains, otherwise the domain"""
+    domain = recipient_domain(email)
+    return DOMAIN_PROVIDERS.get(domain, domain)
+
+
+def is_deferral(error):
+    """Whether an exception raised while sending is a temporary, throttling-style rejection"""
+    if isinstance(error, smtplib.SMTPRecipientsRefused):
+        return any(code in DEFERRAL_CODES for code, _ in error.recipients.values())
+    if isinstance(error, smtplib.SMTPResponseException):
+        return error.smtp_code in DEFERRAL_CODES
+    return False
+
+
+class DomainLimit:
+    """Adaptive limits for one destination domain or provider"""
+
+    def __init__(self, rate=None, max_rate=None):
+        # Rates are messages per second; None means unlimited until a deferral is seen
+        self.rate = rate
+        self.max_rate = max_rate or rate
+        self.next_allowed = 0.0
+        self.deferrals = 0
+
+    @property
+    def interval(self):
+        return 1.0 / self.rate if self.rate else 0.0
+
+
+class DomainThrottle:
+    """
+    Per-destination-domain pacing and send ordering.
+
+    Limits come from settings.EMAIL_DOMAIN_THROTTLE and adapt to responses:
+    every deferral halves the domain's rate, every success raises it additively
+    back towards its configured maximum (AIMD).
+
+    Only the rate is limited, not concurrency: every sender (a send_worker
+    batch or the immediate send pipeline) transmits from a single thread, so
+    it never has more than one message in flight to a domain anyway. Across
+    workers, campaigns sharded by domain keep each domain in a single shard,
+    which is normally leased by one worker at a time.
+    """
+
+    def __init__(self, limits=None):
+        self.config = limits if limits is not None else getattr(settings, 'EMAIL_DOMAIN_THROTTLE', {})
+        self.limits = {}
+        self.lock = threading.Lock()
+
+    def limit(self, key):
+        with self.lock:
+            if key not in self.limits:
+                options = self.config.get(key) or self.config.get('default', {})
+                self.limits[key] = DomainLimit(rate=options.get('rate'), max_rate=options.get('max_rate'))
+            return self.limits[key]
+
+    def record(self, email, error=None):
+        """Feed the outcome of a send back into the domain's rate"""
+        key = throttle_key(email)
+        limit = self.limit(key)
+        with self.lock:
+            if error is not None and is_deferral(error):
+                limit.deferrals += 1
+                floor = self.config.get('min_rate', 0.1)
+                # Unlimited domains fall back to a conservative pace once they push back
+                current = limit.rate or self.config.get('deferral_rate', 2.0)
+                limit.rate = max(current / 2, floor)
+                limit.next_allowed = time.monotonic() + limit.interval
+                logger.warning(f"Deferral from {key}, throttling to {limit.rate:.2f} msg/s")
+            elif error is None and limit.rate:
+                limit.rate += self.config.get('rate_step', 0.1)
+                if limit.max_rate:
+                    limit.rate = min(limit.rate, limit.max_rate)
+
+    def schedule(self, recipients):
+        """
+        Yield recipients grouped by domain and interleaved across domains.
+
+        The next recipient always comes from the domain that is ready soonest,
+        so a throttled provider never stalls sends to other providers; the
+        generator only sleeps when every remaining domain is waiting.
+        """
+        groups = OrderedDict()
+        for recipient in recipients:
+            groups.setdefault(throttle_key(recipient.email), deque()).append(recipient)
+
+        counter = itertools.count()
+        heap = [(0.0, next(counter), key) for key in groups]
+        heapq.heapify(heap)
+
+        while heap:
+            ready, _, key = heapq.heappop(heap)
+            limit = self.limit(key)
+            if limit.next_allowed > ready:
+                # A deferral pushed this domain back since it was queued
+                heapq.heappush(heap, (limit.next_allowed, next(counter), key))
+                continue
+            wait = ready - time.monotonic()
+            if wait > 0:
+                time.sleep(wait)
+
+            limit.next_allowed = time.monotonic() + limit.interval
+            yield groups[key].popleft()
+
+            if groups[key]:
+                heapq.heappush(heap, (limit.next_allowed, next(counter), key))
@@ -0,0 +1,215 @@
+import re
+import logging
+from datetime import timedelta
+from django.conf import settings
+from django.core import signing
+from django.db import transaction
+from django.db.models import Q
+from django.http import Http404, HttpResponse, HttpResponseRedirect
+from django.urls import reverse
+from django.utils import timezone
+from django.utils.html import escape
+from django.views.decorators.cache import never_cache
+from .abtest import record_engagement
+from .logbuffer import TrackingEventBuffer
+from .models import Campaign, Engagement, Recipient, RollupCursor, TrackingEvent
+
+logger = logging.getLogger(__name__)
+
+URL_PATTERN = re.compile(r'https?://[^\s<>"\']+')
+# Punctuation that usually ends a sentence rather than a URL
+URL_TRAILING = '.,;:!?)]'
+
+# 1x1 transparent GIF
+PIXEL = (
+    b'GIF89a\x01\x00\x01\x00\x80\x00\x00\x00\x00\x00\xff\xff\xff!\xf9\x04\x01\x00\x00\x00\x00'
+    b',\x00\x00\x00\x00\x01\x00\x01\x00\x00\x02\x02D\x01\x00;'
+)
+
+# Events are only rolled up once they are this much older than the flush
+# interval, so rows still being written by another process are never skipped
+ROLLUP_SETTLE_SECONDS = 30
+
+signer = signing.Signer(salt='emails.tracking')
+event_buffer = TrackingEventBuffer()
+
+
+class Tracker:
+    """
+    Adds tracked links and an open pixel to personalized bodies of one send.
+
+    Links and pixels carry a signed campaign/recipient token, so the tracking
+    endpoints need no database lookup to attribute an event.
+    """
+
+    def __init__(self, campaign_id=None, opens=False, clicks=False, base_url=None):
+        self.campaign_id = campaign_id
+        self.opens = opens
+        self.clicks = clicks
+        self.base_url = (base_url or settings.TRACKING_BASE_URL).rstrip('/')
+
+    @classmethod
+    def for_campaign(cls, campaign):
+        return cls(campaign.pk, campaign.track_opens, campaign.track_clicks)
+
+    @property
+    def enabled(self):
+        return self.opens or self.clicks
+
+    def click_url(self, url, recipient_id):
+        token = signer.sign_object([self.campaign_id, recipient_id, url], compress=True)
+        return self.base_url + reverse('track_click', args=[token])
+
+    def open_url(self, recipient_id):
+        token = signer.sign(f'{self.campaign_id or 0}.{recipient_id}')
+        return self.base_url + reverse('track_open', args=[token])
+
+    def render(self, body, recipient_id):
+        """Return (text, html) for a body; html is None unless opens are tracked"""
+        pieces = []
+        position = 0
+        for match in URL_PATTERN.finditer(body):
+            url = match.group().rstrip(URL_TRAILING)
+            pieces.append((body[position:match.start()], None))
+            pieces.append((url, self.click_url(url, recipient_id) if self.clicks else url))
+            position = match.start() + len(url)
+        pieces.append((body[position:], None))
+
+        text = ''.join(target or piece for piece, target in pieces)
+        if not self.opens:
+            return text, None
+
+        html = ''.join(
+            f'<a href="{escape(target)}">{escape(piece)}</a>' if target else escape(piece)
+            for piece, target in pieces
+        ).replace('\n', '<br>\n')
+        html = (
+            f'<html><body>{html}'
+            f'<img src="{escape(self.open_url(recipient_id))}" width="1" height="1" alt="" style="display:none">'
+            f'</body></html>'
+        )
+        return text, html
+
+
+def _record(request, kind, campaign_id, recipient_id, url=''):
+    event_buffer.add(
+        campaign_id=campaign_id or None,
+        recipient_id=recipient_id,
+        kind=kind,
+        url=url,
+        user_agent=request.headers.get('User-Agent', '')[:255],
+        created_at=timezone.now(),
+    )
+
+
+@never_cache
+def track_open(request, token):
+    """Record an open and return the pixel; invalid tokens still get the image"""
+    try:
+        campaign_id, recipient_id = signer.unsign(token).split('.')
+        _record(request, 'open', int(campaign_id), int(recipient_id))
+    except (signing.BadSignature, ValueError):
+        logger.warning(f"Invalid open tracking token {token[:40]}")
+    return HttpResponse(PIXEL, content_type='image/gif')
+
+
+@never_cache
+def track_click(request, token):
+    """Record a click and redirect to the original link"""
+    try:
+        campaign_id, recipient_id, url = signer.unsign_object(token)
+    except (signing.BadSignature, ValueError):
+        raise Http404('Unknown link')
+    _record(request, 'click', campaign_id, recipient_id, url)
+    return HttpResponseRedirect(url)
+
+
+def rollup_events(limit=50000):
+    """
+    Fold new TrackingEvents into Engagement rows and return how many were processed.
+
+    Runs in one transaction holding a lock on its RollupCursor, so concurrent
+    calls are serialized and every event is counted exactly once. Events of
+    recipients or campaigns that no longer exist are skipped.
+    Recipients' first opens and clicks in A/B tested campaigns are also
+    added to the counters of the variant they were sent.
+    """
+    cutoff = timezone.now() - timedelta(
+        seconds=getattr(settings, 'TRACKING_FLUSH_SECONDS', 2.0) + ROLLUP_SETTLE_SECONDS
+    )
+    with transaction.atomic():
+        RollupCursor.objects.get_or_create(name='engagement')
+        cursor = RollupCursor.objects.select_for_update().get(name='engagement')
+        events = list(
+            TrackingEvent.objects.filter(pk__gt=cursor.position)
+            .order_by('pk')
+            .values_list('pk', 'campaign_id', 'recipient_id', 'kind', 'created_at')[:limit]
+        )
+
+        totals = {}
+        processed = 0
+        for pk, campaign_id, recipient_id, kind, created_at in events:
+            if created_at >= cutoff:
+                break
+            total = totals.setdefault((campaign_id, recipient_id), {
+                'opens': 0, 'clicks': 0, 'first_opened_at': None, 'first_clicked_at': None, 'last_event_at': None,
+            })
+            if kind == 'open':
+                total['opens'] += 1
+                total['first_opened_at'] = total['first_opened_at'] or created_at
+            else:
+                total['clicks'] += 1
+                total['first_clicked_at'] = total['first_clicked_at'] or created_at
+            total['last_event_at'] = created_at
+            processed += 1
+            cursor.position = pk
+
+        if not processed:
+            return 0
+
+        recipient_ids = set(Recipient.objects.filter(
+            pk__in={recipient_id for _, recipient_id in totals}
+        ).values_list('pk', flat=True))
+        campaign_ids = set(Campaign.objects.filter(
+            pk__in={campaign_id for campaign_id, _ in totals if campaign_id}
+        ).values_list('pk', flat=True))
+        totals = {
+            key: total for key, total in totals.items()
+            if key[1] in recipient_ids and (key[0] is None or key[0] in campaign_ids)
+        }
+
+        existing = {
+            (engagement.campaign_id, engagement.recipient_id): engagement
+            for engagement in Engagement.objects.filter(
+                Q(campaign_id__in=campaign_ids) | Q(campaign__isnull=True),
+                recipient_id__in={recipient_id for _, recipient_id in totals},
+            )
+        }
+        created, updated = [], []
+        # Recipients whose first open/click this is, for the A/B variant counters
+        first_opens, first_clicks = set(), set()
+        for (campaign_id, recipient_id), total in totals.items():
+            engagement = existing.get((campaign_id, recipient_id))
+            if total['opens'] and not (engagement and engagement.opens):
+                first_opens.add((campaign_id, recipient_id))
+            if total['clicks'] and not (engagement and engagement.clicks):
+                first_clicks.add((campaign_id, recipient_id))
+            if engagement is None:
+                created.append(Engagement(campaign_id=campaign_id, recipient_id=recipient_id, **total))
+                continue
+            engagement.opens += total['opens']
+            engagement.clicks += total['clicks']
+            engagement.first_opened_at = engagement.first_opened_at or total['first_opened_at']
+            engagement.first_clicked_at = engagement.first_clicked_at or total['first_clicked_at']
+            engagement.last_event_at = total['last_event_at']
+            updated.append(engagement)
+
+        Engagement.objects.bulk_create(created, batch_size=1000)
+        Engagement.objects.bulk_update(
+            updated, ['opens', 'clicks', 'first_opened_at', 'first_clicked_at', 'last_event_at'], batch_size=1000
+        )
+        record_engagement(first_opens, first_clicks)
+        cursor.save(update_fields=['position', 'updated_at'])
+
+    logger.info(f"Rolled up {processed} tracking events into {len(created)} new and {len(updated)} updated engagements")
+    return processed
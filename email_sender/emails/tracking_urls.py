@@ -0,0 +1,9 @@
+from django.urls import path
+from . import tracking
+
+# Open/click tracking. Kept apart from the other URLs so send workers can build
+# tracking links without importing the web UI (see email_sender/worker_urls.py)
+urlpatterns = [
+    path('t/o/<str:token>.gif', tracking.track_open, name='track_open'),
+    path('t/c/<str:token>/', tracking.track_click, name='track_click'),
+]
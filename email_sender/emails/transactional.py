@@ -0,0 +1,184 @@
+import queue
+import smtplib
+import threading
+import time
+import logging
+from django.conf import settings
+from django.core.mail import EmailMultiAlternatives, get_connection
+from django.template import Context
+from .metrics import LatencyHistogram
+from .models import EmailCredential, Tenant
+from .templating import compile_template
+
+logger = logging.getLogger(__name__)
+
+# The active credential is re-read at most this often, so sends need no query
+CREDENTIAL_CACHE_SECONDS = 30
+
+transactional_latency = LatencyHistogram()
+
+
+class PoolExhausted(Exception):
+    """Every connection of a pool stayed busy for the whole acquire() timeout"""
+
+
+class SMTPConnectionPool:
+    """
+    Pool of open SMTP connections for the active credential of one tenant.
+
+    Connections stay open between sends so a transactional message skips the
+    TCP/TLS handshake and login. When the active credential changes, idle
+    connections for the old one are closed and new ones are opened lazily.
+    """
+
+    def __init__(self, size=None, tenant_id=None):
+        self.size = size or getattr(settings, 'TRANSACTIONAL_POOL_SIZE', 4)
+        self.tenant_id = tenant_id
+        self.idle = queue.LifoQueue()
+        self.lock = threading.Lock()
+        self.created = 0
+        self.key = None
+        self.params = None
+        self.from_email = None
+        self.checked_at = 0.0
+
+    def _refresh_credential(self):
+        if self.params is not None and time.monotonic() - self.checked_at < CREDENTIAL_CACHE_SECONDS:
+            return
+
+        credential = EmailCredential.objects.for_tenant(self.tenant_id or Tenant.default_id()).filter(is_active=True).first()
+        if credential:
+            key = (credential.pk, credential.updated_at)
+            params = {
+                'backend': 'django.core.mail.backends.smtp.EmailBackend',
+                'host': credential.email_host,
+                'port': credential.email_port,
+                'username': credential.email_host_user,
+                'password': credential.decrypt_password(),
+                'use_tls': credential.email_use_tls,
+                'use_ssl': credential.email_use_ssl,
+            }
+            from_email = credential.from_email
+        else:
+            key, params, from_email = 'settings', {}, settings.DEFAULT_FROM_EMAIL
+
+        with self.lock:
+            self.checked_at = time.monotonic()
+            if key != self.key:
+                self.key, self.params, self.from_email = key, params, from_email
+                self._close_idle()
+
+    def _close_idle(self):
+        while True:
+            try:
+                connection = self.idle.get_nowait()
+            except queue.Empty:
+                return
+            connection.close()
+            self.created -= 1
+
+    def acquire(self, timeout=5):
+        """
+        Return an open connection and the sender address to use with it.
+
+        Raises PoolExhausted when all ``size`` connections are in use and
+        none is released within ``timeout`` seconds.
+        """
+        self._refresh_credential()
+        try:
+            connection = self.idle.get_nowait()
+        except queue.Empty:
+            with self.lock:
+                can_create = self.created < self.size
+                if can_create:
+                    self.created += 1
+            if can_create:
+                connection = get_connection(fail_silently=False, **self.params)
+                connection.pool_key = self.key
+                try:
+                    connection.open()
+                except Exception:
+                    with self.lock:
+                        self.created -= 1
+                    raise
+            else:
+                try:
+                    connection = self.idle.get(timeout=timeout)
+                except queue.Empty:
+                    raise PoolExhausted(f"All {self.size} SMTP connections stayed busy for {timeout}s")
+        return connection, self.from_email
+
+    def release(self, connection, broken=False):
+        if broken or connection.pool_key != self.key:
+            connection.close()
+            with self.lock:
+                self.created -= 1
+        else:
+            self.idle.put(connection)
+
+    def warm(self):
+        """Open every connection up front, e.g. right after a worker starts"""
+        connections = [self.acquire()[0] for _ in range(self.size)]
+        for connection in connections:
+            self.release(connection)
+
+
+pools = {}
+_pools_lock = threading.Lock()
+
+
+def get_pool(tenant_id=None):
+    """The connection pool of ``tenant_id`` (the default tenant when None), created on first use"""
+    tenant_id = tenant_id or Tenant.default_id()
+    pool = pools.get(tenant_id)
+    if pool is None:
+        with _pools_lock:
+            pool = pools.setdefault(tenant_id, SMTPConnectionPool(tenant_id=tenant_id))
+    return pool
+
+
+def send_transactional(to_email, subject, body, html_body=None, context=None, from_email=None, tenant_id=None):
+    """
+    Send a single transactional email over a pooled, already-open connection.
+
+    Unlike send_bulk_emails this does not load EmailSettings, apply delays or
+    write EmailLog rows. Each tenant has its own pool with its own credential.
+    If the server dropped an idle connection the send is retried once on a
+    fresh one. Every call is recorded in transactional_latency.
+    """
+    started = time.perf_counter()
+    if context:
+        context = Context(context)
+        subject = compile_template(subject).render(context)
+        body = compile_template(body).render(context)
+        if html_body:
+            html_body = compile_template(html_body).render(context)
+
+    pool = get_pool(tenant_id)
+    connection, default_from_email = pool.acquire()
+    try:
+        message = EmailMultiAlternatives(
+            subject=subject,
+            body=body,
+            from_email=from_email or default_from_email,
+            to=[to_email],
+            connection=connection,
+        )
+        if html_body:
+            message.attach_alternative(html_body, 'text/html')
+
+        try:
+            message.send()
+        except smtplib.SMTPServerDisconnected:
+            connection.close()
+            connection.open()
+            message.send()
+    except Exception:
+        pool.release(connection, broken=True)
+        raise
+    else:
+        pool.release(connection)
+    finally:
+        transactional_latency.observe(time.perf_counter() - started)
+
+    logger.info(f"Transactional email sent to {to_email} in {(time.perf_counter() - started) * 1000:.1f}ms")
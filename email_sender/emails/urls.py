@@ -1,17 +1,25 @@
-from django.urls import path
-from . import views
+from django.urls import include, path
+from . import views, api
 
 urlpatterns = [
     path('', views.dashboard, name='dashboard'),
+    path('tenants/switch/', views.switch_tenant, name='switch_tenant'),
     path('recipients/', views.recipient_list, name='recipient_list'),
     path('recipients/add/', views.add_recipient, name='add_recipient'),
     path('recipients/<int:pk>/edit/', views.edit_recipient, name='edit_recipient'),
     path('recipients/<int:pk>/delete/', views.delete_recipient, name='delete_recipient'),
     path('recipients/import/', views.import_recipients, name='import_recipients'),
+    path('recipients/export/', views.export_recipients, name='export_recipients'),
     path('templates/', views.template_list, name='template_list'),
     path('templates/add/', views.add_template, name='add_template'),
     path('compose/', views.compose_email, name='compose_email'),
     path('logs/', views.email_logs, name='email_logs'),
+    path('logs/export/', views.export_logs, name='export_logs'),
+    # Live send progress (server-sent events)
+    path('sends/<str:key>/', views.send_progress, name='send_progress'),
+    path('sends/<str:key>/stream/', views.send_progress_stream, name='send_progress_stream'),
+    path('campaigns/<int:pk>/progress/', views.campaign_progress, name='campaign_progress'),
+    path('campaigns/<int:pk>/progress/stream/', views.campaign_progress_stream, name='campaign_progress_stream'),
     # Email credential management
     path('credentials/', views.credential_list, name='credential_list'),
     path('credentials/add/', views.add_credential, name='add_credential'),
@@ -21,4 +29,15 @@ urlpatterns = [
     path('credentials/<int:pk>/test/', views.test_credential, name='test_credential'),
     # Email settings
     path('settings/', views.email_settings, name='email_settings'),
+    # Open/click tracking
+    path('', include('emails.tracking_urls')),
+    # JSON API
+    path('api/sends/', api.enqueue_sends, name='api_enqueue_sends'),
+    path('api/recipients/bulk/', api.bulk_upsert_recipients, name='api_bulk_upsert_recipients'),
+    path('api/campaigns/', api.campaign_status_batch, name='api_campaign_status_batch'),
+    path('api/campaigns/<int:pk>/', api.campaign_status, name='api_campaign_status'),
+    path('api/attachments/', api.upload_attachment, name='api_upload_attachment'),
+    path('api/queue/', api.queue_status, name='api_queue_status'),
+    path('api/transactional/', api.transactional_send, name='api_transactional_send'),
+    path('api/transactional/metrics/', api.transactional_metrics, name='api_transactional_metrics'),
 ]
\ No newline at end of file
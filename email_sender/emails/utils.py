@@ -1,26 +1,55 @@
+import codecs
 import csv
+import smtplib
+import threading
 import time
-from django.core.mail import send_mail, EmailMessage, get_connection
-from django.template import Template, Context
+import uuid
+from django.core.mail import get_connection
+from django.db import connections
+from django.template import Context, TemplateSyntaxError
 from django.conf import settings
-from .models import Recipient, EmailLog, EmailCredential, EmailSettings
+from django.utils import timezone
+from .models import Campaign, CustomField, Recipient, EmailLog, EmailCredential, EmailSettings, Tenant
+from .logbuffer import EmailLogBuffer
+from .mime import MessageFactory
+from .throttling import DomainThrottle
+from .tracking import Tracker
+from .validation import REJECTED_STATUSES, check_emails
+from .bounces import verp_address
+from .leases import claim_recipients, finish_deliveries
+from .pipeline import Marker, MemoryBudget, Pipeline, Stage
+from .progress import get_progress, start_progress
+from .templating import compile_template, custom_field_name, recipient_context
+from .tenants import release_quota, reserve_quota
 import logging
 
 logger = logging.getLogger(__name__)
 
+# Immediate sends of a campaign claim their deliveries this many recipients at a time
+SEND_CHUNK = 100
+# Lease length of a chunk: a margin plus a generous per-email estimate and the configured delays
+LEASE_MARGIN_SECONDS = 60
+SEND_SECONDS_PER_EMAIL = 5
 
-def get_email_connection():
+_start_lock = threading.Lock()
+
+IMPORT_CHUNK = 1000
+MAX_IMPORT_ERRORS = 100
+
+
+def get_email_connection(tenant=None):
     """
-    Get email connection using active credential from database.
-    Falls back to settings if no active credential exists.
+    Get email connection using the active credential of ``tenant`` (a Tenant or
+    its primary key; the default tenant when omitted) from the database.
+    Falls back to settings if the tenant has no active credential.
     """
     try:
-        active_credential = EmailCredential.objects.filter(is_active=True).first()
+        active_credential = EmailCredential.objects.for_tenant(tenant or Tenant.default_id()).filter(is_active=True).first()
 
         if active_credential:
             # Use database credential
             connection = get_connection(
-                backend='django.core.mail.backends.smtp.EmailBackend',
+                backend='emails.backends.EmailBackend',
                 host=active_credential.email_host,
                 port=active_credential.email_port,
                 username=active_credential.email_host_user,
@@ -40,92 +69,252 @@ def get_email_connection():
 
 def personalize_message(template_text, recipient):
     """Personalize email message with recipient data"""
-    template = Template(template_text)
-    context = Context({
-        'email': recipient.email,
-        'company': recipient.company,
-    })
+    template = compile_template(template_text)
+    context = Context(recipient_context(template_text, recipient))
     return template.render(context)
 
-def send_bulk_emails(subject, body, recipients, template=None, attachments=None):
+def build_personalized_email(connection, from_email, subject, body, recipient, factory, tracker=None):
+    """
+    Build (but do not send) a single already-personalized email.
+
+    With a Tracker, links are rewritten and an HTML part with an open pixel is
+    added (the factory must then be created with html=tracker.opens). The
+    envelope sender is a VERP address when BOUNCE_ADDRESS is configured.
+    """
+    html = None
+    if tracker is not None and tracker.enabled:
+        body, html = tracker.render(body, recipient.pk)
+    return factory.build(
+        recipient.email, subject, body, connection=connection, html=html, envelope_from=verp_address(recipient.email)
+    )
+
+def send_personalized_email(connection, from_email, subject, body, recipient, attachments=None, factory=None,
+                            tracker=None):
+    """
+    Build and send a single already-personalized email.
+
+    Pass a MessageFactory shared by all recipients of a send so the MIME
+    structure and attachments are only encoded once. See
+    build_personalized_email for tracking and the envelope sender.
+    Returns the sent message; its message_id is stored to match bounces.
+    """
+    if factory is None:
+        factory = MessageFactory(from_email, attachments, html=bool(tracker and tracker.opens))
+    email = build_personalized_email(connection, from_email, subject, body, recipient, factory, tracker)
+    email.send(fail_silently=False)
+    return email
+
+def open_connection(connection):
+    """
+    Open ``connection`` for a whole send, so every message reuses one SMTP session.
+
+    Without this the backend opens and closes a session per message. Returns
+    True when this call opened it and the caller has to close() it. A failure
+    is left to the individual sends, which report it per recipient.
+    """
+    if connection is None:
+        # No active credential: the sends use Django's configured backend
+        return False
+    try:
+        return bool(connection.open())
+    except Exception as e:
+        logger.warning(f"Could not open the email connection: {str(e)}")
+        return False
+
+def recover_connection(connection, error):
+    """After the server dropped the session, open a new one for the next messages"""
+    if isinstance(error, (smtplib.SMTPServerDisconnected, ConnectionError)):
+        connection.close()
+        open_connection(connection)
+
+class OutgoingEmail:
+    """One recipient's email as it moves through the stages of send_bulk_emails"""
+    __slots__ = ('recipient', 'delivery_id', 'subject', 'body', 'message', 'message_id', 'size', 'error')
+
+    def __init__(self, recipient, delivery_id=None):
+        self.recipient = recipient
+        self.delivery_id = delivery_id
+        self.subject = self.body = self.message = self.message_id = self.error = None
+        self.size = 0
+
+def send_bulk_emails(subject, body, recipients, template=None, attachments=None, progress=None, campaign=None,
+                     connection=None, from_email=None):
     """
     Send personalized emails to multiple recipients using database credentials.
     Supports attachments and configurable delays between emails.
 
+    The send is a pipeline of stages connected by bounded queues, each in its
+    own thread: fetch recipients (claiming their deliveries) -> render ->
+    build MIME -> transmit -> log. The next messages are rendered and built
+    while the current one is on the wire, and a lagging stage blocks the ones
+    feeding it, at most SEND_PIPELINE_QUEUE_SIZE items ahead. Built messages
+    waiting to be sent are also capped at SEND_PIPELINE_MEMORY_MB in total,
+    so attachment-heavy sends cannot pile up in memory.
+
     Args:
         subject: Email subject line
         body: Email body text
-        recipients: List of Recipient objects
+        recipients: Recipient objects (a list or a queryset)
         template: Optional EmailTemplate object
-        attachments: List of file objects to attach
+        attachments: List of file objects or stored AttachmentRefs to attach
+        progress: Optional SendProgress updated after every email
+        campaign: Optional Campaign (status 'sending') whose Delivery rows are
+            claimed chunk by chunk, so recipients already sent by an earlier
+            or concurrent run of the same campaign are skipped. Chunks are
+            also counted against its tenant's daily quota; once the quota is
+            used up the campaign is queued for the send workers, which send
+            the rest when the quota allows
+        connection, from_email: Optional email connection to send with instead
+            of the active credential (e.g. for load tests)
 
     Returns:
-        Dictionary with 'success', 'failed', and 'errors' counts
+        Dictionary with 'success', 'failed', 'skipped', and 'errors' counts,
+        per-stage queue metrics under 'pipeline', and 'over_quota' when the
+        send stopped at the tenant's daily quota
     """
     results = {
         'success': 0,
         'failed': 0,
-        'errors': []
+        'skipped': 0,
+        'errors': [],
+        'over_quota': False,
     }
 
+    # Parse subject and body once up front: a syntax error fails the whole send
+    # here instead of writing a failed log for every recipient
+    try:
+        compile_template(subject)
+        compile_template(body)
+    except TemplateSyntaxError as e:
+        logger.error(f"Not sending, the template is invalid: {str(e)}")
+        if campaign is not None:
+            Campaign.objects.filter(pk=campaign.pk).update(status='cancelled', completed_at=timezone.now())
+        raise
+
     # Get email connection and from_email
-    connection, from_email = get_email_connection()
+    if connection is None:
+        connection, from_email = get_email_connection(campaign.tenant_id if campaign is not None else None)
+    tenant = campaign.tenant if campaign is not None else None
 
-    # Get email settings for delays and batching
+    # Get email settings for delays and batching. They are re-read from the
+    # in-process cache after every email, so updates take effect immediately.
     email_settings = EmailSettings.get_settings()
 
-    # Convert recipients to list to track index
-    recipients_list = list(recipients)
-    total_recipients = len(recipients_list)
+    if hasattr(recipients, 'iterator') and campaign is not None:
+        # Loaded chunk by chunk by the fetch stage
+        total_recipients = recipients.count()
+    else:
+        recipients = list(recipients)
+        total_recipients = len(recipients)
 
     logger.info(f"Starting bulk email send to {total_recipients} recipients with {email_settings.email_delay}s delay")
 
-    for index, recipient in enumerate(recipients_list, start=1):
+    # Open/click tracking follows the settings at the time the send starts
+    if campaign is not None:
+        tracker = Tracker.for_campaign(campaign)
+    else:
+        tracker = Tracker(opens=email_settings.track_opens, clicks=email_settings.track_clicks)
+
+    # Build the MIME structure and encode attachments once for the whole send
+    factory = MessageFactory(from_email, attachments, html=tracker.opens)
+
+    # Group recipients by destination domain and interleave the domains,
+    # pacing each one according to its (adaptive) limits
+    throttle = DomainThrottle()
+
+    # Logs are written in multi-row batches rather than one INSERT per email
+    log_buffer = EmailLogBuffer()
+
+    # Without a campaign there is nothing to claim and the whole send is one chunk
+    chunk_size = SEND_CHUNK if campaign is not None else max(total_recipients, 1)
+    worker_id = f"immediate-{uuid.uuid4().hex[:12]}"
+    queue_size = getattr(settings, 'SEND_PIPELINE_QUEUE_SIZE', 32)
+    budget = MemoryBudget(getattr(settings, 'SEND_PIPELINE_MEMORY_MB', 256) * 1024 * 1024)
+    transmitted = 0
+    finished = {'sent': [], 'failed': []}
+
+    def fetch():
+        if isinstance(recipients, list):
+            chunks = (recipients[start:start + chunk_size] for start in range(0, total_recipients, chunk_size))
+        else:
+            chunks = _keyset_chunks(recipients, chunk_size)
+        for chunk in chunks:
+            claimed = None
+            if campaign is not None:
+                granted = reserve_quota(tenant, len(chunk))
+                if granted < len(chunk):
+                    results['over_quota'] = True
+                    chunk = chunk[:granted]
+                # One UPDATE and one SELECT for the whole chunk; recipients that are
+                # already sent, failed or leased by another run are left out. The
+                # lease also covers the emails still queued ahead of this chunk.
+                claimed = claim_recipients(
+                    campaign, worker_id, [recipient.pk for recipient in chunk],
+                    lease_seconds=_chunk_lease_seconds(len(chunk) + queue_size * len(stages), email_settings),
+                ) if chunk else {}
+                release_quota(tenant, granted - len(claimed))
+                skipped = len(chunk) - len(claimed)
+                if skipped:
+                    results['skipped'] += skipped
+                    if progress:
+                        progress.record(skipped=skipped)
+                    logger.info(f"Skipping {skipped} recipients already handled for campaign {campaign.pk}")
+                    chunk = [recipient for recipient in chunk if recipient.pk in claimed]
+            for recipient in throttle.schedule(chunk):
+                yield OutgoingEmail(recipient, claimed[recipient.pk] if claimed is not None else None)
+            # Logs of the chunk are written and its deliveries marked once the marker reaches the log stage
+            yield Marker()
+            if results['over_quota']:
+                return
+
+    def render(outgoing):
         try:
-            # Personalize subject and body
-            personalized_subject = personalize_message(subject, recipient)
-            personalized_body = personalize_message(body, recipient)
-
-            # Create and send email message
-            email = EmailMessage(
-                subject=personalized_subject,
-                body=personalized_body,
-                from_email=from_email,
-                to=[recipient.email],
-                connection=connection,
-            )
+            outgoing.subject = personalize_message(subject, outgoing.recipient)
+            outgoing.body = personalize_message(body, outgoing.recipient)
+        except Exception as e:
+            outgoing.error = e
+        return outgoing
 
-            # Attach files if provided
-            attachment_count = 0
-            if attachments:
-                for attachment_file in attachments:
-                    try:
-                        # Read file content
-                        attachment_file.seek(0)  # Reset file pointer
-                        email.attach(
-                            attachment_file.name,
-                            attachment_file.read(),
-                            attachment_file.content_type
-                        )
-                        attachment_count += 1
-                        logger.debug(f"Attached {attachment_file.name} to email for {recipient.email}")
-                    except Exception as attach_error:
-                        logger.warning(f"Failed to attach {attachment_file.name}: {str(attach_error)}")
-
-            # Send the email
-            email.send(fail_silently=False)
-
-            # Log success
-            EmailLog.objects.create(
-                recipient=recipient,
-                template=template,
-                subject=personalized_subject,
-                body=personalized_body,
-                status='sent',
-                has_attachments=(attachment_count > 0),
-                attachment_count=attachment_count
+    def build(outgoing):
+        if outgoing.error is not None:
+            return outgoing
+        try:
+            outgoing.message = build_personalized_email(
+                connection, from_email, outgoing.subject, outgoing.body, outgoing.recipient, factory, tracker
             )
+        except Exception as e:
+            outgoing.error = e
+            return outgoing
+        # Wait here while the messages already built use up the memory budget
+        outgoing.size = outgoing.message.size
+        budget.acquire(outgoing.size, pipeline.stopped)
+        return outgoing
+
+    def transmit(outgoing):
+        nonlocal transmitted, email_settings
+        transmitted += 1
+        index = transmitted + results['skipped']
+        recipient = outgoing.recipient
+        if outgoing.error is None:
+            try:
+                outgoing.message.send(fail_silently=False)
+                throttle.record(recipient.email)
+                outgoing.message_id = outgoing.message.message_id
+            except Exception as e:
+                throttle.record(recipient.email, e)
+                outgoing.error = e
+                if opened:
+                    recover_connection(connection, e)
+            finally:
+                outgoing.message = None
+                budget.release(outgoing.size)
+
+        # Re-read pacing settings (served from cache) so changes apply mid-send
+        email_settings = EmailSettings.get_settings()
+        if outgoing.error is None:
             results['success'] += 1
+            if progress:
+                progress.record(sent=1)
             logger.info(f"Email sent successfully to {recipient.email} ({index}/{total_recipients})")
 
             # Apply delay between emails (except after the last one)
@@ -138,60 +327,233 @@ def send_bulk_emails(subject, body, recipients, template=None, attachments=None)
                 elif email_settings.email_delay > 0:
                     # Regular delay between emails
                     time.sleep(email_settings.email_delay)
+        else:
+            results['failed'] += 1
+            results['errors'].append(f"{recipient.email}: {str(outgoing.error)}")
+            if progress:
+                progress.record(failed=1, error=f"{recipient.email}: {str(outgoing.error)}")
+            logger.error(f"Failed to send email to {recipient.email}: {str(outgoing.error)}")
 
-        except Exception as e:
-            # Log failure
-            EmailLog.objects.create(
-                recipient=recipient,
+            # Still apply delay even after failure to avoid overwhelming the server
+            if index < total_recipients and email_settings.email_delay > 0:
+                time.sleep(email_settings.email_delay)
+        return outgoing
+
+    def log(outgoing):
+        if outgoing.error is None:
+            log_buffer.add(
+                recipient=outgoing.recipient,
                 template=template,
+                campaign=campaign,
+                subject=outgoing.subject,
+                body=outgoing.body,
+                status='sent',
+                message_id=outgoing.message_id,
+                has_attachments=(factory.attachment_count > 0),
+                attachment_count=factory.attachment_count
+            )
+        else:
+            log_buffer.add(
+                recipient=outgoing.recipient,
+                template=template,
+                campaign=campaign,
                 subject=subject,
                 body=body,
                 status='failed',
-                error_message=str(e),
+                error_message=str(outgoing.error),
                 has_attachments=(attachments is not None and len(attachments) > 0),
                 attachment_count=0
             )
-            results['failed'] += 1
-            results['errors'].append(f"{recipient.email}: {str(e)}")
-            logger.error(f"Failed to send email to {recipient.email}: {str(e)}")
+        if outgoing.delivery_id is not None:
+            finished['sent' if outgoing.error is None else 'failed'].append(outgoing.delivery_id)
 
-            # Still apply delay even after failure to avoid overwhelming the server
-            if index < total_recipients and email_settings.email_delay > 0:
-                time.sleep(email_settings.email_delay)
+    def finish_chunk(marker=None):
+        # Logs are written before the deliveries are marked, so a crash in
+        # between can only cause a resend of this chunk, never a lost log
+        log_buffer.flush()
+        for status, delivery_ids in finished.items():
+            finish_deliveries(delivery_ids, worker_id, status)
+            delivery_ids.clear()
+
+    stages = [
+        Stage('render', render),
+        Stage('build', build),
+        Stage('transmit', transmit),
+        Stage('log', log, on_marker=finish_chunk, on_finish=finish_chunk),
+    ]
+    pipeline = Pipeline(stages, queue_size=queue_size, budget=budget)
+    if progress:
+        progress.pipeline = pipeline
+    # One SMTP session for the whole send, closed when the pipeline is done
+    opened = open_connection(connection)
+    try:
+        pipeline.run(fetch())
+    finally:
+        factory.close()
+        if opened:
+            connection.close()
 
-    logger.info(f"Bulk email send completed. Success: {results['success']}, Failed: {results['failed']}")
+    if results['over_quota']:
+        # The rest waits in the queue; send workers pick it up once the quota allows
+        Campaign.objects.filter(pk=campaign.pk, status='sending').update(status='queued')
+        message = f"Tenant {tenant} reached its daily quota; the remaining emails are queued for the send workers"
+        logger.warning(f"Campaign {campaign.pk}: {message}")
+        if progress:
+            progress.record(error=message)
+    elif campaign is not None:
+        _complete_immediate_campaign(campaign)
+    results['pipeline'] = pipeline.metrics()
+    logger.info(f"Bulk email send completed. Success: {results['success']}, Failed: {results['failed']}, Skipped: {results['skipped']}")
+    logger.info(f"Send pipeline metrics: {results['pipeline']}")
     return results
 
-def import_recipients_from_csv(csv_file):
-    """Import recipients from CSV file"""
+def _keyset_chunks(queryset, size):
+    """
+    Yield lists of up to ``size`` objects of ``queryset`` in primary key order.
+
+    Each chunk is its own short query (pk > last pk seen) rather than a
+    server-side cursor held open across chunks; SQLite refuses writes from a
+    connection whose read cursor predates other connections' writes.
+    """
+    queryset = queryset.order_by('pk')
+    last_pk = None
+    while True:
+        chunk = list((queryset if last_pk is None else queryset.filter(pk__gt=last_pk))[:size])
+        if not chunk:
+            return
+        yield chunk
+        last_pk = chunk[-1].pk
+
+def _chunk_lease_seconds(count, email_settings):
+    """How long one chunk of an immediate send may keep its deliveries leased"""
+    per_email = SEND_SECONDS_PER_EMAIL + email_settings.email_delay
+    if email_settings.batch_size > 0:
+        per_email += email_settings.batch_delay / email_settings.batch_size
+    return int(LEASE_MARGIN_SECONDS + count * per_email)
+
+def _complete_immediate_campaign(campaign):
+    """Mark an immediate campaign completed once none of its deliveries are pending"""
+    if not campaign.deliveries.filter(status='pending').exists():
+        Campaign.objects.filter(pk=campaign.pk, status='sending').update(status='completed', completed_at=timezone.now())
+
+def start_background_send(subject, body, recipients, template=None, attachments=None, campaign=None):
+    """
+    Run send_bulk_emails in a background thread and return its progress key.
+
+    The request that starts a send returns immediately, and the send can be
+    followed live through get_progress(key) (see the send progress page).
+    With a campaign the key is its idempotency key, and a send that is still
+    running in this process under that key is not started a second time.
+    A campaign's recipients may be a queryset, which the send then streams.
+    If the process stops before the send is done, send workers finish the
+    campaign (see sharding.resume_interrupted_sends).
+    """
+    if hasattr(recipients, 'iterator') and campaign is not None:
+        total = recipients.count()
+    else:
+        recipients = list(recipients)
+        total = len(recipients)
+    key = campaign.idempotency_key if campaign is not None and campaign.idempotency_key else uuid.uuid4().hex
+    with _start_lock:
+        running = get_progress(key)
+        if running is not None and not running.done:
+            return key
+        send_progress = start_progress(key, total, campaign.tenant_id if campaign is not None else Tenant.default_id())
+
+    def run():
+        try:
+            send_bulk_emails(subject, body, recipients, template, attachments, progress=send_progress, campaign=campaign)
+        except Exception as e:
+            logger.error(f"Background send {key} failed: {str(e)}")
+            send_progress.record(error=str(e))
+        finally:
+            send_progress.finish()
+            connections.close_all()
+
+    # Not a daemon thread, so a server shutdown waits for the send to finish
+    threading.Thread(target=run, name=f'send-{key[:8]}').start()
+    return key
+
+def import_recipients_from_csv(csv_file, tenant=None):
+    """
+    Import recipients from CSV file into ``tenant`` (the default tenant when omitted).
+
+    Columns other than email and company become custom fields, usable in
+    templates as {{ column_name }}. The file is read as a stream and rows are
+    inserted in chunks of IMPORT_CHUNK, with one batch validation, one lookup
+    and one multi-row INSERT per chunk. Addresses are deduplicated on their
+    normalized form; invalid addresses and domains without a mail server are
+    rejected, role and disposable addresses are imported but flagged.
+    Addresses that already exist in the tenant are reported and left as they are.
+    """
+    tenant_id = tenant.pk if tenant is not None else Tenant.default_id()
     results = {
         'success': 0,
         'failed': 0,
         'errors': []
     }
-    
+
     try:
-        decoded_file = csv_file.read().decode('utf-8').splitlines()
-        reader = csv.DictReader(decoded_file)
-        
+        reader = csv.DictReader(codecs.iterdecode(csv_file, 'utf-8-sig'))
+        custom_columns = {}
+        for header in reader.fieldnames or []:
+            name = custom_field_name(header)
+            if header.strip().lower() not in ('email', 'company') and name:
+                custom_columns[header] = name
+        CustomField.register(set(custom_columns.values()), tenant_id)
+
+        chunk = []
         for row in reader:
-            try:
-                recipient, created = Recipient.objects.get_or_create(
-                    email=row['email'],
-                    defaults={
-                        'company': row.get('company', ''),
-                    }
-                )
-                if created:
-                    results['success'] += 1
-                else:
-                    results['failed'] += 1
-                    results['errors'].append(f"{row['email']} already exists")
-            except Exception as e:
-                results['failed'] += 1
-                results['errors'].append(f"Error importing {row.get('email', 'unknown')}: {str(e)}")
-    
+            email = (row.get('email') or '').strip()
+            if not email:
+                _import_error(results, f"Row {reader.line_num}: missing email")
+                continue
+            chunk.append(Recipient(
+                tenant_id=tenant_id,
+                email=email,
+                company=(row.get('company') or '').strip()[:200],
+                custom_fields={
+                    name: row[header].strip() for header, name in custom_columns.items() if (row.get(header) or '').strip()
+                },
+            ))
+            if len(chunk) >= IMPORT_CHUNK:
+                _import_chunk(chunk, results, tenant_id)
+                chunk = []
+        if chunk:
+            _import_chunk(chunk, results, tenant_id)
+
     except Exception as e:
         results['errors'].append(f"File processing error: {str(e)}")
-    
-    return results
\ No newline at end of file
+
+    return results
+
+def _import_chunk(chunk, results, tenant_id):
+    """Validate a chunk of new recipients in one batch and insert the new, valid ones"""
+    accepted = {}
+    for recipient, check in zip(chunk, check_emails([recipient.email for recipient in chunk])):
+        if check.status in REJECTED_STATUSES:
+            _import_error(results, f"{recipient.email}: {check.reason}")
+        elif check.normalized in accepted:
+            _import_error(results, f"{recipient.email} already exists")
+        else:
+            recipient.email = check.email
+            recipient.email_normalized = check.normalized
+            recipient.email_check = check.status
+            accepted[check.normalized] = recipient
+
+    existing = set(
+        Recipient.objects.for_tenant(tenant_id).filter(email_normalized__in=accepted)
+        .values_list('email_normalized', flat=True)
+    )
+    for normalized in existing:
+        _import_error(results, f"{accepted[normalized].email} already exists")
+    Recipient.objects.bulk_create(
+        [recipient for normalized, recipient in accepted.items() if normalized not in existing],
+        ignore_conflicts=True,
+    )
+    results['success'] += len(accepted) - len(existing)
+
+def _import_error(results, error):
+    results['failed'] += 1
+    if len(results['errors']) < MAX_IMPORT_ERRORS:
+        results['errors'].append(error)
@@ -0,0 +1,170 @@
+import socket
+import threading
+import time
+import logging
+from collections import namedtuple
+from concurrent.futures import ThreadPoolExecutor
+from django.conf import settings
+from django.core.exceptions import ValidationError
+from django.core.validators import EmailValidator
+
+try:
+    import dns.resolver
+except ImportError:
+    dns = None
+
+logger = logging.getLogger(__name__)
+
+EmailCheck = namedtuple('EmailCheck', ['email', 'normalized', 'status', 'reason'])
+
+# Statuses that keep an address out of the recipient list; role and disposable
+# addresses are imported but flagged
+REJECTED_STATUSES = {'invalid', 'no_mx'}
+
+ROLE_LOCAL_PARTS = frozenset({
+    'abuse', 'admin', 'administrator', 'billing', 'contact', 'help', 'hostmaster', 'info', 'mailer-daemon',
+    'marketing', 'no-reply', 'noreply', 'office', 'postmaster', 'root', 'sales', 'security', 'support',
+    'team', 'webmaster',
+})
+DISPOSABLE_DOMAINS = frozenset({
+    '10minutemail.com', 'discard.email', 'dispostable.com', 'fakeinbox.com', 'getnada.com',
+    'guerrillamail.com', 'guerrillamail.net', 'mailinator.com', 'maildrop.cc', 'mailnesia.com',
+    'mintemail.com', 'mohmal.com', 'sharklasers.com', 'temp-mail.org', 'tempmail.com', 'throwawaymail.com',
+    'trashmail.com', 'yopmail.com',
+})
+
+MX_CACHE_SECONDS = 3600
+MX_LOOKUP_WORKERS = 16
+
+_validator = EmailValidator()
+
+
+def normalize_email(email):
+    """
+    The key recipients are deduplicated on: trimmed, lowercased, IDNA domain.
+
+    'Foo@Example.com ' and 'foo@example.com' normalize to the same key.
+    Provider-specific rewriting (dots or +tags at Gmail) is deliberately not
+    applied, since those are different mailboxes elsewhere.
+    """
+    local, at, domain = (email or '').strip().rpartition('@')
+    if not at:
+        return domain.lower()
+    domain = domain.rstrip('.').lower()
+    try:
+        domain = domain.encode('idna').decode('ascii')
+    except UnicodeError:
+        pass
+    return f'{local.lower()}@{domain}'
+
+
+def _has_mail_server(domain):
+    """Whether ``domain`` accepts mail: an MX record, or an address record as implicit MX"""
+    if dns is not None:
+        try:
+            dns.resolver.resolve(domain, 'MX', lifetime=5)
+            return True
+        except (dns.resolver.NXDOMAIN, dns.resolver.NoNameservers):
+            return False
+        except dns.resolver.NoAnswer:
+            pass
+        except dns.exception.DNSException:
+            return True
+    try:
+        socket.getaddrinfo(domain, 25, proto=socket.IPPROTO_TCP)
+        return True
+    except socket.gaierror as e:
+        # Only a definite "no such name" rejects an address; timeouts do not
+        return e.errno not in (socket.EAI_NONAME, getattr(socket, 'EAI_NODATA', socket.EAI_NONAME))
+
+
+class MxResolver:
+    """
+    Cached, concurrent mail server lookups.
+
+    Each distinct domain of a batch is resolved once, in parallel, and the
+    answer is cached for ``ttl`` seconds. ``lookup`` is a callable taking a
+    domain and returning a bool; it defaults to DNS (dnspython when installed,
+    otherwise the system resolver) and can be replaced with a local stub.
+    """
+
+    def __init__(self, lookup=None, ttl=MX_CACHE_SECONDS, workers=MX_LOOKUP_WORKERS):
+        self.lookup = lookup or _has_mail_server
+        self.ttl = ttl
+        self.workers = workers
+        self.cache = {}
+        self.lock = threading.Lock()
+
+    def _safe_lookup(self, domain):
+        try:
+            return self.lookup(domain)
+        except Exception as e:
+            logger.warning(f"MX lookup for {domain} failed: {str(e)}")
+            return True
+
+    def check(self, domains):
+        """Return {domain: accepts mail} for ``domains``"""
+        now = time.monotonic()
+        results, missing = {}, []
+        with self.lock:
+            for domain in set(domains):
+                cached = self.cache.get(domain)
+                if cached and cached[1] > now:
+                    results[domain] = cached[0]
+                else:
+                    missing.append(domain)
+        if missing:
+            with ThreadPoolExecutor(max_workers=min(self.workers, len(missing))) as pool:
+                answers = dict(zip(missing, pool.map(self._safe_lookup, missing)))
+            with self.lock:
+                for domain, answer in answers.items():
+                    self.cache[domain] = (answer, now + self.ttl)
+            results.update(answers)
+        return results
+
+
+mx_resolver = MxResolver()
+
+
+def check_emails(emails, check_mx=None, resolver=None):
+    """
+    Normalize and classify a batch of addresses, returning one EmailCheck per input.
+
+    Status is 'ok', 'role', 'disposable', 'invalid' (bad syntax) or 'no_mx'
+    (the domain has no mail server; only checked with ``check_mx``, which
+    defaults to settings.EMAIL_CHECK_MX). Domain-level checks run once per
+    distinct domain of the batch, so a chunk of thousands of addresses at a
+    few providers costs a handful of lookups.
+    """
+    if check_mx is None:
+        check_mx = getattr(settings, 'EMAIL_CHECK_MX', False)
+    disposable = DISPOSABLE_DOMAINS | set(getattr(settings, 'DISPOSABLE_EMAIL_DOMAINS', []))
+
+    parsed = []
+    for email in emails:
+        email = (email or '').strip()
+        normalized = normalize_email(email)
+        try:
+            _validator(normalized)
+        except ValidationError:
+            parsed.append((email, normalized, None, None))
+            continue
+        local, _, domain = normalized.rpartition('@')
+        parsed.append((email, normalized, local, domain))
+
+    domains = {domain for _, _, _, domain in parsed if domain}
+    mail_servers = (resolver or mx_resolver).check(domains - disposable) if check_mx else {}
+
+    results = []
+    for email, normalized, local, domain in parsed:
+        if domain is None:
+            results.append(EmailCheck(email, normalized, 'invalid', 'Invalid email address'))
+        elif domain in disposable:
+            results.append(EmailCheck(email, normalized, 'disposable', 'Disposable email domain'))
+        elif not mail_servers.get(domain, True):
+            results.append(EmailCheck(email, normalized, 'no_mx', f'{domain} does not accept email'))
+        elif local.split('+', 1)[0] in ROLE_LOCAL_PARTS:
+            results.append(EmailCheck(email, normalized, 'role', 'Role address'))
+        else:
+            results.append(EmailCheck(email, normalized, 'ok', ''))
+    return results
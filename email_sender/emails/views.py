@@ -1,17 +1,43 @@
+import asyncio
+import json
+import time
+import uuid
+from datetime import timedelta
+from asgiref.sync import sync_to_async
 from django.shortcuts import render, redirect, get_object_or_404
 from django.contrib import messages
+from django.core.handlers.asgi import ASGIRequest
 from django.db.models import Q, Count
-from .models import Recipient, EmailTemplate, EmailLog, EmailCredential, EmailSettings
+from django.http import Http404, HttpResponseBadRequest, StreamingHttpResponse
+from django.urls import reverse
+from django.utils import timezone
+from .models import Recipient, CustomField, EmailTemplate, EmailLog, EmailCredential, EmailSettings, Campaign
 from .forms import RecipientForm, EmailTemplateForm, SendEmailForm, BulkRecipientForm, EmailCredentialForm, EmailSettingsForm
-from .utils import send_bulk_emails, import_recipients_from_csv
+from .utils import start_background_send, import_recipients_from_csv
+from .sharding import get_or_create_campaign
+from .abtest import DEFAULT_TEST_PERCENT, DEFAULT_TEST_WAIT_MINUTES, winner_tracking
+from .attachments import campaign_attachment_refs, store_upload
+from .exports import FORMATS, async_chunks, export_chunks, log_export, recipient_export
+from .progress import campaign_snapshot, get_progress
+from .simulation import simulate_send
+from .templating import recipient_fields
+from .tenants import SESSION_KEY, accessible_tenants, quota_status
+
+# How often progress streams push counters; queued campaigns are read from the database
+PROGRESS_INTERVAL_SECONDS = 0.5
+CAMPAIGN_PROGRESS_INTERVAL_SECONDS = 2.0
+# Recipients rendered by the compose page's Estimate button
+COMPOSE_SIMULATION_SAMPLE = 200
 
 def dashboard(request):
-    total_recipients = Recipient.objects.count()
-    total_templates = EmailTemplate.objects.count()
-    total_sent = EmailLog.objects.filter(status='sent').count()
-    total_failed = EmailLog.objects.filter(status='failed').count()
+    tenant = request.tenant
+    logs = EmailLog.objects.for_tenant(tenant)
+    total_recipients = Recipient.objects.for_tenant(tenant).count()
+    total_templates = EmailTemplate.objects.for_tenant(tenant).count()
+    total_sent = logs.filter(status='sent').count()
+    total_failed = logs.filter(status='failed').count()
     
-    recent_logs = EmailLog.objects.all()[:10]
+    recent_logs = logs[:10]
     
     context = {
         'total_recipients': total_recipients,
@@ -19,11 +45,23 @@ def dashboard(request):
         'total_sent': total_sent,
         'total_failed': total_failed,
         'recent_logs': recent_logs,
+        'quota': quota_status(tenant),
     }
     return render(request, 'emails/dashboard.html', context)
 
+def switch_tenant(request):
+    """Make another tenant the current one for this session"""
+    if request.method == 'POST':
+        tenant = accessible_tenants(request.user).filter(pk=request.POST.get('tenant')).first()
+        if tenant is None:
+            messages.error(request, 'You do not have access to that tenant.')
+        else:
+            request.session[SESSION_KEY] = tenant.pk
+            messages.success(request, f'Switched to {tenant}.')
+    return redirect('dashboard')
+
 def recipient_list(request):
-    recipients = Recipient.objects.all()
+    recipients = Recipient.objects.for_tenant(request.tenant)
     search = request.GET.get('search', '')
     
     if search:
@@ -37,13 +75,13 @@ def recipient_list(request):
 
 def add_recipient(request):
     if request.method == 'POST':
-        form = RecipientForm(request.POST)
+        form = RecipientForm(request.POST, tenant=request.tenant)
         if form.is_valid():
             form.save()
             messages.success(request, 'Recipient added successfully!')
             return redirect('recipient_list')
     else:
-        form = RecipientForm()
+        form = RecipientForm(tenant=request.tenant)
     
     return render(request, 'emails/recipient_form.html', {'form': form})
 
@@ -51,7 +89,7 @@ def import_recipients(request):
     if request.method == 'POST':
         form = BulkRecipientForm(request.POST, request.FILES)
         if form.is_valid():
-            results = import_recipients_from_csv(request.FILES['csv_file'])
+            results = import_recipients_from_csv(request.FILES['csv_file'], request.tenant)
             messages.success(request, f"Imported {results['success']} recipients. Failed: {results['failed']}")
             if results['errors']:
                 for error in results['errors'][:5]:
@@ -63,50 +101,102 @@ def import_recipients(request):
     return render(request, 'emails/import_recipients.html', {'form': form})
 
 def template_list(request):
-    templates = EmailTemplate.objects.all()
+    templates = EmailTemplate.objects.for_tenant(request.tenant)
     return render(request, 'emails/template_list.html', {'templates': templates})
 
 def add_template(request):
     if request.method == 'POST':
-        form = EmailTemplateForm(request.POST)
+        form = EmailTemplateForm(request.POST, tenant=request.tenant)
         if form.is_valid():
             form.save()
             messages.success(request, 'Template created successfully!')
             return redirect('template_list')
     else:
-        form = EmailTemplateForm()
+        form = EmailTemplateForm(tenant=request.tenant)
     
-    return render(request, 'emails/template_form.html', {'form': form})
+    return render(request, 'emails/template_form.html', {'form': form, 'custom_fields': CustomField.names(request.tenant)})
 
 def compose_email(request):
     if request.method == 'POST':
-        form = SendEmailForm(request.POST, request.FILES)
+        form = SendEmailForm(request.POST, request.FILES, tenant=request.tenant)
         if form.is_valid():
             subject = form.cleaned_data['subject']
             body = form.cleaned_data['body']
             recipients = form.cleaned_data['recipients']
             template = form.cleaned_data.get('template')
-            attachments = request.FILES.getlist('attachments')
-
-            if form.cleaned_data['send_immediately']:
-                results = send_bulk_emails(subject, body, recipients, template, attachments)
-
-                # Success message with attachment info
-                attachment_info = f" with {len(attachments)} attachment(s)" if attachments else ""
-                messages.success(request, f"Sent {results['success']} emails{attachment_info}. Failed: {results['failed']}")
 
-                if results['errors']:
-                    for error in results['errors'][:5]:
-                        messages.error(request, error)
+            if request.POST.get('dry_run'):
+                # Render a sample against a null transport; nothing is stored, sent or logged
+                simulation = simulate_send(subject, body, recipients, request.FILES.getlist('attachments'),
+                                           sample=COMPOSE_SIMULATION_SAMPLE)
+                simulation['projected'] = timedelta(seconds=round(simulation['projected_seconds']))
+                simulation['delays'] = timedelta(seconds=round(simulation['delay_seconds']))
+                simulation['slowest_domain_time'] = timedelta(seconds=round(simulation['slowest_domain_seconds']))
+                return render(request, 'emails/compose.html', {
+                    'form': form, 'custom_fields': CustomField.names(request.tenant), 'simulation': simulation,
+                })
+
+            # Uploads were spooled to disk; move them into the deduplicating store
+            attachments = [store_upload(upload, request.tenant.pk) for upload in request.FILES.getlist('attachments')]
+
+            # The key rendered into the form makes a resubmitted or double-clicked
+            # post find its first campaign instead of sending everything again
+            key = form.cleaned_data['idempotency_key'] or uuid.uuid4().hex
+
+            if form.cleaned_data['variant_templates']:
+                # A/B tests wait for results between the test and the rest, so send workers deliver them
+                variants = [{'subject': subject, 'body': body, 'template': template}] + [
+                    {'subject': variant.subject, 'body': variant.body, 'template': variant}
+                    for variant in form.cleaned_data['variant_templates']
+                ]
+                test_wait = form.cleaned_data['test_wait_minutes']
+                winner_metric = form.cleaned_data['winner_metric'] or 'opens'
+                campaign, created = get_or_create_campaign(
+                    key, subject, body, recipients, template, attachments=attachments, variants=variants,
+                    test_percent=form.cleaned_data['test_percent'] or DEFAULT_TEST_PERCENT,
+                    winner_metric=winner_metric,
+                    test_wait_minutes=DEFAULT_TEST_WAIT_MINUTES if test_wait is None else test_wait,
+                    tenant=request.tenant, **winner_tracking(winner_metric),
+                )
+                if created:
+                    messages.success(request, f"Queued A/B test campaign #{campaign.pk} with {len(variants)} variants. Run the send_worker command to deliver it.")
+                return redirect('campaign_progress', pk=campaign.pk)
 
-            return redirect('dashboard')
+            if form.cleaned_data['send_immediately']:
+                # Send in the background and follow it live, so the request returns at once
+                campaign, created = get_or_create_campaign(
+                    key, subject, body, recipients, template, attachments=attachments, status='sending',
+                    tenant=request.tenant,
+                )
+                running = get_progress(key, request.tenant)
+                if campaign.status == 'sending' and (created or running is None or running.done):
+                    # A repeated post of an interrupted send resumes it; recipients
+                    # that were already sent are skipped
+                    campaign_recipients = Recipient.objects.filter(delivery__campaign=campaign).only(
+                        *recipient_fields(campaign.subject, campaign.body)
+                    )
+                    start_background_send(
+                        campaign.subject, campaign.body, campaign_recipients, campaign.template,
+                        campaign_attachment_refs(campaign), campaign=campaign,
+                    )
+                elif campaign.status != 'sending':
+                    return redirect('campaign_progress', pk=campaign.pk)
+                return redirect('send_progress', key=key)
+
+            # Queue the campaign for the send_worker processes
+            campaign, created = get_or_create_campaign(
+                key, subject, body, recipients, template, attachments=attachments, tenant=request.tenant,
+            )
+            if created:
+                messages.success(request, f"Queued {campaign.deliveries.count()} emails as campaign #{campaign.pk}. Run the send_worker command to deliver them.")
+            return redirect('campaign_progress', pk=campaign.pk)
     else:
-        form = SendEmailForm()
+        form = SendEmailForm(initial={'idempotency_key': uuid.uuid4().hex}, tenant=request.tenant)
 
-    return render(request, 'emails/compose.html', {'form': form})
+    return render(request, 'emails/compose.html', {'form': form, 'custom_fields': CustomField.names(request.tenant)})
 
 def email_logs(request):
-    logs = EmailLog.objects.all()
+    logs = EmailLog.objects.for_tenant(request.tenant)
     status_filter = request.GET.get('status', '')
     
     if status_filter:
@@ -115,8 +205,29 @@ def email_logs(request):
     context = {'logs': logs, 'status_filter': status_filter}
     return render(request, 'emails/email_logs.html', context)
 
+def _export_response(request, export, name):
+    export_format = request.GET.get('format', 'csv')
+    try:
+        columns, rows = export(request.GET, request.tenant)
+        chunks = export_chunks(export_format, columns, rows)
+    except ValueError as e:
+        return HttpResponseBadRequest(str(e))
+    if isinstance(request, ASGIRequest):
+        chunks = async_chunks(chunks)
+    response = StreamingHttpResponse(chunks, content_type=FORMATS[export_format])
+    response['Content-Disposition'] = f'attachment; filename="{name}-{timezone.now():%Y%m%d-%H%M%S}.{export_format}"'
+    return response
+
+def export_recipients(request):
+    """Stream recipients as CSV or NDJSON: /recipients/export/?format=ndjson&suppressed=no"""
+    return _export_response(request, recipient_export, 'recipients')
+
+def export_logs(request):
+    """Stream email logs as CSV or NDJSON: /logs/export/?status=failed&since=2025-01-01"""
+    return _export_response(request, log_export, 'email-logs')
+
 def delete_recipient(request, pk):
-    recipient = get_object_or_404(Recipient, pk=pk)
+    recipient = get_object_or_404(Recipient.objects.for_tenant(request.tenant), pk=pk)
     if request.method == 'POST':
         recipient.delete()
         messages.success(request, f'Recipient {recipient.email} deleted successfully!')
@@ -124,7 +235,7 @@ def delete_recipient(request, pk):
     return redirect('recipient_list')
 
 def edit_recipient(request, pk):
-    recipient = get_object_or_404(Recipient, pk=pk)
+    recipient = get_object_or_404(Recipient.objects.for_tenant(request.tenant), pk=pk)
     if request.method == 'POST':
         form = RecipientForm(request.POST, instance=recipient)
         if form.is_valid():
@@ -138,9 +249,9 @@ def edit_recipient(request, pk):
 
 
 def credential_list(request):
-    """Display all email credentials"""
-    credentials = EmailCredential.objects.all()
-    active_credential = EmailCredential.objects.filter(is_active=True).first()
+    """Display the current tenant's email credentials"""
+    credentials = EmailCredential.objects.for_tenant(request.tenant)
+    active_credential = credentials.filter(is_active=True).first()
 
     context = {
         'credentials': credentials,
@@ -152,7 +263,7 @@ def credential_list(request):
 def add_credential(request):
     """Add a new email credential"""
     if request.method == 'POST':
-        form = EmailCredentialForm(request.POST)
+        form = EmailCredentialForm(request.POST, tenant=request.tenant)
         if form.is_valid():
             # Check if password was provided
             if not form.cleaned_data.get('password'):
@@ -163,14 +274,14 @@ def add_credential(request):
             messages.success(request, 'Email credential added successfully!')
             return redirect('credential_list')
     else:
-        form = EmailCredentialForm()
+        form = EmailCredentialForm(tenant=request.tenant)
 
     return render(request, 'emails/credential_form.html', {'form': form})
 
 
 def edit_credential(request, pk):
     """Edit an existing email credential"""
-    credential = get_object_or_404(EmailCredential, pk=pk)
+    credential = get_object_or_404(EmailCredential.objects.for_tenant(request.tenant), pk=pk)
 
     if request.method == 'POST':
         form = EmailCredentialForm(request.POST, instance=credential)
@@ -191,7 +302,7 @@ def edit_credential(request, pk):
 
 def delete_credential(request, pk):
     """Delete an email credential"""
-    credential = get_object_or_404(EmailCredential, pk=pk)
+    credential = get_object_or_404(EmailCredential.objects.for_tenant(request.tenant), pk=pk)
 
     if request.method == 'POST':
         credential_name = credential.name
@@ -203,12 +314,12 @@ def delete_credential(request, pk):
 
 
 def activate_credential(request, pk):
-    """Set a credential as active"""
-    credential = get_object_or_404(EmailCredential, pk=pk)
+    """Set a credential as the tenant's active one"""
+    credential = get_object_or_404(EmailCredential.objects.for_tenant(request.tenant), pk=pk)
 
     if request.method == 'POST':
-        # Deactivate all other credentials
-        EmailCredential.objects.filter(is_active=True).update(is_active=False)
+        # Deactivate the tenant's other credentials
+        EmailCredential.objects.for_tenant(request.tenant).filter(is_active=True).update(is_active=False)
         # Activate this one
         credential.is_active = True
         credential.save()
@@ -219,7 +330,7 @@ def activate_credential(request, pk):
 
 def test_credential(request, pk):
     """Test an email credential by sending a test email"""
-    credential = get_object_or_404(EmailCredential, pk=pk)
+    credential = get_object_or_404(EmailCredential.objects.for_tenant(request.tenant), pk=pk)
 
     if request.method == 'POST':
         try:
@@ -271,4 +382,101 @@ def email_settings(request):
         'form': form,
         'settings': settings,
     }
-    return render(request, 'emails/email_settings.html', context)
\ No newline at end of file
+    return render(request, 'emails/email_settings.html', context)
+
+
+def send_progress(request, key):
+    if get_progress(key, request.tenant) is None:
+        # Sent by another process, or before a restart: show the campaign's stored progress
+        campaign = Campaign.objects.for_tenant(request.tenant).filter(idempotency_key=key).only('pk').first()
+        if campaign is None:
+            raise Http404('Unknown send')
+        return redirect('campaign_progress', pk=campaign.pk)
+    return render(request, 'emails/send_progress.html', {
+        'title': 'Sending emails',
+        'stream_url': reverse('send_progress_stream', args=[key]),
+    })
+
+
+def campaign_progress(request, pk):
+    campaign = get_object_or_404(Campaign.objects.for_tenant(request.tenant), pk=pk)
+    return render(request, 'emails/send_progress.html', {
+        'title': f'Campaign: {campaign}',
+        'campaign': campaign,
+        'stream_url': reverse('campaign_progress_stream', args=[pk]),
+    })
+
+
+def _progress_event(data, last):
+    """The server-sent event for one snapshot, and the payload the next snapshot is compared with"""
+    if data is None:
+        return 'event: missing\ndata: {}\n\n', None
+    payload = json.dumps(data)
+    # Unchanged counters are sent as a comment, which keeps proxies from closing the stream
+    return (f'data: {payload}\n\n' if payload != last else ': waiting\n\n'), payload
+
+
+def _progress_events(snapshot, interval):
+    """Server-sent events with the latest counters until the send is done"""
+    last = None
+    while True:
+        data = snapshot()
+        event, last = _progress_event(data, last)
+        yield event
+        if data is None or data['done']:
+            return
+        time.sleep(interval)
+
+
+async def _async_progress_events(snapshot, interval, queries=True):
+    """
+    _progress_events for ASGI servers, where waiting for the next snapshot holds no thread.
+
+    With ``queries`` the snapshot runs in the thread that owns the database
+    connection; in-memory snapshots are taken directly.
+    """
+    if queries:
+        snapshot = sync_to_async(snapshot, thread_sensitive=True)
+    last = None
+    while True:
+        data = await snapshot() if queries else snapshot()
+        event, last = _progress_event(data, last)
+        yield event
+        if data is None or data['done']:
+            return
+        await asyncio.sleep(interval)
+
+
+def _event_stream_response(request, snapshot, interval, queries=True):
+    """
+    Stream ``snapshot()`` every ``interval`` seconds as server-sent events.
+
+    Each kind of server gets the iterator it can flush event by event: WSGI
+    servers read an async iterator to the end before sending any of it, and
+    ASGI servers do the same with a synchronous one. Under WSGI an open
+    progress page holds a worker thread until its send is done; under ASGI
+    (see gunicorn.conf.py) it holds none.
+    """
+    if isinstance(request, ASGIRequest):
+        events = _async_progress_events(snapshot, interval, queries)
+    else:
+        events = _progress_events(snapshot, interval)
+    response = StreamingHttpResponse(events, content_type='text/event-stream')
+    response['Cache-Control'] = 'no-cache'
+    response['X-Accel-Buffering'] = 'no'
+    return response
+
+
+def send_progress_stream(request, key):
+    """Stream the in-memory counters of a send started from the compose page"""
+    send = get_progress(key, request.tenant)
+    if send is None:
+        raise Http404('Unknown send')
+    return _event_stream_response(request, send.snapshot, PROGRESS_INTERVAL_SECONDS, queries=False)
+
+
+def campaign_progress_stream(request, pk):
+    """Stream the progress of a queued campaign delivered by send_worker"""
+    if not Campaign.objects.for_tenant(request.tenant).filter(pk=pk).exists():
+        raise Http404('Unknown campaign')
+    return _event_stream_response(request, lambda: campaign_snapshot(pk), CAMPAIGN_PROGRESS_INTERVAL_SECONDS)
@@ -0,0 +1,26 @@
+"""
+Gunicorn settings, read when gunicorn is started from this directory:
+
+    gunicorn
+
+Workers are uvicorn's, serving email_sender.asgi, so open progress pages
+wait for their next event without holding a thread each.
+
+With preload_app the app is imported once in the master and the workers are
+forked from it, so they start at once and share the imported code's memory
+copy-on-write. Database connections, buffers' flush threads and SMTP pools
+are all created on first use, so every forked worker gets its own.
+"""
+from decouple import config
+
+wsgi_app = 'email_sender.asgi:application'
+worker_class = 'uvicorn.workers.UvicornWorker'
+bind = config('GUNICORN_BIND', default='127.0.0.1:8000')
+workers = config('WEB_CONCURRENCY', default=2, cast=int)
+preload_app = True
+
+# Sends started from the compose page run in threads of the worker that took
+# the request, so workers are not recycled after a number of requests, and a
+# stopping worker gets this long to finish its sends before it is killed.
+# Sends cut short anyway are finished by send_worker once their leases expire.
+graceful_timeout = config('GUNICORN_GRACEFUL_TIMEOUT', default=600, cast=int)